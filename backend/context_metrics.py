@@ -0,0 +1,192 @@
+"""
+Context Metrics - Analisi contestuali precalcolate
+==================================================
+Metriche di contesto avversari (difficoltà calendario, goal quality index,
+split vs top/bottom team) per TUTTI i giocatori di una stagione, calcolate in
+un'unica passata vettoriale dopo ogni ETL e salvate in player_context_metrics:
+
+- ELO e forma dell'avversario per ogni match con lo stesso merge_asof del
+  modello di valutazione (ultima riga team_performance con data <= match);
+- aggregazioni per giocatore con groupby, nessun loop per riga;
+- lo storico partita per partita è salvato come JSONB accanto al riepilogo.
+
+/analytics/player/{name}/context diventa una lettura per chiave e
+/analytics/league/toughest-schedules una ORDER BY sulla stessa tabella.
+
+Uso:
+    python context_metrics.py --season 2025
+"""
+
+import argparse
+import json
+import os
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from team_keys import team_season_code
+from valuation_engine_v3 import attach_opponent_elo, copy_frame
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', 'data-processing', '.env'))
+
+DEFAULT_ELO = 1500.0
+TOP_TEAM_ELO = 1600      # Gol vs squadre con ELO >= soglia
+BOTTOM_TEAM_ELO = 1450   # Gol vs squadre con ELO <= soglia
+
+# team_performance -> colonne per match
+OPPONENT_COLUMNS = {
+    'elo': 'opponent_elo',
+    'rolling_xg_form': 'opponent_attack_form',
+    'rolling_ga_form': 'opponent_defense_form',
+}
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS player_context_metrics (
+        player_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        player_name TEXT NOT NULL,
+        team_id TEXT,
+        matches_analyzed INTEGER NOT NULL,
+        total_goals INTEGER NOT NULL,
+        total_xg DOUBLE PRECISION NOT NULL,
+        avg_opponent_elo DOUBLE PRECISION NOT NULL,
+        difficulty_score DOUBLE PRECISION NOT NULL,
+        goal_quality_index DOUBLE PRECISION NOT NULL,
+        fair_value_difficulty_adj DOUBLE PRECISION NOT NULL,
+        top_team_goals INTEGER NOT NULL,
+        bottom_team_goals INTEGER NOT NULL,
+        top_bottom_ratio DOUBLE PRECISION NOT NULL,
+        match_history JSONB NOT NULL,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (player_id, season)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_player_context_metrics_name ON player_context_metrics (season, player_name)",
+    "CREATE INDEX IF NOT EXISTS ix_player_context_metrics_difficulty ON player_context_metrics (season, avg_opponent_elo DESC)",
+]
+
+METRIC_COLUMNS = [
+    'player_id', 'season', 'player_name', 'team_id', 'matches_analyzed', 'total_goals', 'total_xg',
+    'avg_opponent_elo', 'difficulty_score', 'goal_quality_index', 'fair_value_difficulty_adj',
+    'top_team_goals', 'bottom_team_goals', 'top_bottom_ratio', 'match_history',
+]
+
+
+def get_engine():
+    db_password = os.getenv('DB_PASSWORD')
+    encoded_password = urllib.parse.quote_plus(db_password)
+    return create_engine(f"postgresql://{os.getenv('DB_USER')}:{encoded_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+
+
+def load_matches(engine, season: str) -> pd.DataFrame:
+    query = text("""
+        SELECT player_id, player_name, team_id, match_date, opponent, goals, xg
+        FROM v_full_match_stats
+        WHERE season = :season AND minutes > 0
+    """)
+    return pd.read_sql(query, engine, params={"season": str(season)})
+
+
+def load_team_context(engine, season: str) -> pd.DataFrame:
+    query = text("""
+        SELECT team_id, match_date, elo, rolling_xg_form, rolling_ga_form
+        FROM team_performance
+        WHERE season = :season
+    """)
+    try:
+        return pd.read_sql(query, engine, params={"season": team_season_code(season)})
+    except Exception:
+        return pd.DataFrame(columns=['team_id', 'match_date'] + list(OPPONENT_COLUMNS))
+
+
+def compute_context_metrics(matches: pd.DataFrame, team_context: pd.DataFrame, season: str) -> pd.DataFrame:
+    """Una riga per giocatore con riepilogo, split e storico partite (stesse formule dell'endpoint)."""
+    if matches.empty:
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+
+    md = attach_opponent_elo(matches, team_context, OPPONENT_COLUMNS)
+    md = md.sort_values(['player_id', 'match_date'], kind='mergesort').reset_index(drop=True)
+    md['goals'] = pd.to_numeric(md['goals'], errors='coerce').fillna(0).astype(int)
+    md['xg'] = pd.to_numeric(md['xg'], errors='coerce').fillna(0.0)
+    elo = md['opponent_elo'].fillna(DEFAULT_ELO)
+
+    # Goal Quality: gol contro squadre forti valgono di più (goals * elo / 1500)
+    md['quality_score'] = elo / DEFAULT_ELO * md['goals']
+    md['top_goals'] = md['goals'].where(elo >= TOP_TEAM_ELO, 0)
+    md['bottom_goals'] = md['goals'].where(elo <= BOTTOM_TEAM_ELO, 0)
+    md['elo_filled'] = elo
+
+    grouped = md.groupby('player_id', sort=True)
+    out = grouped.agg(
+        player_name=('player_name', 'first'),
+        matches_analyzed=('goals', 'size'),
+        total_goals=('goals', 'sum'),
+        total_xg=('xg', 'sum'),
+        avg_opponent_elo=('elo_filled', 'mean'),
+        weighted_goals=('quality_score', 'sum'),
+        top_team_goals=('top_goals', 'sum'),
+        bottom_team_goals=('bottom_goals', 'sum'),
+    ).reset_index()
+
+    # Calendar Difficulty Score (0-100): 1200 = 0, 1500 = 50, 1800 = 100
+    out['difficulty_score'] = ((out['avg_opponent_elo'] - 1200) / 600 * 100).clip(0, 100)
+    out['goal_quality_index'] = (out['weighted_goals'] / out['total_goals'].replace(0, np.nan)).fillna(1.0)
+    out['fair_value_difficulty_adj'] = out['difficulty_score'] - 50  # % adjustment
+    out['top_bottom_ratio'] = (out['top_team_goals'] / out['bottom_team_goals'].replace(0, np.nan)).fillna(0.0)
+
+    # Squadra prevalente nella stagione
+    teams = (
+        md.groupby(['player_id', 'team_id']).size().rename('n').reset_index()
+        .sort_values(['player_id', 'n'], ascending=[True, False], kind='mergesort')
+        .drop_duplicates('player_id')
+    )
+    out = out.merge(teams[['player_id', 'team_id']], on='player_id', how='left')
+
+    # Storico partita per partita (già ordinato per data dentro ogni giocatore)
+    history = pd.DataFrame({
+        'date': md['match_date'].astype(str),
+        'opponent': md['opponent'],
+        'goals': md['goals'],
+        'xg': md['xg'],
+        'opponent_elo': elo.round(0),
+        'opponent_attack': md['opponent_attack_form'].fillna(0).round(2),
+        'opponent_defense': md['opponent_defense_form'].fillna(0).round(2),
+        'quality_score': md['quality_score'].round(2),
+    })
+    records = history.to_dict('records')
+    bounds = np.concatenate([[0], np.cumsum(grouped.size().to_numpy())])
+    out['match_history'] = [json.dumps(records[a:b], default=str) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    out['season'] = str(season)
+    return out[METRIC_COLUMNS]
+
+
+def save_context_metrics(engine, metrics: pd.DataFrame, season: str) -> int:
+    """Sostituisce le metriche della stagione in una transazione (DELETE + COPY)."""
+    with engine.begin() as conn:
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+        conn.execute(text("DELETE FROM player_context_metrics WHERE season = :season"), {"season": str(season)})
+        if not metrics.empty:
+            copy_frame(conn, "player_context_metrics", metrics)
+    return len(metrics)
+
+
+def refresh_context_metrics(engine, season: str = "2025") -> int:
+    start = time.perf_counter()
+    metrics = compute_context_metrics(load_matches(engine, season), load_team_context(engine, season), season)
+    written = save_context_metrics(engine, metrics, season)
+    print(f"🧭 Metriche di contesto {season}: {written} giocatori in {time.perf_counter() - start:.2f}s")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcolo metriche di contesto avversari")
+    parser.add_argument("--season", default="2025")
+    args = parser.parse_args()
+    refresh_context_metrics(get_engine(), args.season)
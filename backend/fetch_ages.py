@@ -1,82 +1,270 @@
-import wikipedia
-import dateparser
-from sqlalchemy import create_engine, text
-import time
-import re
+"""
+Fetch Ages - Date di nascita da Wikipedia
+=========================================
+Cerca la data di nascita dei giocatori senza birth_date tramite l'API MediaWiki
+(una sola richiesta per giocatore: ricerca "<nome> footballer" + estratto
+introduttivo della prima pagina).
+
+- richieste concorrenti (asyncio, al massimo MAX_CONCURRENCY in volo) con un
+  token bucket condiviso che limita le richieste al secondo;
+- 429/5xx/errori di rete: retry con backoff esponenziale (Retry-After se presente);
+  gli altri 4xx non si ritentano e contano come "non trovato";
+- cache negativa persistente (player_age_lookups): un giocatore non trovato
+  viene ricercato solo dopo un backoff che raddoppia a ogni tentativo fallito;
+- aggiornamenti di players.birth_date e della cache negativa a blocchi, con un
+  UPDATE ... FROM unnest(...) per blocco.
+
+L'endpoint è configurabile (WIKI_API_URL) per i test con un server HTTP locale.
+"""
+
+import argparse
+import asyncio
 import os
+import re
+import time
+import urllib.parse
+from datetime import date
+
+import pandas as pd
+import requests
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
 
 load_dotenv()
 
-# Configurazione
-wikipedia.set_lang("en") # Inglese è più standard per le date
-DB_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-engine = create_engine(DB_URL)
-
-def extract_birth_date(player_name):
-    try:
-        # Cerca su Wikipedia (aggiungiamo "footballer" per evitare omonimi)
-        search_results = wikipedia.search(f"{player_name} footballer")
-        if not search_results:
-            return None
-        
-        # Prende la prima pagina trovata
-        page = wikipedia.page(search_results[0], auto_suggest=False)
-        
-        # Cerchiamo pattern di data nel contenuto (es. "born 22 August 1997")
-        # Regex per catturare: (born) (Day Month Year)
-        summary = page.summary[:500] # Primi 500 caratteri bastano
-        
-        # Cerchiamo date comuni
-        match = re.search(r'born\s+(\d{1,2}\s+\w+\s+\d{4})', summary)
-        if match:
-            date_str = match.group(1)
-            return dateparser.parse(date_str)
-            
-        # Fallback: a volte è (born Month Day, Year)
-        match = re.search(r'born\s+(\w+\s+\d{1,2},\s+\d{4})', summary)
-        if match:
-            date_str = match.group(1)
-            return dateparser.parse(date_str)
+WIKI_API_URL = os.getenv("WIKI_API_URL", "https://en.wikipedia.org/w/api.php")  # Inglese: date più standard
+USER_AGENT = "football-quant-engine/1.0 (age fetcher)"
+REQUESTS_PER_SECOND = 3.0
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 3
+RETRY_BASE_SECONDS = 1.0    # Retry nella stessa esecuzione: 1, 2, 4 s
+REQUEST_TIMEOUT_SECONDS = 15
+RETRY_BASE_DAYS = 7         # Cache negativa: 7, 14, 28, ... giorni
+RETRY_MAX_DAYS = 180
+TRANSIENT_RETRY_DAYS = 1    # Errori di rete/server: si riprova il giorno dopo
+WRITE_BATCH_SIZE = 100
 
-    except Exception as e:
-        print(f"   ⚠️ Errore Wiki per {player_name}: {e}")
-        return None
-    
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS player_age_lookups (
+        player_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_attempt TIMESTAMPTZ NOT NULL DEFAULT now(),
+        next_attempt TIMESTAMPTZ NOT NULL,
+        last_error TEXT
+    )
+    """,
+]
+
+# "born 22 August 1997" oppure "born August 22, 1997"
+BORN_PATTERNS = [
+    re.compile(r'born\s+(\d{1,2}\s+\w+\s+\d{4})'),
+    re.compile(r'born\s+(\w+\s+\d{1,2},\s+\d{4})'),
+]
+
+
+def get_engine():
+    db_password = urllib.parse.quote_plus(os.getenv('DB_PASSWORD') or '')
+    return create_engine(f"postgresql://{os.getenv('DB_USER')}:{db_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+
+
+class TokenBucket:
+    """Limite di richieste al secondo condiviso tra le coroutine (burst fino a `capacity`)."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TransientError(Exception):
+    """Errore di rete o del server: il giocatore non va in cache negativa."""
+
+
+def parse_birth_date(summary: str) -> date | None:
+    """Data di nascita dai primi 500 caratteri dell'estratto."""
+    for pattern in BORN_PATTERNS:
+        match = pattern.search(summary[:500])
+        if match:
+            parsed = pd.to_datetime(match.group(1), errors='coerce')
+            if not pd.isna(parsed):
+                return parsed.date()
     return None
 
-def update_ages():
+
+def _search_params(player_name: str) -> dict:
+    # Aggiungiamo "footballer" per evitare omonimi; prima pagina trovata + estratto
+    return {
+        "action": "query", "format": "json", "formatversion": "2",
+        "generator": "search", "gsrsearch": f"{player_name} footballer", "gsrlimit": "1",
+        "prop": "extracts", "exintro": "1", "explaintext": "1", "redirects": "1",
+    }
+
+
+async def lookup_birth_date(http, bucket: TokenBucket, player_name: str, api_url: str = WIKI_API_URL) -> date | None:
+    """Data di nascita di un giocatore (None = non trovata). TransientError se i retry falliscono."""
+    delay = RETRY_BASE_SECONDS
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        wait = delay
+        try:
+            response = await asyncio.to_thread(
+                http.get, api_url, params=_search_params(player_name), timeout=REQUEST_TIMEOUT_SECONDS
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = response.headers.get("Retry-After", "")
+                wait = float(retry_after) if retry_after.isdigit() else delay
+                error = f"HTTP {response.status_code}"
+            elif 400 <= response.status_code < 500:
+                return None  # Richiesta rifiutata: inutile ritentare, va in cache negativa
+            else:
+                response.raise_for_status()
+                pages = response.json().get("query", {}).get("pages", [])
+                return parse_birth_date(pages[0].get("extract", "")) if pages else None
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        if attempt == MAX_RETRIES:
+            raise TransientError(error)
+        await asyncio.sleep(wait)
+        delay *= 2
+
+
+async def fetch_birth_dates(players, api_url: str = WIKI_API_URL, rate: float = REQUESTS_PER_SECOND,
+                            concurrency: int = MAX_CONCURRENCY, on_result=None) -> list:
+    """[(player_id, birth_date | None, errore | None)] per [(player_id, nome)]."""
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    with requests.Session() as http:
+        http.headers["User-Agent"] = USER_AGENT
+
+        async def one(player_id, name):
+            async with semaphore:
+                try:
+                    result = (player_id, await lookup_birth_date(http, bucket, name, api_url), None)
+                except TransientError as e:
+                    result = (player_id, None, str(e))
+            results.append(result)
+            if on_result is not None:
+                on_result(result, name)
+
+        await asyncio.gather(*(one(pid, name) for pid, name in players))
+    return results
+
+
+def load_pending(conn, limit: int | None = None) -> list:
+    """Giocatori senza birth_date il cui backoff nella cache negativa è scaduto."""
+    query = """
+        SELECT p.player_id, p.name
+        FROM players p
+        LEFT JOIN player_age_lookups l ON l.player_id = p.player_id
+        WHERE p.birth_date IS NULL AND (l.player_id IS NULL OR l.next_attempt <= now())
+        ORDER BY p.player_id
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return [tuple(r) for r in conn.execute(text(query)).fetchall()]
+
+
+def save_results(conn, results: list):
+    """Un UPDATE per le date trovate e un upsert per la cache negativa (per blocco)."""
+    found = [(pid, bd) for pid, bd, _ in results if bd is not None]
+    missed = [(pid, err) for pid, bd, err in results if bd is None]
+
+    if found:
+        conn.execute(
+            text("""
+                UPDATE players p SET birth_date = v.birth_date
+                FROM unnest(CAST(:ids AS INTEGER[]), CAST(:dates AS DATE[])) AS v(player_id, birth_date)
+                WHERE p.player_id = v.player_id
+            """),
+            {"ids": [pid for pid, _ in found], "dates": [bd for _, bd in found]}
+        )
+        conn.execute(
+            text("DELETE FROM player_age_lookups WHERE player_id = ANY(CAST(:ids AS INTEGER[]))"),
+            {"ids": [pid for pid, _ in found]}
+        )
+    if missed:
+        # Non trovato: backoff esponenziale sui tentativi. Errore transitorio: si riprova presto.
+        conn.execute(
+            text(f"""
+                INSERT INTO player_age_lookups (player_id, attempts, next_attempt, last_error)
+                SELECT v.player_id, CASE WHEN v.error IS NULL THEN 1 ELSE 0 END,
+                       now() + CASE WHEN v.error IS NULL THEN interval '{RETRY_BASE_DAYS} days'
+                                    ELSE interval '{TRANSIENT_RETRY_DAYS} days' END,
+                       v.error
+                FROM unnest(CAST(:ids AS INTEGER[]), CAST(:errors AS TEXT[])) AS v(player_id, error)
+                ON CONFLICT (player_id) DO UPDATE SET
+                    attempts = player_age_lookups.attempts + CASE WHEN EXCLUDED.last_error IS NULL THEN 1 ELSE 0 END,
+                    last_attempt = now(),
+                    next_attempt = now() + CASE
+                        WHEN EXCLUDED.last_error IS NULL THEN LEAST(
+                            interval '{RETRY_BASE_DAYS} days' * power(2, player_age_lookups.attempts),
+                            interval '{RETRY_MAX_DAYS} days')
+                        ELSE interval '{TRANSIENT_RETRY_DAYS} days' END,
+                    last_error = EXCLUDED.last_error
+            """),
+            {"ids": [pid for pid, _ in missed], "errors": [err for _, err in missed]}
+        )
+
+
+def update_ages(limit: int | None = None):
     print("🎂 Avvio Wikipedia Age Hunter...")
-    
-    with engine.connect() as conn:
-        # Prendiamo i giocatori che NON hanno ancora la data di nascita
-        players = conn.execute(text("SELECT player_id, name FROM players WHERE birth_date IS NULL")).fetchall()
-    
-    print(f"🔍 Trovati {len(players)} giocatori senza data di nascita.")
-    
-    count = 0
-    for p_id, name in players:
-        print(f"   Searching: {name}...", end=" ", flush=True)
-        
-        birth_date = extract_birth_date(name)
-        
+    engine = get_engine()
+
+    with engine.begin() as conn:
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+        players = load_pending(conn, limit)
+
+    print(f"🔍 {len(players)} giocatori senza data di nascita da cercare (esclusi quelli in backoff).")
+    if not players:
+        return
+
+    pending = []
+    counts = {"found": 0, "missed": 0, "errors": 0}
+
+    def on_result(result, name):
+        player_id, birth_date, error = result
         if birth_date:
-            print(f"✅ Trovato: {birth_date.strftime('%Y-%m-%d')}")
-            
-            # Aggiorna DB
-            with engine.begin() as conn:
-                conn.execute(
-                    text("UPDATE players SET birth_date = :bd WHERE player_id = :pid"),
-                    {"bd": birth_date, "pid": p_id}
-                )
-            count += 1
+            print(f"   ✅ {name}: {birth_date.isoformat()}")
+            counts["found"] += 1
+        elif error:
+            print(f"   ⚠️ {name}: {error}")
+            counts["errors"] += 1
         else:
-            print("❌ Non trovato.")
-        
-        # Pausa etica per non spammare Wikipedia (importante!)
-        time.sleep(0.5)
+            counts["missed"] += 1
+        pending.append(result)
+        if len(pending) >= WRITE_BATCH_SIZE:
+            with engine.begin() as conn:
+                save_results(conn, pending)
+            pending.clear()
+
+    start = time.perf_counter()
+    asyncio.run(fetch_birth_dates(players, on_result=on_result))
+    if pending:
+        with engine.begin() as conn:
+            save_results(conn, pending)
+
+    print(f"\n🎉 Finito in {time.perf_counter() - start:.0f}s! Trovati {counts['found']}, "
+          f"non trovati {counts['missed']} (in cache negativa), errori {counts['errors']}.")
 
-    print(f"\n🎉 Finito! Aggiornati {count} giocatori.")
 
 if __name__ == "__main__":
-    update_ages()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Date di nascita mancanti da Wikipedia")
+    parser.add_argument("--limit", type=int, default=None, help="Numero massimo di giocatori da cercare")
+    update_ages(parser.parse_args().limit)
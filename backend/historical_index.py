@@ -0,0 +1,263 @@
+"""
+Historical Comparables - Indice Cross-Season
+============================================
+Indice persistente di tutte le player-season presenti nel database, per confronti
+del tipo "assomiglia all'Osimhen 2022".
+
+- Ogni stagione è uno shard su disco (feature per 90 grezze + checksum dei dati letti).
+- refresh() confronta i fingerprint con il DB e ricarica SOLO le stagioni cambiate.
+- La normalizzazione (MinMax) è condivisa: calcolata sull'unione di tutti gli shard,
+  così una stagione del 2019 e una del 2025 stanno sulla stessa scala.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import row_checksum
+import similarity_engine
+from scouting_service import (
+    ALGORITHM_LABELS,
+    DISTANCE_METRICS,
+    FEATURE_COLUMNS,
+    FEATURE_METRICS,
+    ScoutingService,
+)
+
+MODULE_DIR = Path(__file__).resolve().parent
+DEFAULT_INDEX_DIR = MODULE_DIR / ".cache" / "historical_index"
+
+MIN_SEASON_MINUTES = 450        # Almeno 5 partite intere per un profilo p90 stabile
+REFRESH_INTERVAL_SECONDS = 300  # Controllo fingerprint al massimo ogni 5 minuti
+
+# Colonne di v_full_match_stats che finiscono negli shard (+ chiave di ordinamento)
+FINGERPRINT_COLUMNS = (
+    "player_id", "match_date", "player_name", "team_id", "minutes",
+    "goals", "assists", "npxg", "shots", "shots_on_target",
+)
+
+
+@dataclass(frozen=True)
+class _IndexState:
+    """Tutto ciò che serve alle query, calcolato una volta per rebuild e sostituito in blocco."""
+    frame: pd.DataFrame
+    matrix: np.ndarray              # Feature normalizzate (MinMax condiviso)
+    normalized_names: pd.Series     # Nomi normalizzati, allineati a frame
+    name_index: dict                # (stagione, nome normalizzato) -> prima riga
+    player_code: np.ndarray         # Identità del giocatore (int32): group_code del motore
+    team_code: np.ndarray           # Squadra (int32): team_code del motore
+    minutes: np.ndarray
+    covariance: np.ndarray          # Per la metrica mahalanobis
+
+
+class HistoricalComparablesIndex:
+    def __init__(self, scouting_service: ScoutingService, index_dir: str | Path | None = None):
+        self.scouting = scouting_service
+        self.engine = scouting_service.engine
+        self.index_dir = Path(index_dir or os.getenv("HISTORICAL_INDEX_DIR") or DEFAULT_INDEX_DIR)
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._manifest: dict[str, dict] = {}
+        self._shards: dict[str, pd.DataFrame] = {}
+        # Stato sostituito in blocco: i lettori non vedono mai uno stato misto
+        self._state: _IndexState | None = None
+        self._load_from_disk()
+
+    # ------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------
+    @property
+    def _manifest_path(self) -> Path:
+        return self.index_dir / "manifest.json"
+
+    def _shard_path(self, season: str) -> Path:
+        return self.index_dir / f"season_{season}.csv"
+
+    def _load_from_disk(self):
+        if not self._manifest_path.exists():
+            return
+        manifest = json.loads(self._manifest_path.read_text())
+        for season in manifest:
+            path = self._shard_path(season)
+            if path.exists():
+                self._shards[season] = pd.read_csv(path, dtype={"season": str})
+                self._manifest[season] = manifest[season]
+        self._rebuild_matrix()
+
+    def _save_shard(self, season: str, shard: pd.DataFrame):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        shard.to_csv(self._shard_path(season), index=False)
+
+    def _save_manifest(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._manifest, indent=2, sort_keys=True))
+        tmp.replace(self._manifest_path)
+
+    # ------------------------------------------------------------------
+    # Aggiornamento incrementale
+    # ------------------------------------------------------------------
+    def _season_checksums(self, columns: tuple) -> dict[str, dict]:
+        with self.engine.connect() as conn:
+            checksums = row_checksum.table_checksums(
+                conn, "v_full_match_stats", columns, ("player_id", "match_date"), group_by="trim(season)"
+            )
+        return {str(season): fp for season, fp in checksums.items()}
+
+    def _season_fingerprints(self) -> dict[str, dict]:
+        """Checksum per stagione delle colonne lette da _build_shard (correzioni tardive incluse)."""
+        try:
+            return self._season_checksums(FINGERPRINT_COLUMNS)
+        except Exception:
+            # Stesso fallback di ScoutingService._load_player_data (vista con xa al posto di npxg)
+            return self._season_checksums(tuple(c.replace("npxg", "xa") for c in FINGERPRINT_COLUMNS))
+
+    def _build_shard(self, season: str) -> pd.DataFrame:
+        df = self.scouting._load_player_data(season)
+        df = self.scouting._aggregate_players(df, MIN_SEASON_MINUTES)
+        for m in FEATURE_METRICS:
+            df[f"{m}_p90"] = (df[m] / df["minutes"]) * 90
+        df["season"] = season
+        return df[["player_name", "season", "team_id", "minutes"] + FEATURE_COLUMNS]
+
+    def refresh(self, force: bool = False) -> list[str]:
+        """Riallinea l'indice al DB. Restituisce le stagioni ricostruite."""
+        with self._lock:
+            if not force and time.monotonic() - self._last_check < REFRESH_INTERVAL_SECONDS:
+                return []
+
+            fingerprints = self._season_fingerprints()
+            changed = [s for s, fp in fingerprints.items() if self._manifest.get(s) != fp]
+            removed = [s for s in self._manifest if s not in fingerprints]
+
+            for season in changed:
+                shard = self._build_shard(season)
+                self._save_shard(season, shard)
+                self._shards[season] = shard
+                self._manifest[season] = fingerprints[season]
+            for season in removed:
+                self._shards.pop(season, None)
+                self._manifest.pop(season, None)
+                self._shard_path(season).unlink(missing_ok=True)
+
+            if changed or removed:
+                self._save_manifest()
+                self._rebuild_matrix()
+                print(f"📚 Indice storico aggiornato: {len(changed)} stagioni ricostruite, {len(removed)} rimosse")
+
+            self._last_check = time.monotonic()
+            return changed
+
+    def _rebuild_matrix(self):
+        """Scala condivisa: MinMax sull'unione di tutte le player-season."""
+        if not self._shards:
+            self._state = None
+            return
+        frame = pd.concat(self._shards.values(), ignore_index=True)
+        raw = frame[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+        col_min = raw.min(axis=0)
+        col_range = raw.max(axis=0) - col_min
+        col_range[col_range == 0] = 1.0
+        matrix = np.ascontiguousarray((raw - col_min) / col_range)
+
+        normalized = frame["player_name"].map(ScoutingService._normalize_name)
+        name_index = {}
+        for idx, key in enumerate(zip(frame["season"].astype(str), normalized)):
+            name_index.setdefault(key, idx)
+        player_code, _ = pd.factorize(frame["player_name"])
+        team_code, _ = pd.factorize(frame["team_id"])
+        self._state = _IndexState(
+            frame=frame,
+            matrix=matrix,
+            normalized_names=normalized,
+            name_index=name_index,
+            player_code=player_code.astype(np.int32),
+            team_code=team_code.astype(np.int32),
+            minutes=frame["minutes"].to_numpy(dtype=np.float64),
+            covariance=np.atleast_2d(np.cov(matrix, rowvar=False)),
+        )
+
+    # ------------------------------------------------------------------
+    # Query
+    # ------------------------------------------------------------------
+    def find_comparables(
+        self,
+        player_name: str,
+        season: str = "2025",
+        top_n: int = 5,
+        profile: str = "default",
+        weights: str | None = None,
+        metric: str = "euclidean",
+        include_same_player: bool = False,
+    ):
+        if metric not in DISTANCE_METRICS:
+            raise ValueError(f"Metrica sconosciuta: '{metric}'. Disponibili: {list(DISTANCE_METRICS)}")
+        feature_cols, feature_weights = self.scouting._resolve_weights(profile, weights)
+
+        self.refresh()
+        state = self._state
+        if state is None:
+            raise ValueError("Indice storico vuoto.")
+        frame, full_matrix = state.frame, state.matrix
+
+        target_norm = ScoutingService._normalize_name(player_name)
+        target_idx = state.name_index.get((str(season), target_norm))
+        if target_idx is None:
+            in_season = (frame["season"] == str(season)).to_numpy()
+            partial = np.flatnonzero(in_season & state.normalized_names.str.contains(target_norm, regex=False).to_numpy())
+            if not len(partial):
+                raise ValueError("Giocatore non trovato nell'indice storico (minuti insufficienti?).")
+            target_idx = int(partial[0])
+
+        covariance = state.covariance if metric == "mahalanobis" else None
+        full_weights, cov_inv = ScoutingService._expand_profile(feature_cols, feature_weights, covariance, metric)
+
+        # Identità del giocatore come group_code: le sue altre stagioni vengono
+        # escluse dentro la scansione, senza over-fetch.
+        flt = similarity_engine.SimilarityFilter()
+        if not include_same_player:
+            flt.exclude_group = int(state.player_code[target_idx])
+
+        n = len(frame)
+        results = similarity_engine.find_similar_filtered(
+            full_matrix[target_idx],
+            full_matrix,
+            full_weights,
+            int(top_n),
+            int(target_idx),
+            flt,
+            np.full(n, np.nan),
+            np.full(n, np.nan),
+            state.team_code,
+            state.minutes,
+            DISTANCE_METRICS[metric],
+            cov_inv,
+            group_code=state.player_code,
+        )
+
+        matches = []
+        for res in results:
+            row = frame.iloc[res.index]
+            matches.append({
+                "player": row["player_name"],
+                "season": row["season"],
+                "team": row["team_id"],
+                "minutes": int(row["minutes"]),
+                "similarity": round(ScoutingService._similarity_pct(res.score, metric), 1),
+                "data": {col: round(float(row[col]), 3) for col in FEATURE_COLUMNS},
+            })
+
+        return {
+            "target": frame.loc[target_idx, "player_name"],
+            "season": str(season),
+            "seasons_indexed": sorted(self._manifest),
+            "matches": matches,
+            "metric": metric,
+            "algorithm": ALGORITHM_LABELS[metric],
+        }
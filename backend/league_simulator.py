@@ -12,11 +12,22 @@ from collections import defaultdict
 from typing import List, Dict, Tuple
 import urllib.parse
 
-import soccerdata as sd
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from team_elo_store import TeamEloStore
+
+# Cache dei download grezzi condivisa con la pipeline ETL (directory in RAW_CACHE_DIR).
+# Nessun fallback: senza cache si perderebbero TTL condiviso e replay offline.
+try:
+    from raw_cache import CacheMiss, understat_frame
+except ImportError as e:
+    raise ImportError(
+        "raw_cache non importabile: avviare il backend con data-processing nel PYTHONPATH "
+        "(es. PYTHONPATH=../data-processing uvicorn main:app)"
+    ) from e
+
 # Carica .env dalla directory data-processing (come fa main.py)
 load_dotenv("../data-processing/.env")
 
@@ -31,6 +42,7 @@ db_pass = urllib.parse.quote_plus(db_password)
 db_url = f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
 engine = create_engine(db_url)
 Session = sessionmaker(bind=engine)
+team_elo_store = TeamEloStore(engine)  # Condiviso con gli endpoint ELO di main.py
 
 # Costanti simulazione
 HOME_ADVANTAGE = 100  # Bonus ELO per squadra di casa
@@ -81,9 +93,8 @@ def get_remaining_fixtures(season: str = '2025') -> List[Dict]:
     print(f"📅 Recupero fixture rimanenti per stagione {season}...")
     
     try:
-        # Download calendario completo da Understat
-        scraper = sd.Understat(leagues=['ITA-Serie A'], seasons=season)
-        fixtures_df = scraper.read_schedule().reset_index()
+        # Calendario completo da Understat (via cache locale, TTL 6h)
+        fixtures_df = understat_frame('read_schedule', season).reset_index()
         
         print(f"   ✓ Scaricate {len(fixtures_df)} partite totali")
         print(f"   ℹ️ Colonne disponibili: {list(fixtures_df.columns)}")
@@ -125,6 +136,8 @@ def get_remaining_fixtures(season: str = '2025') -> List[Dict]:
         
         return remaining
     
+    except CacheMiss:
+        raise  # Offline senza snapshot del calendario: errore esplicito, non una simulazione parziale
     except Exception as e:
         print(f"   ❌ Errore nel recupero fixture: {e}")
         # Fallback: restituisci lista vuota (simulazione solo su classifica attuale)
@@ -245,31 +258,8 @@ def get_team_elos(season: str = '2025') -> Dict[str, float]:
     """
     print(f"⚡ Recupero ELO rating per stagione {season}...")
     
-    session = Session()
-    
-    # Mappa season
-    team_season_map = {
-        '2024': '2425',
-        '2025': '2526'
-    }
-    team_season = team_season_map.get(season, season)
-    
-    query = text("""
-        SELECT DISTINCT ON (team_id)
-            team_id,
-            elo
-        FROM team_performance
-        WHERE season = :season
-        ORDER BY team_id, match_date DESC
-    """)
-    
-    elos = {}
-    rows = session.execute(query, {'season': team_season}).fetchall()
-    
-    for row in rows:
-        elos[row[0]] = float(row[1])
-    
-    session.close()
+    # Ultimo punto della serie ELO di ogni squadra (store in memoria, stagione mappata a "2526")
+    elos = team_elo_store.team_elos(season)
     
     print(f"   ✓ ELO caricati per {len(elos)} squadre")
     # Mostra top 3 ELO
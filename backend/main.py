@@ -6,6 +6,10 @@ from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 import quant_engine #C++ Module
 from scouting_service import ScoutingService
+from historical_index import HistoricalComparablesIndex
+from player_search_index import PlayerSearchIndex
+from valuation_service import ValuationService, WhatIfError
+import league_simulator
 
 # Setup App
 from fastapi.middleware.cors import CORSMiddleware
@@ -27,6 +31,10 @@ db_pass = urllib.parse.quote_plus(os.getenv("DB_PASSWORD"))
 db_url = f"postgresql://{os.getenv('DB_USER')}:{db_pass}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 engine = create_engine(db_url)
 scouting_service = ScoutingService(engine)
+historical_index = HistoricalComparablesIndex(scouting_service)
+player_search = PlayerSearchIndex(engine)
+valuation_service = ValuationService(engine)
+team_elo_store = league_simulator.team_elo_store  # Serie ELO condivise con il simulatore
 
 @app.get("/")
 def read_root():
@@ -95,6 +103,21 @@ def get_top_scorers(season: str = "2025", team_id: str | None = None):
     results.sort(key=lambda x: x["quant_efficiency_score"], reverse=True)
     return results
 
+def load_season_valuation(player_name: str, season: str) -> float:
+    """Fair value stagionale (player_season_valuations), 0.0 se non ancora valutato."""
+    query = text("""
+        SELECT pv.fair_value
+        FROM player_season_valuations pv
+        JOIN players p ON p.player_id = pv.player_id
+        WHERE p.name = :name AND pv.season = :season
+    """)
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(query, {"name": player_name, "season": season.strip()}).fetchone()
+    except Exception:
+        return 0.0
+    return float(row[0]) if row and row[0] else 0.0
+
 @app.get("/analytics/player/{player_name}")
 def get_player_history(player_name: str, season: str = "2025"):
     """Player history and advanced metrics for the requested season."""
@@ -108,8 +131,7 @@ def get_player_history(player_name: str, season: str = "2025"):
                opponent,
                season,
                minutes,
-               shots,
-               fair_value
+               shots
         FROM v_full_match_stats
         WHERE player_name = :name AND trim(season) = :season
         ORDER BY match_date ASC
@@ -117,7 +139,6 @@ def get_player_history(player_name: str, season: str = "2025"):
 
     history = []
     goals_vector = []
-    fair_values = []
     total_goals = 0
     total_xg = 0.0
     total_minutes = 0
@@ -136,14 +157,11 @@ def get_player_history(player_name: str, season: str = "2025"):
             mins = int(row[6] or 0)
             shots = int(row[7] or 0)
             row_season = row[5]
-            fv = float(row[8]) if row[8] else 0.0
 
             total_goals += g
             total_xg += xg
             total_minutes += mins
             total_shots += shots
-            if fv > 0:
-                fair_values.append(fv)
 
             history.append({
                 "date": str(row[0]),
@@ -163,8 +181,7 @@ def get_player_history(player_name: str, season: str = "2025"):
                    NULL as opponent,
                    season,
                    minutes,
-                   shots,
-                   fair_value
+                   shots
             FROM v_full_match_stats
             WHERE player_name = :name AND trim(season) = :season
             ORDER BY match_date ASC
@@ -181,14 +198,11 @@ def get_player_history(player_name: str, season: str = "2025"):
             mins = int(row[6] or 0)
             shots = int(row[7] or 0)
             row_season = row[5]
-            fv = float(row[8]) if row[8] else 0.0
 
             total_goals += g
             total_xg += xg
             total_minutes += mins
             total_shots += shots
-            if fv > 0:
-                fair_values.append(fv)
 
             history.append({
                 "date": str(row[0]),
@@ -206,7 +220,7 @@ def get_player_history(player_name: str, season: str = "2025"):
     conversion_rate = (total_goals / total_shots) * 100 if total_shots > 0 else 0.0
     goals_p90 = (total_goals / total_minutes) * 90 if total_minutes > 0 else 0.0
     xg_diff = total_goals - total_xg
-    avg_fair_value = sum(fair_values) / len(fair_values) if fair_values else 0.0
+    fair_value = load_season_valuation(decoded_name, season)
 
     recent_goals = goals_vector[-5:] if len(goals_vector) >= 5 else goals_vector
     trend_score = quant_engine.calculate_trend(recent_goals)
@@ -229,7 +243,7 @@ def get_player_history(player_name: str, season: str = "2025"):
             "goals_per_90": round(goals_p90, 2),
             "total_shots": total_shots,
             "xg_diff": round(xg_diff, 2),
-            "fair_value": round(avg_fair_value, 0),
+            "fair_value": round(fair_value, 0),
         },
         "history": history,
     }
@@ -313,14 +327,71 @@ def get_prediction(player_name: str, season: str = "2025"):
         "simulation": simulation,
     }
 
+@app.get("/analytics/valuation")
+def get_valuation(
+    season: str = "2025",
+    player: str | None = None,
+    top_n: int = 20,
+    role: str | None = None,
+    team: str | None = None,
+    extra_goals: float = 0,
+    extra_assists: float = 0,
+    extra_npxg: float = 0,
+    extra_shots: float = 0,
+    extra_shots_on_target: float = 0,
+    extra_minutes: float = 0,
+):
+    """Fair value on-demand from the in-memory V3 model.
+
+    Without `player` returns the top N by value (optionally filtered by role/team).
+    With `player` returns its value and components; any `extra_*` parameter adds a
+    what-if scenario re-scored against the cached league-wide normalisation.
+    """
+    try:
+        if not player:
+            return valuation_service.top(season=season, top_n=top_n, role=role, team=team)
+        what_if = {
+            "goals": extra_goals,
+            "assists": extra_assists,
+            "npxg": extra_npxg,
+            "shots": extra_shots,
+            "shots_on_target": extra_shots_on_target,
+            "minutes": extra_minutes,
+        }
+        return valuation_service.value(urllib.parse.unquote(player), season=season, what_if=what_if)
+    except WhatIfError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
 @app.get("/analytics/scouting/similar/{player_name}")
 def get_similar_players(
     player_name: str,
     season: str = "2025",
     min_minutes: int = 90,
     top_n: int = 5,
+    min_fair_value: float | None = None,
+    max_fair_value: float | None = None,
+    min_age: float | None = None,
+    max_age: float | None = None,
+    team: str | None = None,
+    exclude_team: str | None = None,
+    exclude_same_team: bool = False,
+    candidate_min_minutes: int | None = None,
+    profile: str = "default",
+    weights: str | None = None,
+    metric: str = "euclidean",
+    role_scope: str = "all",
 ):
-    """Find similar players using the scouting service (weighted euclidean)."""
+    """Find similar players using the scouting service.
+
+    Budget, age, team and minutes filters are applied inside the C++ engine
+    before the top-N selection, so tight filters still return top_n matches.
+    `profile` picks a named feature set (see FEATURE_PROFILES), `weights`
+    overrides it with custom "feature:weight" pairs, and `metric` is one of
+    euclidean, cosine or mahalanobis. `role_scope` ("same"/"nearby") restricts
+    the scan to the target's role cluster (and its nearest neighbours).
+    """
     decoded_name = urllib.parse.unquote(player_name)
     try:
         return scouting_service.find_similar(
@@ -328,6 +399,43 @@ def get_similar_players(
             season=season,
             min_minutes=min_minutes,
             top_n=top_n,
+            min_fair_value=min_fair_value,
+            max_fair_value=max_fair_value,
+            min_age=min_age,
+            max_age=max_age,
+            team=team,
+            exclude_team=exclude_team,
+            exclude_same_team=exclude_same_team,
+            candidate_min_minutes=candidate_min_minutes,
+            profile=profile,
+            weights=weights,
+            metric=metric,
+            role_scope=role_scope,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+@app.get("/analytics/scouting/historical/{player_name}")
+def get_historical_comparables(
+    player_name: str,
+    season: str = "2025",
+    top_n: int = 5,
+    profile: str = "default",
+    weights: str | None = None,
+    metric: str = "euclidean",
+    include_same_player: bool = False,
+):
+    """Most similar past player-seasons (any season in the DB) to the player's current profile."""
+    decoded_name = urllib.parse.unquote(player_name)
+    try:
+        return historical_index.find_comparables(
+            decoded_name,
+            season=season,
+            top_n=top_n,
+            profile=profile,
+            weights=weights,
+            metric=metric,
+            include_same_player=include_same_player,
         )
     except ValueError as exc:
         raise HTTPException(status_code=404, detail=str(exc))
@@ -336,26 +444,14 @@ def get_similar_players(
 
 @app.get("/analytics/scouting/suggest")
 def suggest_players(q: str):
-    """Return up to 10 player name suggestions matching the query (case-insensitive)."""
+    """Return up to 10 player name suggestions (accent-insensitive prefix/infix match).
+
+    Served from the in-process PlayerSearchIndex, ranked by relevance then minutes.
+    """
     if not q or len(q.strip()) < 1:
         return []
 
-    query = text("""
-        SELECT DISTINCT player_name
-        FROM v_full_match_stats
-        WHERE player_name ILIKE :pattern
-        ORDER BY player_name ASC
-        LIMIT 10
-    """)
-
-    pattern = f"%{q.strip()}%"
-    suggestions = []
-    with engine.connect() as conn:
-        rows = conn.execute(query, {"pattern": pattern})
-        for r in rows:
-            suggestions.append(r[0])
-
-    return suggestions
+    return player_search.suggest(q.strip(), limit=10)
 """
 Analisi Contestuali - Context Analytics Endpoints
 
@@ -375,155 +471,107 @@ def get_player_context_analysis(player_name: str, season: str = "2025"):
     - Goal Quality Score (gol contro squadre forti valgono di più)
     """
     decoded_name = urllib.parse.unquote(player_name)
-    
-    # Map season format: v_full_match_stats usa "2025", team_performance usa "2526"
-    team_season_map = {"2024": "2425", "2025": "2526"}
-    team_season = team_season_map.get(season, season)
-    
+
+    # Precalcolate per tutta la lega dopo ogni ETL (context_metrics.py)
     query = text("""
-        WITH player_matches AS (
-            SELECT 
-                pms.match_date,
-                pms.opponent,
-                pms.goals,
-                pms.xg,
-                pms.team_id,
-                tp.elo as opponent_elo,
-                tp.rolling_xg_form as opponent_attack_form,
-                tp.rolling_ga_form as opponent_defense_form
-            FROM v_full_match_stats pms
-            LEFT JOIN team_performance tp 
-                ON pms.opponent = tp.team_id 
-                AND pms.match_date = tp.match_date
-                AND tp.season = :team_season
-            WHERE pms.player_name = :name 
-                AND pms.season = :season
-                AND pms.minutes > 0
-        )
-        SELECT 
-            match_date,
-            opponent,
-            goals,
-            xg,
-            opponent_elo,
-            opponent_attack_form,
-            opponent_defense_form
-        FROM player_matches
-        ORDER BY match_date ASC
+        SELECT
+            player_name, matches_analyzed, total_goals, avg_opponent_elo, difficulty_score,
+            goal_quality_index, fair_value_difficulty_adj, top_team_goals, bottom_team_goals,
+            top_bottom_ratio, match_history
+        FROM player_context_metrics
+        WHERE season = :season AND player_name = :name
+        ORDER BY matches_analyzed DESC
+        LIMIT 1
     """)
-    
-    matches = []
-    total_goals = 0
-    total_xg = 0.0
-    elo_weighted_goals = 0.0
-    total_opponent_elo = 0.0
-    
-    top_team_goals = 0  # Gol vs squadre ELO > 1600
-    bottom_team_goals = 0  # Gol vs squadre ELO < 1450
-    
+
     with engine.connect() as conn:
-        rows = conn.execute(query, {"name": decoded_name, "season": season, "team_season": team_season})
-        
-        for row in rows:
-            opponent_elo = float(row[4]) if row[4] else 1500.0
-            goals = int(row[2])
-            xg = float(row[3])
-            
-            # Goal Quality: gol contro squadre forti valgono di più
-            # Formula: goals * (opponent_elo / 1500)
-            quality_multiplier = opponent_elo / 1500.0
-            
-            matches.append({
-                "date": str(row[0]),
-                "opponent": row[1],
-                "goals": goals,
-                "xg": xg,
-                "opponent_elo": round(opponent_elo, 0),
-                "opponent_attack": round(float(row[5] or 0), 2),
-                "opponent_defense": round(float(row[6] or 0), 2),
-                "quality_score": round(quality_multiplier * goals, 2)
-            })
-            
-            total_goals += goals
-            total_xg += xg
-            elo_weighted_goals += quality_multiplier * goals
-            total_opponent_elo += opponent_elo
-            
-            # Classifica performance vs top/bottom
-            if opponent_elo >= 1600:
-                top_team_goals += goals
-            elif opponent_elo <= 1450:
-                bottom_team_goals += goals
-    
-    if not matches:
+        row = conn.execute(query, {"name": decoded_name, "season": season}).mappings().fetchone()
+
+    if row is None:
         raise HTTPException(status_code=404, detail="Player not found or no matches")
-    
-    num_matches = len(matches)
-    avg_opponent_elo = total_opponent_elo / num_matches if num_matches > 0 else 1500.0
-    
-    # Calendar Difficulty Score (0-100)
-    # 1500 = 50 (media), 1800 = 100 (difficilissimo), 1200 = 0 (facile)
-    difficulty_score = min(100, max(0, ((avg_opponent_elo - 1200) / 600) * 100))
-    
-    # Goal Quality Index (weighted vs standard)
-    goal_quality_index = (elo_weighted_goals / total_goals) if total_goals > 0 else 1.0
-    
-    # Fair Value Adjustment
-    # Giocatori che affrontano calendari difficili meritano bonus
-    difficulty_bonus_pct = (difficulty_score - 50) / 100  # da -50% a +50%
-    
+
     return {
         "player": decoded_name,
         "season": season,
         "summary": {
-            "matches_analyzed": num_matches,
-            "total_goals": total_goals,
-            "avg_opponent_elo": round(avg_opponent_elo, 0),
-            "difficulty_score": round(difficulty_score, 1),  # 0-100
-            "goal_quality_index": round(goal_quality_index, 2),  # >1 = gol contro forti
-            "fair_value_difficulty_adj": round(difficulty_bonus_pct * 100, 1)  # % adjustment
+            "matches_analyzed": row["matches_analyzed"],
+            "total_goals": row["total_goals"],
+            "avg_opponent_elo": round(row["avg_opponent_elo"], 0),
+            "difficulty_score": round(row["difficulty_score"], 1),  # 0-100
+            "goal_quality_index": round(row["goal_quality_index"], 2),  # >1 = gol contro forti
+            "fair_value_difficulty_adj": round(row["fair_value_difficulty_adj"], 1)  # % adjustment
         },
         "splits": {
             "vs_top_teams": {
-                "goals": top_team_goals,
+                "goals": row["top_team_goals"],
                 "description": "Goals vs teams with ELO >= 1600"
             },
             "vs_bottom_teams": {
-                "goals": bottom_team_goals,
+                "goals": row["bottom_team_goals"],
                 "description": "Goals vs teams with ELO <= 1450"
             },
-            "top_bottom_ratio": round(top_team_goals / bottom_team_goals, 2) if bottom_team_goals > 0 else 0
+            "top_bottom_ratio": round(row["top_bottom_ratio"], 2)
         },
-        "match_history": matches
+        "match_history": row["match_history"]
     }
 
 
-@app.get("/analytics/team/{team_id}/elo-history")
-def get_team_elo_history(team_id: str, season: str = "2025"):
+@app.get("/analytics/league/toughest-schedules")
+def get_toughest_schedules(season: str = "2025", min_matches: int = 5, limit: int = 20, team: str | None = None):
     """
-    Storico ELO di una squadra per visualizzazione grafico.
+    Classifica dei giocatori per difficoltà del calendario affrontato (ELO medio avversari).
     """
     query = text("""
-        SELECT 
-            match_date,
-            elo,
-            rolling_xg_form,
-            rolling_ga_form
-        FROM team_performance
-        WHERE team_id = :team_id AND season = :season
-        ORDER BY match_date ASC
+        SELECT
+            player_name, team_id, matches_analyzed, total_goals, avg_opponent_elo,
+            difficulty_score, goal_quality_index, top_team_goals, bottom_team_goals
+        FROM player_context_metrics
+        WHERE season = :season
+            AND matches_analyzed >= :min_matches
+            AND (CAST(:team AS TEXT) IS NULL OR team_id = :team)
+        ORDER BY avg_opponent_elo DESC, matches_analyzed DESC
+        LIMIT :limit
     """)
-    
-    history = []
+
     with engine.connect() as conn:
-        rows = conn.execute(query, {"team_id": team_id, "season": season})
-        for row in rows:
-            history.append({
-                "date": str(row[0]),
-                "elo": round(float(row[1]), 0),
-                "attack_form": round(float(row[2] or 0), 2),
-                "defense_form": round(float(row[3] or 0), 2)
-            })
+        rows = conn.execute(query, {
+            "season": season, "min_matches": min_matches, "team": team, "limit": min(max(limit, 1), 500)
+        }).mappings().fetchall()
+
+    return {
+        "season": season,
+        "rankings": [
+            {
+                "rank": i,
+                "player": r["player_name"],
+                "team": r["team_id"],
+                "matches_analyzed": r["matches_analyzed"],
+                "total_goals": r["total_goals"],
+                "avg_opponent_elo": round(r["avg_opponent_elo"], 0),
+                "difficulty_score": round(r["difficulty_score"], 1),
+                "goal_quality_index": round(r["goal_quality_index"], 2),
+                "vs_top_teams_goals": r["top_team_goals"],
+                "vs_bottom_teams_goals": r["bottom_team_goals"],
+            }
+            for i, r in enumerate(rows, 1)
+        ]
+    }
+
+
+@app.get("/analytics/team/{team_id}/elo-history")
+def get_team_elo_history(team_id: str, season: str = "2025", start: str | None = None, end: str | None = None):
+    """
+    Storico ELO di una squadra per visualizzazione grafico (opzionale: intervallo start/end).
+    """
+    history = [
+        {
+            "date": point["date"],
+            "elo": round(point["elo"], 0),
+            "attack_form": round(point["attack_form"], 2),
+            "defense_form": round(point["defense_form"], 2)
+        }
+        for point in team_elo_store.history(team_id, season, start=start, end=end)
+    ]
     
     if not history:
         raise HTTPException(status_code=404, detail="Team not found")
@@ -537,38 +585,26 @@ def get_team_elo_history(team_id: str, season: str = "2025"):
 
 
 @app.get("/analytics/league/strength-rankings")
-def get_league_strength_rankings(season: str = "2025"):
+def get_league_strength_rankings(season: str = "2025", as_of: str | None = None):
     """
-    Classifica squadre per ELO corrente + forma.
+    Classifica squadre per ELO corrente + forma (o alla data as_of, YYYY-MM-DD).
     """
-    query = text("""
-        SELECT DISTINCT ON (team_id)
-            team_id,
-            elo,
-            rolling_xg_form,
-            rolling_ga_form,
-            match_date
-        FROM team_performance
-        WHERE season = :season
-        ORDER BY team_id, match_date DESC
-    """)
+    points = team_elo_store.points_as_of(as_of, season) if as_of else team_elo_store.latest(season)
     
     teams = []
-    with engine.connect() as conn:
-        rows = conn.execute(query, {"season": season})
-        for row in rows:
-            gf = float(row[2] or 0)
-            ga = float(row[3] or 0)
-            goal_diff = gf - ga
-            
-            teams.append({
-                "team": row[0],
-                "elo": round(float(row[1]), 0),
-                "attack_form": round(gf, 2),
-                "defense_form": round(ga, 2),
-                "form_diff": round(goal_diff, 2),
-                "last_update": str(row[4])
-            })
+    for team_id, point in points.items():
+        gf = point["attack_form"]
+        ga = point["defense_form"]
+        goal_diff = gf - ga
+        
+        teams.append({
+            "team": team_id,
+            "elo": round(point["elo"], 0),
+            "attack_form": round(gf, 2),
+            "defense_form": round(ga, 2),
+            "form_diff": round(goal_diff, 2),
+            "last_update": point["date"]
+        })
     
     # Ordina per ELO
     teams.sort(key=lambda x: x["elo"], reverse=True)
@@ -584,7 +620,6 @@ def get_league_strength_rankings(season: str = "2025"):
 # ============================================
 from datetime import datetime
 from functools import lru_cache
-import league_simulator
 
 # Cache per 5 minuti (evita ricalcolo se utente ricarica pagina)
 _forecast_cache = {"data": None, "timestamp": None}
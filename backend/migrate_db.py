@@ -1,114 +1,147 @@
-import pandas as pd
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import IntegrityError
+"""
+Migrate DB - v_full_match_stats -> schema V2 (players, matches, player_stats_v2)
+===============================================================================
+Migrazione set-based, una stagione alla volta:
+
+1. players: INSERT ... SELECT DISTINCT dei nomi, ON CONFLICT (name) DO NOTHING;
+2. matches: una riga per (data, squadre in ordine alfabetico), ON CONFLICT sulla
+   chiave (date, home_team_id, away_team_id). Senza colonna h_a non sappiamo chi
+   gioca in casa: per convenzione home = prima squadra in ordine alfabetico;
+3. player_stats_v2: INSERT ... SELECT con join su players e matches, saltando
+   le coppie (player_id, match_id) già presenti.
+
+Ogni stagione è una transazione che registra un checkpoint in
+migration_checkpoints: se la migrazione si interrompe, la riesecuzione riparte
+dalla prima stagione non completata (--restart per rifare tutto).
+"""
+
+import argparse
 import os
+import time
+import urllib.parse
+
 from dotenv import load_dotenv
-from tqdm import tqdm # Installalo con: pip install tqdm
+from sqlalchemy import create_engine, text
 
 load_dotenv()
 
 # Setup Database
-DB_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+db_password = urllib.parse.quote_plus(os.getenv('DB_PASSWORD') or '')
+DB_URL = f"postgresql://{os.getenv('DB_USER')}:{db_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 engine = create_engine(DB_URL)
 
-def migrate():
+MIGRATION_NAME = "v_full_match_stats_to_v2"
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS migration_checkpoints (
+        migration TEXT NOT NULL,
+        chunk TEXT NOT NULL,
+        rows_migrated INTEGER NOT NULL,
+        completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (migration, chunk)
+    )
+    """,
+]
+
+INSERT_PLAYERS = text("""
+    INSERT INTO players (name)
+    SELECT DISTINCT player_name FROM v_full_match_stats
+    WHERE season = :season AND player_name IS NOT NULL
+    ON CONFLICT (name) DO NOTHING
+""")
+
+INSERT_MATCHES = text("""
+    INSERT INTO matches (season, date, home_team_id, away_team_id)
+    SELECT DISTINCT ON (match_date, LEAST(team_id, opponent), GREATEST(team_id, opponent))
+           season, match_date, LEAST(team_id, opponent), GREATEST(team_id, opponent)
+    FROM v_full_match_stats
+    WHERE season = :season AND team_id IS NOT NULL AND opponent IS NOT NULL
+    ON CONFLICT (date, home_team_id, away_team_id) DO UPDATE SET season = EXCLUDED.season
+""")
+
+INSERT_STATS = text("""
+    INSERT INTO player_stats_v2
+        (player_id, match_id, team_id, minutes, goals, assists, shots, shots_on_target, npxg, xa, fair_value)
+    SELECT DISTINCT ON (p.player_id, m.match_id)
+           p.player_id, m.match_id, v.team_id, v.minutes, v.goals, v.assists, v.shots,
+           v.shots_on_target, COALESCE(v.npxg, 0), 0.0, v.fair_value
+    FROM v_full_match_stats v
+    JOIN players p ON p.name = v.player_name
+    JOIN matches m ON m.date = v.match_date
+                  AND m.home_team_id = LEAST(v.team_id, v.opponent)
+                  AND m.away_team_id = GREATEST(v.team_id, v.opponent)
+    WHERE v.season = :season
+      AND NOT EXISTS (
+          SELECT 1 FROM player_stats_v2 s WHERE s.player_id = p.player_id AND s.match_id = m.match_id
+      )
+""")
+
+
+def completed_chunks(conn) -> set:
+    rows = conn.execute(
+        text("SELECT chunk FROM migration_checkpoints WHERE migration = :m"), {"m": MIGRATION_NAME}
+    ).fetchall()
+    return {r[0] for r in rows}
+
+
+def migrate_season(conn, season) -> dict:
+    """Migra una stagione nella transazione corrente e registra il checkpoint."""
+    params = {"season": season}
+    counts = {
+        "players": conn.execute(INSERT_PLAYERS, params).rowcount,
+        "matches": conn.execute(INSERT_MATCHES, params).rowcount,
+        "stats": conn.execute(INSERT_STATS, params).rowcount,
+    }
+    conn.execute(
+        text("""
+            INSERT INTO migration_checkpoints (migration, chunk, rows_migrated) VALUES (:m, :c, :n)
+            ON CONFLICT (migration, chunk) DO UPDATE SET rows_migrated = EXCLUDED.rows_migrated, completed_at = now()
+        """),
+        {"m": MIGRATION_NAME, "c": str(season), "n": counts["stats"]}
+    )
+    return counts
+
+
+def migrate(restart: bool = False):
     print("🚀 Inizio Migrazione Database in 'Shadow Mode'...")
-    
-    with engine.connect() as conn:
-        # 1. Carichiamo TUTTI i dati vecchi in memoria (pandas è efficiente per questo volume)
-        print("📥 Caricamento dati grezzi...")
-        raw_df = pd.read_sql("SELECT * FROM v_full_match_stats", conn)
-        print(f"   Trovate {len(raw_df)} righe di statistiche.")
-
-        # --- FASE 1: POPOLARE PLAYERS ---
-        print("👤 Migrazione Giocatori...")
-        unique_players = raw_df['player_name'].unique()
-        
-        player_map = {} # Dizionario { 'Lautaro': player_id }
-        
-        for name in tqdm(unique_players, desc="Players"):
-            # Inseriamo o ignoriamo se esiste già
-            try:
-                # Insert e ritorna ID
-                result = conn.execute(
-                    text("INSERT INTO players (name) VALUES (:name) ON CONFLICT (name) DO UPDATE SET name=EXCLUDED.name RETURNING player_id"),
-                    {"name": name}
-                )
-                player_id = result.fetchone()[0]
-                player_map[name] = player_id
-            except Exception as e:
-                print(f"Errore su {name}: {e}")
-
-        conn.commit()
-        print(f"✅ Mappati {len(player_map)} giocatori unici.")
-
-        # --- FASE 2: POPOLARE MATCHES E STATS ---
-        print("⚽️ Migrazione Partite e Stats (Questo richiederà tempo)...")
-        
-        match_map = {} # Chiave (date, team_a, team_b) -> match_id
-        stats_count = 0
-
-        # Iteriamo su ogni riga del vecchio DB
-        for index, row in tqdm(raw_df.iterrows(), total=raw_df.shape[0], desc="Rows"):
-            try:
-                # 1. Identificazione Partita
-                # Dobbiamo creare una chiave unica per la partita. 
-                # Assumiamo: Date + (Team, Opponent) ordinati alfabeticamente per evitare duplicati A-B vs B-A
-                teams = sorted([row['team_id'], row['opponent']])
-                match_key = (row['match_date'], teams[0], teams[1])
-                
-                if match_key not in match_map:
-                    # Creiamo la partita
-                    # Nota: Non sappiamo chi è casa/fuori dai dati vecchi in modo affidabile senza 'h_a' column
-                    # Assumiamo convenzionalmente teams[0] home, teams[1] away per l'ID, ma salviamo i dati
-                    res = conn.execute(
-                        text("""
-                            INSERT INTO matches (season, date, home_team_id, away_team_id)
-                            VALUES (:season, :date, :h, :a)
-                            ON CONFLICT (date, home_team_id, away_team_id) DO UPDATE SET season=EXCLUDED.season
-                            RETURNING match_id
-                        """),
-                        {
-                            "season": row['season'],
-                            "date": row['match_date'],
-                            "h": teams[0],
-                            "a": teams[1]
-                        }
-                    )
-                    match_id = res.fetchone()[0]
-                    match_map[match_key] = match_id
-                else:
-                    match_id = match_map[match_key]
-
-                # 2. Inserimento Statistiche Collegate
-                conn.execute(
-                    text("""
-                        INSERT INTO player_stats_v2 
-                        (player_id, match_id, team_id, minutes, goals, assists, shots, shots_on_target, npxg, xa, fair_value)
-                        VALUES (:pid, :mid, :tid, :mins, :gls, :ast, :sh, :sot, :npxg, :xa, :fv)
-                    """),
-                    {
-                        "pid": player_map[row['player_name']],
-                        "mid": match_id,
-                        "tid": row['team_id'],
-                        "mins": row['minutes'],
-                        "gls": row['goals'],
-                        "gls": row['goals'],
-                        "ast": row['assists'],
-                        "sh": row['shots'],
-                        "sot": row['shots_on_target'],
-                        "npxg": row['npxg'] if row['npxg'] else 0, # Handle None
-                        "xa": 0.0, # Se non avevi la colonna xa nel vecchio, metti 0 o correggi
-                        "fv": row['fair_value']
-                    }
-                )
-                stats_count += 1
-                
-            except Exception as e:
-                print(f"Errore riga {index}: {e}")
-
-        conn.commit()
-        print(f"✅ Migrazione completata. Inserite {len(match_map)} partite e {stats_count} statistiche.")
+
+    with engine.begin() as conn:
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+        if restart:
+            conn.execute(text("DELETE FROM migration_checkpoints WHERE migration = :m"), {"m": MIGRATION_NAME})
+        done = completed_chunks(conn)
+        seasons = conn.execute(
+            text("SELECT season, COUNT(*) FROM v_full_match_stats GROUP BY season ORDER BY season")
+        ).fetchall()
+
+    todo = [(season, n) for season, n in seasons if str(season) not in done]
+    total_rows = sum(n for _, n in todo)
+    print(f"📥 {len(seasons)} stagioni in v_full_match_stats, {len(seasons) - len(todo)} già migrate (checkpoint).")
+    print(f"   Da migrare: {len(todo)} stagioni, {total_rows} righe di statistiche.")
+
+    totals = {"players": 0, "matches": 0, "stats": 0}
+    processed = 0
+    start = time.perf_counter()
+    for i, (season, n_rows) in enumerate(todo, 1):
+        t0 = time.perf_counter()
+        with engine.begin() as conn:  # Una transazione (e un checkpoint) per stagione
+            counts = migrate_season(conn, season)
+        elapsed = time.perf_counter() - t0
+        processed += n_rows
+        for key in totals:
+            totals[key] += counts[key]
+        print(f"   ✅ [{i}/{len(todo)}] Stagione {season}: {counts['players']} giocatori, "
+              f"{counts['matches']} partite, {counts['stats']} stats "
+              f"({n_rows / max(elapsed, 1e-9):,.0f} righe/s, {processed}/{total_rows})")
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Migrazione completata in {elapsed:.1f}s. Inseriti {totals['players']} giocatori, "
+          f"{totals['matches']} partite e {totals['stats']} statistiche.")
+
 
 if __name__ == "__main__":
-    migrate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Migrazione v_full_match_stats -> schema V2")
+    parser.add_argument("--restart", action="store_true", help="Ignora i checkpoint e rimigra tutte le stagioni")
+    migrate(parser.parse_args().restart)
@@ -0,0 +1,184 @@
+"""
+Player Search Index - Autocomplete in memoria
+=============================================
+Indice per /analytics/scouting/suggest costruito dalla tabella players:
+
+- Trie sui nomi normalizzati (senza accenti, lowercase): match per prefisso,
+  sia sul nome completo sia su ogni singola parola ("mart" -> "Lautaro Martínez").
+- Indice a trigrammi per i match "infix" (sottostringhe a metà parola); le query
+  di 1-2 caratteri usano posting list esatte di unigrammi/bigrammi.
+
+Ranking: prima i match sul nome completo, poi per prefisso di parola, poi infix;
+a parità si ordina per minuti giocati. L'indice viene ricostruito quando la
+versione dei dati cambia (controllata al massimo ogni REFRESH_INTERVAL_SECONDS,
+con i contatori di modifica di Postgres invece di un COUNT(*) sulle statistiche).
+"""
+
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import text
+
+REFRESH_INTERVAL_SECONDS = 60
+MAX_TRIE_CANDIDATES = 200  # Candidati raccolti nel trie prima del ranking
+
+# Classi di rilevanza (più basso = più rilevante)
+FULL_PREFIX, WORD_PREFIX, INFIX = 0, 1, 2
+
+
+def normalize(name: str) -> str:
+    nfd = unicodedata.normalize("NFD", name)
+    without_accents = "".join(
+        char for char in nfd if unicodedata.category(char) != "Mn"
+    )
+    return without_accents.lower().strip()
+
+
+def ngrams(value: str, n: int) -> set:
+    return {value[i:i + n] for i in range(len(value) - n + 1)}
+
+
+def trigrams(value: str) -> set:
+    return ngrams(value, 3)
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []  # Id dei nomi che passano da questo nodo, già ordinati per rank
+
+
+class _Index:
+    """Struttura immutabile dopo la build: letta senza lock dalle richieste."""
+
+    def __init__(self, names: list[str], minutes: list[int]):
+        # Ordine per minuti decrescenti: l'id È il rank, le liste restano ordinate
+        order = sorted(range(len(names)), key=lambda i: (-minutes[i], names[i]))
+        self.names = [names[i] for i in order]
+        self.minutes = [minutes[i] for i in order]
+        self.normalized = [normalize(n) for n in self.names]
+
+        self.root = _TrieNode()
+        self.grams: dict[str, list[int]] = {}
+        self.short_grams: dict[str, list[int]] = {}
+        for pid, norm in enumerate(self.normalized):
+            keys = {norm} | {norm[i + 1:] for i, ch in enumerate(norm) if ch in " -'"}
+            for key in keys:
+                self._insert(key, pid)
+            for gram in trigrams(norm):
+                self.grams.setdefault(gram, []).append(pid)
+            for gram in ngrams(norm, 1) | ngrams(norm, 2):
+                self.short_grams.setdefault(gram, []).append(pid)
+
+    def _insert(self, key: str, pid: int):
+        node = self.root
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+            if len(node.ids) < MAX_TRIE_CANDIDATES and (not node.ids or node.ids[-1] != pid):
+                node.ids.append(pid)
+
+    def prefix_ids(self, query: str) -> list[int]:
+        node = self.root
+        for ch in query:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return node.ids
+
+    def infix_ids(self, query: str) -> list[int]:
+        if len(query) < 3:
+            return self.short_grams.get(query, [])
+        postings = sorted((self.grams.get(g, []) for g in trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        # I trigrammi sono un filtro: la verifica finale è sulla sottostringa
+        return sorted(pid for pid in candidates if query in self.normalized[pid])
+
+    def search(self, query: str, limit: int) -> list[str]:
+        ranked = {}
+        for pid in self.prefix_ids(query):
+            ranked[pid] = FULL_PREFIX if self.normalized[pid].startswith(query) else WORD_PREFIX
+        if len(ranked) < limit:
+            # Posting list già in ordine di rank: ci fermiamo appena abbiamo abbastanza nomi
+            for pid in self.infix_ids(query):
+                if pid not in ranked:
+                    ranked[pid] = INFIX
+                    if len(ranked) >= limit:
+                        break
+        best = sorted(ranked, key=lambda pid: (ranked[pid], pid))[:limit]
+        return [self.names[pid] for pid in best]
+
+
+class PlayerSearchIndex:
+    def __init__(self, engine):
+        self.engine = engine
+        self._index: _Index | None = None
+        self._version = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _data_version(self):
+        """Marcatore di modifica economico: nessuna scansione di player_stats_v2.
+
+        I contatori di pg_stat_user_tables crescono a ogni insert/update/delete,
+        quindi anche gli upsert dei minuti (etl_live) fanno ricostruire l'indice.
+        """
+        query = text("""
+            SELECT
+                (SELECT COUNT(*) FROM players),
+                (SELECT MAX(player_id) FROM players),
+                (SELECT n_tup_ins + n_tup_upd + n_tup_del
+                 FROM pg_stat_user_tables WHERE relname = 'player_stats_v2')
+        """)
+        with self.engine.connect() as conn:
+            return tuple(conn.execute(query).fetchone())
+
+    def _load(self) -> _Index:
+        query = text("""
+            SELECT p.name, COALESCE(SUM(s.minutes), 0) AS minutes
+            FROM players p
+            LEFT JOIN player_stats_v2 s ON s.player_id = p.player_id
+            GROUP BY p.name
+        """)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+        return _Index([r[0] for r in rows], [int(r[1]) for r in rows])
+
+    def refresh(self, force: bool = False, blocking: bool = True):
+        """Ricostruisce l'indice se i dati sono cambiati (swap atomico del riferimento).
+
+        Con blocking=False, se un altro thread sta già aggiornando si esce subito
+        e si continua a servire l'indice corrente.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            if not force and self._index is not None and time.monotonic() - self._last_check < REFRESH_INTERVAL_SECONDS:
+                return
+            version = self._data_version()
+            if force or version != self._version or self._index is None:
+                start = time.perf_counter()
+                self._index = self._load()
+                self._version = version
+                print(f"🔎 Indice ricerca giocatori: {len(self._index.names)} nomi in {time.perf_counter() - start:.2f}s")
+            self._last_check = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def suggest(self, q: str, limit: int = 10) -> list[str]:
+        query = normalize(q or "")
+        if not query:
+            return []
+        if self._index is None:
+            self.refresh()
+        elif time.monotonic() - self._last_check >= REFRESH_INTERVAL_SECONDS:
+            self.refresh(blocking=False)
+        return self._index.search(query, limit)
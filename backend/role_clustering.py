@@ -0,0 +1,171 @@
+"""
+Role Clustering - Batch Job
+===========================
+Raggruppa tutte le player-season in ruoli statistici (MiniBatchKMeans sulle feature
+per 90) e salva assegnazioni e centroidi su DB:
+
+- role_centroids: un record per cluster (centroide grezzo e standardizzato + etichetta)
+- player_roles:   (player_id, season) -> cluster_id, role
+
+L'etichetta del cluster si ottiene applicando le regole di CalibratedValuation.infer_role
+al centroide, così valutazione e scouting condividono la stessa label.
+Lo scouting usa i centroidi standardizzati per restringere la ricerca ai cluster vicini.
+"""
+
+import argparse
+import os
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from sqlalchemy import create_engine, text
+
+from scouting_service import FEATURE_COLUMNS, FEATURE_METRICS
+from valuation_engine_v3 import CalibratedValuation
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', 'data-processing', '.env'))
+
+N_CLUSTERS = 6
+MIN_MINUTES = 450
+RANDOM_STATE = 42
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS role_centroids (
+        cluster_id INTEGER PRIMARY KEY,
+        role TEXT NOT NULL,
+        n_members INTEGER NOT NULL,
+        features TEXT[] NOT NULL,
+        centroid DOUBLE PRECISION[] NOT NULL,
+        centroid_z DOUBLE PRECISION[] NOT NULL,
+        fitted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS player_roles (
+        player_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        cluster_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        PRIMARY KEY (player_id, season)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_player_roles_season ON player_roles (season)",
+]
+
+
+def get_engine():
+    db_password = os.getenv('DB_PASSWORD')
+    encoded_password = urllib.parse.quote_plus(db_password)
+    return create_engine(f"postgresql://{os.getenv('DB_USER')}:{encoded_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+
+
+def load_player_seasons(engine, min_minutes: int = MIN_MINUTES) -> pd.DataFrame:
+    """Una riga per player-season con le feature per 90."""
+    sums = ",\n                ".join(f"SUM({m}) AS {m}" for m in FEATURE_METRICS)
+    query = text(f"""
+        SELECT
+            player_id,
+            trim(season) AS season,
+            {sums},
+            SUM(minutes) AS minutes
+        FROM v_full_match_stats
+        GROUP BY player_id, trim(season)
+        HAVING SUM(minutes) >= :min_minutes
+    """)
+    df = pd.read_sql(query, engine, params={"min_minutes": int(min_minutes)})
+    for m in FEATURE_METRICS:
+        df[f"{m}_p90"] = (df[m].astype(float) / df["minutes"]) * 90
+    return df
+
+
+def fit_roles(df: pd.DataFrame, n_clusters: int = N_CLUSTERS):
+    """Restituisce (assegnazioni, centroidi) come DataFrame."""
+    scaler = StandardScaler()
+    X = scaler.fit_transform(df[FEATURE_COLUMNS])
+
+    kmeans = MiniBatchKMeans(
+        n_clusters=n_clusters,
+        random_state=RANDOM_STATE,
+        batch_size=1024,
+        n_init=10,
+    )
+    labels = kmeans.fit_predict(X)
+
+    centroids_z = kmeans.cluster_centers_
+    centroids_raw = scaler.inverse_transform(centroids_z)
+    raw = pd.DataFrame(centroids_raw, columns=FEATURE_COLUMNS)
+    centroids = pd.DataFrame({
+        "cluster_id": np.arange(n_clusters),
+        "role": [
+            CalibratedValuation.infer_role(r["goals_p90"], r["assists_p90"], r["shots_p90"])
+            for _, r in raw.iterrows()
+        ],
+        "n_members": np.bincount(labels, minlength=n_clusters),
+        "centroid": [list(map(float, c)) for c in centroids_raw],
+        "centroid_z": [list(map(float, c)) for c in centroids_z],
+    })
+
+    assignments = df[["player_id", "season"]].copy()
+    assignments["cluster_id"] = labels
+    assignments["role"] = centroids["role"].to_numpy()[labels]
+    return assignments, centroids
+
+
+def save_roles(engine, assignments: pd.DataFrame, centroids: pd.DataFrame):
+    with engine.begin() as conn:
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+        # I cluster vengono rinumerati a ogni fit: sostituiamo tutto in un'unica transazione
+        conn.execute(text("TRUNCATE TABLE player_roles, role_centroids"))
+        conn.execute(
+            text("""
+                INSERT INTO role_centroids (cluster_id, role, n_members, features, centroid, centroid_z)
+                VALUES (:cluster_id, :role, :n_members, :features, :centroid, :centroid_z)
+            """),
+            [
+                {**rec, "cluster_id": int(rec["cluster_id"]), "n_members": int(rec["n_members"]), "features": FEATURE_COLUMNS}
+                for rec in centroids.to_dict("records")
+            ],
+        )
+        conn.execute(
+            text("""
+                INSERT INTO player_roles (player_id, season, cluster_id, role)
+                VALUES (:player_id, :season, :cluster_id, :role)
+            """),
+            [
+                {"player_id": int(r.player_id), "season": r.season, "cluster_id": int(r.cluster_id), "role": r.role}
+                for r in assignments.itertuples(index=False)
+            ],
+        )
+
+
+def run(n_clusters: int = N_CLUSTERS, min_minutes: int = MIN_MINUTES):
+    print("🧭 Avvio clustering ruoli...")
+    start = time.perf_counter()
+    engine = get_engine()
+
+    df = load_player_seasons(engine, min_minutes)
+    if len(df) < n_clusters:
+        print("❌ Dati insufficienti per il clustering.")
+        return
+    print(f"📊 {len(df)} player-season caricate")
+
+    assignments, centroids = fit_roles(df, n_clusters)
+    save_roles(engine, assignments, centroids)
+
+    for rec in centroids.itertuples(index=False):
+        print(f"   Cluster {rec.cluster_id}: {rec.role:<11} ({rec.n_members} player-season)")
+    print(f"✅ Ruoli salvati in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clustering ruoli sulle feature per 90")
+    parser.add_argument("--clusters", type=int, default=N_CLUSTERS)
+    parser.add_argument("--min-minutes", type=int, default=MIN_MINUTES)
+    args = parser.parse_args()
+    run(n_clusters=args.clusters, min_minutes=args.min_minutes)
@@ -0,0 +1,54 @@
+"""
+Row Checksum - Impronta del contenuto di una tabella/vista
+==========================================================
+Checksum delle righe lette da un job (stesse colonne, ordine di chiave fisso),
+per capire se dati già elaborati sono cambiati: a differenza di COUNT/SUM su
+poche colonne, vede anche le correzioni tardive di npxg, tiri, assist, squadra.
+
+Su PostgreSQL è un md5(string_agg(...)) calcolato dal server (una riga per
+gruppo); sugli altri dialetti (SQLite nei test) le righe vengono lette in ordine
+e accumulate nell'hash lato client. Stessa logica di pipeline.TableChecksum.
+"""
+
+import hashlib
+
+from sqlalchemy import text
+
+
+def checksum_query(dialect: str, source: str, columns: tuple, order_by: tuple,
+                   where: str | None = None, group_by: str | None = None) -> str:
+    row = f"CAST(ROW({', '.join(columns)}) AS TEXT)"
+    group = group_by or "NULL"
+    condition = f" WHERE {where}" if where else ""
+    if dialect == "postgresql":
+        # La riga intera come ultimo criterio: ordine deterministico anche a parità di chiave
+        order = ", ".join((*order_by, row))
+        grouping = " GROUP BY 1" if group_by else ""
+        return (f"SELECT {group} AS grp, count(*), md5(string_agg({row}, ',' ORDER BY {order})) "
+                f"FROM {source}{condition}{grouping}")
+    order = ", ".join(("grp", *order_by, *columns))
+    return f"SELECT {group} AS grp, {', '.join(columns)} FROM {source}{condition} ORDER BY {order}"
+
+
+def table_checksums(conn, source: str, columns: tuple, order_by: tuple, where: str | None = None,
+                    params: dict | None = None, group_by: str | None = None) -> dict:
+    """{gruppo: {"n_rows", "checksum"}} (gruppo None senza group_by)."""
+    dialect = conn.engine.dialect.name
+    query = text(checksum_query(dialect, source, columns, order_by, where, group_by))
+    result = conn.execute(query, params or {})
+    if dialect == "postgresql":
+        return {
+            grp: {"n_rows": int(n_rows), "checksum": digest or ""}
+            for grp, n_rows, digest in result
+            if n_rows or not group_by
+        }
+
+    digests, counts = {}, {}
+    for row in result:  # Riga per riga: nessun fetchall
+        grp = row[0]
+        digests.setdefault(grp, hashlib.md5()).update(repr(tuple(row[1:])).encode("utf-8"))
+        counts[grp] = counts.get(grp, 0) + 1
+    checksums = {grp: {"n_rows": counts[grp], "checksum": d.hexdigest()} for grp, d in digests.items()}
+    if not group_by and not checksums:
+        checksums[None] = {"n_rows": 0, "checksum": ""}
+    return checksums
@@ -1,5 +1,8 @@
 import sys
+import threading
+import time
 import unicodedata
+from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
@@ -13,17 +16,97 @@ if str(MODULE_DIR) not in sys.path:
 
 import similarity_engine
 
+FEATURE_METRICS = ["goals", "assists", "npxg", "shots", "shots_on_target"]
+FEATURE_COLUMNS = [f"{m}_p90" for m in FEATURE_METRICS]
+
+# Profili di similarità: feature -> peso (più alto = deve essere più simile).
+# La matrice normalizzata contiene già tutte le FEATURE_COLUMNS, quindi un nuovo
+# profilo non richiede né ricompilare il motore né rileggere il database.
+FEATURE_PROFILES = {
+    "default": {
+        "goals_p90": 0.5,
+        "assists_p90": 0.5,
+        "npxg_p90": 1.5,  # Capacità di smarcarsi
+        "shots_on_target_p90": 1.0,
+    },
+    "finisher": {
+        "goals_p90": 1.5,
+        "npxg_p90": 1.5,
+        "shots_on_target_p90": 1.0,
+    },
+    "creator": {
+        "assists_p90": 1.5,
+        "goals_p90": 0.5,
+        "npxg_p90": 0.5,
+    },
+    "shooter": {
+        "shots_p90": 1.5,
+        "shots_on_target_p90": 1.0,
+        "npxg_p90": 0.5,
+    },
+}
+
+DISTANCE_METRICS = {
+    "euclidean": similarity_engine.Metric.WEIGHTED_EUCLIDEAN,
+    "cosine": similarity_engine.Metric.COSINE,
+    "mahalanobis": similarity_engine.Metric.MAHALANOBIS,  # I pesi sono ignorati (invarianza di scala)
+}
+
+ROLE_SCOPES = ("all", "same", "nearby")
+NEARBY_CLUSTERS = 1  # Cluster vicini aggiunti a quello del target con role_scope="nearby"
+
+SNAPSHOT_TTL_SECONDS = 300  # Dopo 5 minuti lo snapshot viene ricostruito dal DB
+
+ALGORITHM_LABELS = {
+    "euclidean": "weighted_euclidean_cpp",
+    "cosine": "weighted_cosine_cpp",
+    "mahalanobis": "mahalanobis_cpp",
+}
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array = np.ascontiguousarray(array)
+    array.flags.writeable = False
+    return array
+
+
+@dataclass(frozen=True)
+class ScoutingSnapshot:
+    """Dataset immutabile di una (stagione, min_minutes), condiviso in sola lettura tra i thread.
+
+    Gli array sono allineati per riga e non scrivibili: le richieste concorrenti
+    leggono lo stesso snapshot senza lock. Un dato nuovo produce un nuovo snapshot,
+    quello vecchio resta valido per chi lo sta ancora usando.
+    """
+    season: str
+    min_minutes: int
+    built_at: float
+    player_names: np.ndarray
+    normalized_names: pd.Series
+    name_index: dict           # nome normalizzato -> prima riga (lookup O(1) del target)
+    team_ids: np.ndarray
+    roles: np.ndarray
+    features_p90: np.ndarray   # FEATURE_COLUMNS grezze (per la risposta)
+    matrix: np.ndarray         # FEATURE_COLUMNS normalizzate MinMax
+    covariance: np.ndarray     # Covarianza di matrix (Mahalanobis su sottoinsiemi di feature)
+    fair_value: np.ndarray
+    age: np.ndarray
+    team_code: np.ndarray
+    minutes: np.ndarray
+    cluster_id: np.ndarray
+    teams: tuple
+    cluster_centers: dict      # cluster_id -> centroide standardizzato
+    cluster_rows: dict         # cluster_id -> indici riga (int32)
+
+    def __len__(self) -> int:
+        return len(self.player_names)
+
 
 class ScoutingService:
     def __init__(self, engine):
         self.engine = engine
-        self.scaler = MinMaxScaler()
-        self.weights = np.array([
-            0.5,  # goals_p90
-            0.5,  # assists_p90
-            1.5,  # npxg_p90
-            1.0,  # shots_on_target_p90
-        ])
+        self._snapshots: dict[tuple[str, int], ScoutingSnapshot] = {}
+        self._build_lock = threading.Lock()
 
     @staticmethod
     def _normalize_name(name: str) -> str:
@@ -36,16 +119,18 @@ class ScoutingService:
     def _load_player_data(self, season: str) -> pd.DataFrame:
         query = text("""
             SELECT
-                player_name,
-                team_id,
-                goals,
-                assists,
-                npxg,
-                shots_on_target,
-                minutes,
-                fair_value
-            FROM v_full_match_stats
-            WHERE trim(season) = :season
+                v.player_name,
+                v.team_id,
+                v.goals,
+                v.assists,
+                v.npxg,
+                v.shots,
+                v.shots_on_target,
+                v.minutes,
+                p.birth_date
+            FROM v_full_match_stats v
+            LEFT JOIN players p ON p.player_id = v.player_id
+            WHERE trim(v.season) = :season
         """)
         try:
             return pd.read_sql(query, self.engine, params={"season": str(season)})
@@ -55,8 +140,57 @@ class ScoutingService:
             df = df.rename(columns={"xa": "npxg"})
             return df
 
+    def _load_valuations(self, season: str) -> pd.DataFrame:
+        """Fair value stagionale da player_season_valuations (valuation_engine_v3.py)."""
+        query = text("""
+            SELECT p.name AS player_name, pv.fair_value
+            FROM player_season_valuations pv
+            JOIN players p ON p.player_id = pv.player_id
+            WHERE pv.season = :season
+        """)
+        try:
+            valuations = pd.read_sql(query, self.engine, params={"season": str(season).strip()})
+        except Exception:
+            # Valutazione mai eseguita: nessun fair value, i filtri relativi escludono tutti
+            valuations = pd.DataFrame(columns=["player_name", "fair_value"])
+        return valuations.drop_duplicates("player_name")
+
+    def _load_roles(self, season: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Assegnazioni di ruolo e centroidi dal batch di role_clustering.py."""
+        roles_query = text("""
+            SELECT p.name AS player_name, r.cluster_id, r.role
+            FROM player_roles r
+            JOIN players p ON p.player_id = r.player_id
+            WHERE r.season = :season
+        """)
+        centroids_query = text("SELECT cluster_id, centroid_z FROM role_centroids ORDER BY cluster_id")
+        try:
+            roles = pd.read_sql(roles_query, self.engine, params={"season": str(season).strip()})
+            centroids = pd.read_sql(centroids_query, self.engine)
+        except Exception:
+            # Clustering mai eseguito: nessun ruolo, ricerca su tutti i candidati
+            roles = pd.DataFrame(columns=["player_name", "cluster_id", "role"])
+            centroids = pd.DataFrame(columns=["cluster_id", "centroid_z"])
+        return roles, centroids
+
+    @staticmethod
+    def _role_candidates(snapshot: ScoutingSnapshot, target_cluster: int, role_scope: str):
+        """Indici delle righe da scandire per lo scope di ruolo (None = tutte)."""
+        if role_scope == "all" or target_cluster not in snapshot.cluster_rows:
+            return None
+        allowed = [target_cluster]
+        if role_scope == "nearby" and target_cluster in snapshot.cluster_centers:
+            target_center = snapshot.cluster_centers[target_cluster]
+            by_distance = sorted(
+                snapshot.cluster_centers,
+                key=lambda cid: float(np.linalg.norm(snapshot.cluster_centers[cid] - target_center)),
+            )
+            allowed = by_distance[: 1 + NEARBY_CLUSTERS]
+        rows = [snapshot.cluster_rows[cid] for cid in allowed if cid in snapshot.cluster_rows]
+        return np.sort(np.concatenate(rows))
+
     def _aggregate_players(self, df: pd.DataFrame, min_minutes: int) -> pd.DataFrame:
-        metrics = ["goals", "assists", "npxg", "shots_on_target"]
+        metrics = FEATURE_METRICS
         team_minutes = (
             df.groupby(["player_name", "team_id"], as_index=False)["minutes"]
             .sum()
@@ -65,15 +199,100 @@ class ScoutingService:
         team_primary = team_minutes.drop_duplicates("player_name")
 
         totals = df.groupby("player_name", as_index=False)[metrics + ["minutes"]].sum()
-        fair_values = df.groupby("player_name", as_index=False)["fair_value"].mean()
+        birth_dates = df.groupby("player_name", as_index=False)["birth_date"].first()
 
         merged = totals.merge(team_primary[["player_name", "team_id"]], on="player_name")
-        merged = merged.merge(fair_values, on="player_name", how="left")
+        merged = merged.merge(birth_dates, on="player_name", how="left")
 
         merged = merged[merged["minutes"] > int(min_minutes)].reset_index(drop=True)
         return merged
 
-    def find_similar(self, player_name: str, season: str = "2025", min_minutes: int = 90, top_n: int = 5):
+    @staticmethod
+    def _attribute_arrays(df: pd.DataFrame) -> dict:
+        """Array contigui per i filtri del motore C++ (uno per attributo, allineati alle righe)."""
+        fair_value = pd.to_numeric(df["fair_value"], errors="coerce").to_numpy(dtype=np.float64, copy=True)
+        fair_value[~(fair_value > 0)] = np.nan  # 0 = non ancora valutato
+
+        birth = pd.to_datetime(df["birth_date"], errors="coerce")
+        age = ((pd.Timestamp.now() - birth).dt.days / 365.25).to_numpy(dtype=np.float64)
+
+        team_code, teams = pd.factorize(df["team_id"])
+        return {
+            "fair_value": fair_value,
+            "age": age,
+            "team_code": team_code.astype(np.int32),
+            "minutes": df["minutes"].to_numpy(dtype=np.float64),
+            "teams": list(teams),
+        }
+
+    @staticmethod
+    def _build_filter(snapshot: ScoutingSnapshot, target_idx: int, criteria: dict):
+        flt = similarity_engine.SimilarityFilter()
+        bounds = {
+            "min_fair_value": criteria.get("min_fair_value"),
+            "max_fair_value": criteria.get("max_fair_value"),
+            "min_age": criteria.get("min_age"),
+            "max_age": criteria.get("max_age"),
+            "min_minutes": criteria.get("candidate_min_minutes"),
+        }
+        for field, value in bounds.items():
+            if value is not None:
+                setattr(flt, field, float(value))
+
+        teams = snapshot.teams
+        team = criteria.get("team")
+        if team:
+            # Squadra sconosciuta -> codice inesistente, nessun candidato
+            flt.include_team = teams.index(team) if team in teams else len(teams)
+        exclude_team = criteria.get("exclude_team")
+        if criteria.get("exclude_same_team"):
+            exclude_team = teams[snapshot.team_code[target_idx]]
+        if exclude_team and exclude_team in teams:
+            flt.exclude_team = teams.index(exclude_team)
+        return flt
+
+    @staticmethod
+    def _resolve_weights(profile: str, weights: str | None) -> tuple[list[str], np.ndarray]:
+        """Colonne e pesi per la richiesta: profilo nominato o pesi custom ("npxg_p90:2,goals_p90:1")."""
+        if weights:
+            spec = {}
+            for item in weights.split(","):
+                name, sep, value = item.partition(":")
+                name = name.strip()
+                if not sep or name not in FEATURE_COLUMNS:
+                    raise ValueError(f"Peso non valido: '{item}'. Feature disponibili: {FEATURE_COLUMNS}")
+                spec[name] = float(value)
+        elif profile in FEATURE_PROFILES:
+            spec = FEATURE_PROFILES[profile]
+        else:
+            raise ValueError(f"Profilo sconosciuto: '{profile}'. Disponibili: {list(FEATURE_PROFILES)}")
+
+        if any(w < 0 for w in spec.values()) or not any(w > 0 for w in spec.values()):
+            raise ValueError("I pesi devono essere >= 0 e almeno uno positivo.")
+        return list(spec), np.array(list(spec.values()), dtype=np.float64)
+
+    @staticmethod
+    def _expand_profile(feature_cols: list[str], feature_weights: np.ndarray, covariance, metric: str):
+        """Pesi (e inversa di covarianza) estesi a tutte le FEATURE_COLUMNS."""
+        col_idx = [FEATURE_COLUMNS.index(c) for c in feature_cols]
+        full_weights = np.zeros(len(FEATURE_COLUMNS))
+        full_weights[col_idx] = feature_weights
+
+        cov_inv = None
+        if metric == "mahalanobis":
+            cov_inv = np.zeros((len(FEATURE_COLUMNS), len(FEATURE_COLUMNS)))
+            cov_inv[np.ix_(col_idx, col_idx)] = np.linalg.pinv(covariance[np.ix_(col_idx, col_idx)])
+        return full_weights, cov_inv
+
+    @staticmethod
+    def _similarity_pct(score: float, metric: str) -> float:
+        if metric == "cosine":
+            return max(0.0, 100 * (1 - score))
+        if metric == "mahalanobis":
+            return 100 / (1 + score)
+        return max(0.0, 100 - (score * 20))
+
+    def _build_snapshot(self, season: str, min_minutes: int) -> ScoutingSnapshot:
         df = self._load_player_data(season)
         if df.empty:
             raise ValueError("Nessun dato trovato per lo scouting.")
@@ -82,63 +301,185 @@ class ScoutingService:
         if df.empty:
             raise ValueError("Nessun dato trovato per lo scouting.")
 
-        df = df.reset_index(drop=True)
-        df["normalized_name"] = df["player_name"].apply(self._normalize_name)
+        roles, centroids = self._load_roles(season)
+        df = df.merge(roles, on="player_name", how="left")
+        df = df.merge(self._load_valuations(season), on="player_name", how="left").reset_index(drop=True)
+        df["cluster_id"] = df["cluster_id"].fillna(-1).astype(int)
+
+        for m in FEATURE_METRICS:
+            df[f"{m}_p90"] = (df[m] / df["minutes"]) * 90
+
+        # Scaler locale alla build: nessuno stato condiviso tra le richieste
+        matrix = MinMaxScaler().fit_transform(df[FEATURE_COLUMNS])
+        covariance = np.atleast_2d(np.cov(matrix, rowvar=False))
+        attributes = self._attribute_arrays(df)
+
+        normalized_names = df["player_name"].apply(self._normalize_name)
+        cluster_id = df["cluster_id"].to_numpy(dtype=np.int32)
+        cluster_rows = {
+            int(cid): _frozen(np.flatnonzero(cluster_id == cid).astype(np.int32))
+            for cid in np.unique(cluster_id) if cid >= 0
+        }
+        cluster_centers = {
+            int(rec.cluster_id): _frozen(np.asarray(rec.centroid_z, dtype=np.float64))
+            for rec in centroids.itertuples(index=False)
+        }
+
+        return ScoutingSnapshot(
+            season=str(season),
+            min_minutes=int(min_minutes),
+            built_at=time.monotonic(),
+            player_names=_frozen(df["player_name"].to_numpy(dtype=object)),
+            normalized_names=normalized_names,
+            name_index={name: i for i, name in reversed(list(enumerate(normalized_names)))},
+            team_ids=_frozen(df["team_id"].to_numpy(dtype=object)),
+            roles=_frozen(df["role"].where(df["role"].notna(), None).to_numpy(dtype=object)),
+            features_p90=_frozen(df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)),
+            matrix=_frozen(matrix.astype(np.float64)),
+            covariance=_frozen(covariance),
+            fair_value=_frozen(attributes["fair_value"]),
+            age=_frozen(attributes["age"]),
+            team_code=_frozen(attributes["team_code"]),
+            minutes=_frozen(attributes["minutes"]),
+            cluster_id=_frozen(cluster_id),
+            teams=tuple(attributes["teams"]),
+            cluster_centers=cluster_centers,
+            cluster_rows=cluster_rows,
+        )
+
+    def get_snapshot(self, season: str = "2025", min_minutes: int = 90) -> ScoutingSnapshot:
+        """Snapshot corrente per (season, min_minutes); costruito una volta sola anche sotto carico."""
+        key = (str(season), int(min_minutes))
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and time.monotonic() - snapshot.built_at < SNAPSHOT_TTL_SECONDS:
+            return snapshot
+
+        with self._build_lock:
+            # Double-checked: un altro thread potrebbe averlo appena ricostruito
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or time.monotonic() - snapshot.built_at >= SNAPSHOT_TTL_SECONDS:
+                snapshot = self._build_snapshot(*key)
+                self._snapshots[key] = snapshot  # Swap atomico del riferimento
+            return snapshot
+
+    def invalidate(self, season: str | None = None):
+        """Scarta gli snapshot (tutti o di una stagione) dopo un aggiornamento dei dati."""
+        with self._build_lock:
+            for key in list(self._snapshots):
+                if season is None or key[0] == str(season):
+                    del self._snapshots[key]
+
+    def find_similar(
+        self,
+        player_name: str,
+        season: str = "2025",
+        min_minutes: int = 90,
+        top_n: int = 5,
+        min_fair_value: float | None = None,
+        max_fair_value: float | None = None,
+        min_age: float | None = None,
+        max_age: float | None = None,
+        team: str | None = None,
+        exclude_team: str | None = None,
+        exclude_same_team: bool = False,
+        candidate_min_minutes: int | None = None,
+        profile: str = "default",
+        weights: str | None = None,
+        metric: str = "euclidean",
+        role_scope: str = "all",
+    ):
+        if metric not in DISTANCE_METRICS:
+            raise ValueError(f"Metrica sconosciuta: '{metric}'. Disponibili: {list(DISTANCE_METRICS)}")
+        if role_scope not in ROLE_SCOPES:
+            raise ValueError(f"role_scope non valido: '{role_scope}'. Disponibili: {list(ROLE_SCOPES)}")
+        feature_cols, feature_weights = self._resolve_weights(profile, weights)
+
+        snapshot = self.get_snapshot(season, min_minutes)
+        names = snapshot.normalized_names
 
         target_norm = self._normalize_name(player_name)
-        target_rows = df.index[df["normalized_name"] == target_norm].tolist()
-        if not target_rows:
-            starts_with = df["normalized_name"].str.startswith(target_norm)
-            contains = df["normalized_name"].str.contains(target_norm)
-            fallback = df.index[starts_with | contains].tolist()
-            if not fallback:
+        target_idx = snapshot.name_index.get(target_norm)
+        if target_idx is None:
+            starts_with = names.str.startswith(target_norm)
+            contains = names.str.contains(target_norm, regex=False)
+            fallback = np.flatnonzero((starts_with | contains).to_numpy())
+            if len(fallback) == 0:
                 raise ValueError("Giocatore non trovato o minuti insufficienti.")
-            target_rows = [fallback[0]]
+            target_idx = int(fallback[0])
 
-        target_idx = target_rows[0]
-        target_player_name = df.loc[target_idx, "player_name"]
+        target_player_name = snapshot.player_names[target_idx]
 
-        metrics = ["goals", "assists", "npxg", "shots_on_target"]
-        for m in metrics:
-            df[f"{m}_p90"] = (df[m] / df["minutes"]) * 90
+        # Nessuna copia della matrice per profilo: le feature escluse hanno peso 0
+        # (e righe/colonne nulle nell'inversa di Mahalanobis), contributo esattamente nullo.
+        matrix = snapshot.matrix
+        full_weights, cov_inv = self._expand_profile(feature_cols, feature_weights, snapshot.covariance, metric)
 
-        cols_p90 = [f"{m}_p90" for m in metrics]
-        matrix = self.scaler.fit_transform(df[cols_p90])
+        criteria = {
+            "min_fair_value": min_fair_value,
+            "max_fair_value": max_fair_value,
+            "min_age": min_age,
+            "max_age": max_age,
+            "team": team,
+            "exclude_team": exclude_team,
+            "exclude_same_team": exclude_same_team,
+            "candidate_min_minutes": candidate_min_minutes,
+        }
+        flt = self._build_filter(snapshot, target_idx, criteria)
+
+        target_cluster = int(snapshot.cluster_id[target_idx])
+        candidates = self._role_candidates(snapshot, target_cluster, role_scope)
 
-        results = similarity_engine.find_similar(
+        # Filtri applicati nel motore prima del top-k: niente over-fetch lato Python.
+        # La scansione C++ rilascia il GIL, quindi le richieste scalano sui core.
+        results = similarity_engine.find_similar_filtered(
             matrix[target_idx],
             matrix,
-            self.weights,
+            full_weights,
             int(top_n),
+            target_idx,
+            flt,
+            snapshot.fair_value,
+            snapshot.age,
+            snapshot.team_code,
+            snapshot.minutes,
+            DISTANCE_METRICS[metric],
+            cov_inv,
+            candidates,
         )
 
+        p90 = dict(zip(FEATURE_COLUMNS, range(len(FEATURE_COLUMNS))))
         matches = []
         for res in results:
             idx = res.index
-            if idx == target_idx:
-                continue
-
-            row = df.iloc[idx]
-            similarity = max(0.0, 100 - (res.score * 20))
+            features = snapshot.features_p90[idx]
+            fair_value = snapshot.fair_value[idx]
+            age = snapshot.age[idx]
             matches.append({
-                "player": row["player_name"],
-                "team": row["team_id"],
-                "similarity": round(similarity, 1),
+                "player": snapshot.player_names[idx],
+                "team": snapshot.team_ids[idx],
+                "role": snapshot.roles[idx],
+                "similarity": round(self._similarity_pct(res.score, metric), 1),
                 "data": {
-                    "goals_p90": round(row["goals_p90"], 3),
-                    "assists_p90": round(row["assists_p90"], 3),
-                    "npxg_p90": round(row["npxg_p90"], 3),
-                    "shots_on_target_p90": round(row["shots_on_target_p90"], 3),
-                    "xg_p90": round(row["npxg_p90"], 3),
-                    "fair_value": float(row["fair_value"] or 0),
+                    "goals_p90": round(features[p90["goals_p90"]], 3),
+                    "assists_p90": round(features[p90["assists_p90"]], 3),
+                    "npxg_p90": round(features[p90["npxg_p90"]], 3),
+                    "shots_p90": round(features[p90["shots_p90"]], 3),
+                    "shots_on_target_p90": round(features[p90["shots_on_target_p90"]], 3),
+                    "xg_p90": round(features[p90["npxg_p90"]], 3),
+                    "fair_value": 0.0 if np.isnan(fair_value) else float(fair_value),
+                    "age": None if np.isnan(age) else round(float(age), 1),
                 },
             })
-            if len(matches) >= int(top_n):
-                break
 
         return {
             "target": target_player_name,
-            "position": "UNKNOWN",
+            "position": snapshot.roles[target_idx] or "UNKNOWN",
+            "role_cluster": target_cluster if target_cluster >= 0 else None,
+            "role_scope": role_scope,
             "matches": matches,
-            "algorithm": "weighted_euclidean_cpp",
+            "filters": {k: v for k, v in criteria.items() if v not in (None, False)},
+            "profile": "custom" if weights else profile,
+            "weights": dict(zip(feature_cols, feature_weights.tolist())),
+            "metric": metric,
+            "algorithm": ALGORITHM_LABELS[metric],
         }
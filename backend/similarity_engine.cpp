@@ -1,8 +1,13 @@
 #include <vector>
 #include <cmath>
 #include <algorithm>
+#include <cstdint>
+#include <limits>
+#include <queue>
+#include <stdexcept>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 
 namespace py = pybind11;
 
@@ -52,13 +57,309 @@ std::vector<MatchResult> find_similar_players(
     return results;
 }
 
+// ============================================
+// FILTER PUSHDOWN
+// ============================================
+// I filtri vengono valutati dentro la scansione, PRIMA della selezione top-k:
+// un candidato scartato non costa nemmeno il calcolo della distanza.
+// Un limite infinito (default) significa "filtro disattivato"; un attributo NaN
+// (età o fair value sconosciuti) non supera mai un filtro attivo.
+struct SimilarityFilter {
+    double min_fair_value = -std::numeric_limits<double>::infinity();
+    double max_fair_value = std::numeric_limits<double>::infinity();
+    double min_age = -std::numeric_limits<double>::infinity();
+    double max_age = std::numeric_limits<double>::infinity();
+    double min_minutes = -std::numeric_limits<double>::infinity();
+    double max_minutes = std::numeric_limits<double>::infinity();
+    int include_team = -1;  // Codice squadra richiesto (-1 = tutte)
+    int exclude_team = -1;  // Codice squadra da escludere (-1 = nessuna)
+    int exclude_group = -1; // Codice di gruppo da escludere (-1 = nessuno), vedi group_code
+};
+
+typedef py::array_t<double, py::array::c_style | py::array::forcecast> DoubleArray;
+typedef py::array_t<int32_t, py::array::c_style | py::array::forcecast> IntArray;
+
+// Range [lo, hi] attivo solo se almeno un estremo è finito
+struct RangeCheck {
+    double lo, hi;
+    bool active;
+
+    RangeCheck(double lo_, double hi_)
+        : lo(lo_), hi(hi_), active(std::isfinite(lo_) || std::isfinite(hi_)) {}
+
+    bool passes(double value) const {
+        return !active || (value >= lo && value <= hi);  // NaN -> false
+    }
+};
+
+static void check_length(const py::buffer_info& info, py::ssize_t n, const char* name) {
+    if (info.ndim != 1 || info.shape[0] != n) {
+        throw std::invalid_argument(std::string(name) + ": lunghezza diversa dal numero di giocatori");
+    }
+}
+
+// ============================================
+// METRICHE DI DISTANZA
+// ============================================
+// Tutte lavorano su righe contigue (n x d, row-major) di dimensione arbitraria:
+// i loop interni sono lineari in memoria e il compilatore li vettorizza con -O3.
+enum Metric {
+    WEIGHTED_EUCLIDEAN = 0,
+    COSINE = 1,
+    MAHALANOBIS = 2
+};
+
+// Chiave di ordinamento: distanza al quadrato per euclidea/mahalanobis
+// (la sqrt è monotona, la applichiamo solo ai k finali), 1 - cos per il coseno.
+static inline double weighted_sq_euclidean(const double* a, const double* b, const double* w, py::ssize_t d) {
+    double acc = 0.0;
+    for (py::ssize_t j = 0; j < d; ++j) {
+        double diff = a[j] - b[j];
+        acc += w[j] * (diff * diff);
+    }
+    return acc;
+}
+
+static inline double weighted_cosine_distance(
+    const double* a, const double* b, const double* w, py::ssize_t d, double norm_a
+) {
+    double dot = 0.0;
+    double norm_b = 0.0;
+    for (py::ssize_t j = 0; j < d; ++j) {
+        dot += w[j] * a[j] * b[j];
+        norm_b += w[j] * b[j] * b[j];
+    }
+    if (norm_a <= 0.0 || norm_b <= 0.0) {
+        return 1.0;  // Vettore nullo: nessuna direzione, similarità neutra
+    }
+    return 1.0 - dot / (std::sqrt(norm_a) * std::sqrt(norm_b));
+}
+
+// (a - b)^T S (a - b) con S = inversa della covarianza (d x d, row-major)
+static inline double sq_mahalanobis(
+    const double* a, const double* b, const double* s_inv, py::ssize_t d, double* diff
+) {
+    for (py::ssize_t j = 0; j < d; ++j) {
+        diff[j] = a[j] - b[j];
+    }
+    double acc = 0.0;
+    for (py::ssize_t r = 0; r < d; ++r) {
+        const double* s_row = s_inv + r * d;
+        double row_dot = 0.0;
+        for (py::ssize_t c = 0; c < d; ++c) {
+            row_dot += s_row[c] * diff[c];
+        }
+        acc += diff[r] * row_dot;
+    }
+    return acc > 0.0 ? acc : 0.0;  // Rumore numerico della pseudo-inversa
+}
+
+std::vector<MatchResult> find_similar_filtered(
+    DoubleArray target,
+    DoubleArray matrix,
+    DoubleArray weights,
+    int top_n,
+    int exclude_index,
+    const SimilarityFilter& filter,
+    DoubleArray fair_value,
+    DoubleArray age,
+    IntArray team_code,
+    DoubleArray minutes,
+    Metric metric,
+    py::object cov_inv,
+    py::object candidates,
+    py::object group_code
+) {
+    py::buffer_info m = matrix.request();
+    if (m.ndim != 2) {
+        throw std::invalid_argument("matrix deve essere 2D (giocatori x feature)");
+    }
+    const py::ssize_t n = m.shape[0];
+    const py::ssize_t d = m.shape[1];
+
+    py::buffer_info t = target.request();
+    py::buffer_info w = weights.request();
+    check_length(t, d, "target");
+    check_length(w, d, "weights");
+
+    py::buffer_info fv = fair_value.request();
+    py::buffer_info ag = age.request();
+    py::buffer_info tc = team_code.request();
+    py::buffer_info mn = minutes.request();
+    check_length(fv, n, "fair_value");
+    check_length(ag, n, "age");
+    check_length(tc, n, "team_code");
+    check_length(mn, n, "minutes");
+
+    DoubleArray s_inv_array;
+    const double* s_inv = nullptr;
+    if (metric == MAHALANOBIS) {
+        if (cov_inv.is_none()) {
+            throw std::invalid_argument("mahalanobis richiede cov_inv (d x d)");
+        }
+        s_inv_array = DoubleArray::ensure(cov_inv);
+        if (!s_inv_array || s_inv_array.ndim() != 2 || s_inv_array.shape(0) != d || s_inv_array.shape(1) != d) {
+            throw std::invalid_argument("cov_inv deve essere una matrice d x d");
+        }
+        s_inv = s_inv_array.data();
+    }
+
+    // Sottoinsieme opzionale di righe da scandire (es. cluster di ruolo vicini):
+    // le altre righe non vengono nemmeno toccate.
+    IntArray candidate_array;
+    const int32_t* candidate_ptr = nullptr;
+    py::ssize_t n_scan = n;
+    if (!candidates.is_none()) {
+        candidate_array = IntArray::ensure(candidates);
+        if (!candidate_array || candidate_array.ndim() != 1) {
+            throw std::invalid_argument("candidates deve essere un array 1D di indici");
+        }
+        candidate_ptr = candidate_array.data();
+        n_scan = candidate_array.shape(0);
+        for (py::ssize_t pos = 0; pos < n_scan; ++pos) {
+            if (candidate_ptr[pos] < 0 || candidate_ptr[pos] >= n) {
+                throw std::out_of_range("candidates: indice fuori range");
+            }
+        }
+    }
+
+    // Codici di gruppo opzionali (es. identità del giocatore nell'indice storico),
+    // separati da team_code: exclude_group li filtra senza toccare la semantica squadra.
+    IntArray group_array;
+    const int32_t* group_ptr = nullptr;
+    if (!group_code.is_none()) {
+        group_array = IntArray::ensure(group_code);
+        if (!group_array || group_array.ndim() != 1 || group_array.shape(0) != n) {
+            throw std::invalid_argument("group_code: lunghezza diversa dal numero di giocatori");
+        }
+        group_ptr = group_array.data();
+    } else if (filter.exclude_group >= 0) {
+        throw std::invalid_argument("exclude_group richiede group_code");
+    }
+
+    const double* rows = static_cast<const double*>(m.ptr);
+    const double* tgt = static_cast<const double*>(t.ptr);
+    const double* wts = static_cast<const double*>(w.ptr);
+    const double* fv_ptr = static_cast<const double*>(fv.ptr);
+    const double* age_ptr = static_cast<const double*>(ag.ptr);
+    const int32_t* team_ptr = static_cast<const int32_t*>(tc.ptr);
+    const double* min_ptr = static_cast<const double*>(mn.ptr);
+
+    const RangeCheck fv_check(filter.min_fair_value, filter.max_fair_value);
+    const RangeCheck age_check(filter.min_age, filter.max_age);
+    const RangeCheck minutes_check(filter.min_minutes, filter.max_minutes);
+
+    if (top_n <= 0) {
+        return std::vector<MatchResult>();
+    }
+    const size_t k = static_cast<size_t>(top_n);
+
+    double target_norm = 0.0;
+    if (metric == COSINE) {
+        for (py::ssize_t j = 0; j < d; ++j) {
+            target_norm += wts[j] * tgt[j] * tgt[j];
+        }
+    }
+    std::vector<double> diff_buffer(static_cast<size_t>(d));
+
+    // Da qui in poi solo puntatori a buffer già acquisiti: rilasciamo il GIL
+    // così più richieste concorrenti scandiscono in parallelo sui core.
+    py::gil_scoped_release release;
+
+    // Max-heap sui top-k: in cima c'è il peggiore dei migliori.
+    auto worse = [](const MatchResult& a, const MatchResult& b) { return a.score < b.score; };
+    std::priority_queue<MatchResult, std::vector<MatchResult>, decltype(worse)> heap(worse);
+
+    for (py::ssize_t pos = 0; pos < n_scan; ++pos) {
+        const py::ssize_t i = candidate_ptr ? static_cast<py::ssize_t>(candidate_ptr[pos]) : pos;
+        if (i == exclude_index) continue;
+        if (filter.include_team >= 0 && team_ptr[i] != filter.include_team) continue;
+        if (filter.exclude_team >= 0 && team_ptr[i] == filter.exclude_team) continue;
+        if (group_ptr && filter.exclude_group >= 0 && group_ptr[i] == filter.exclude_group) continue;
+        if (!fv_check.passes(fv_ptr[i])) continue;
+        if (!age_check.passes(age_ptr[i])) continue;
+        if (!minutes_check.passes(min_ptr[i])) continue;
+
+        const double* row = rows + i * d;
+        double key;
+        switch (metric) {
+            case COSINE:
+                key = weighted_cosine_distance(tgt, row, wts, d, target_norm);
+                break;
+            case MAHALANOBIS:
+                key = sq_mahalanobis(tgt, row, s_inv, d, diff_buffer.data());
+                break;
+            default:
+                key = weighted_sq_euclidean(tgt, row, wts, d);
+                break;
+        }
+
+        if (heap.size() < k) {
+            heap.push({static_cast<int>(i), key});
+        } else if (key < heap.top().score) {
+            heap.pop();
+            heap.push({static_cast<int>(i), key});
+        }
+    }
+
+    std::vector<MatchResult> results;
+    results.reserve(heap.size());
+    while (!heap.empty()) {
+        MatchResult r = heap.top();
+        heap.pop();
+        if (metric != COSINE) {
+            r.score = std::sqrt(r.score);
+        }
+        results.push_back(r);
+    }
+    std::reverse(results.begin(), results.end()); // Ordine crescente (0 = identico)
+    return results;
+}
+
 // Binding Pybind11: Espone la funzione a Python
 PYBIND11_MODULE(similarity_engine, m) {
     m.doc() = "Motore di Scouting C++ per Football Quant Engine";
-    
+
     py::class_<MatchResult>(m, "MatchResult")
         .def_readonly("index", &MatchResult::index)
         .def_readonly("score", &MatchResult::score);
 
+    py::class_<SimilarityFilter>(m, "SimilarityFilter")
+        .def(py::init<>())
+        .def_readwrite("min_fair_value", &SimilarityFilter::min_fair_value)
+        .def_readwrite("max_fair_value", &SimilarityFilter::max_fair_value)
+        .def_readwrite("min_age", &SimilarityFilter::min_age)
+        .def_readwrite("max_age", &SimilarityFilter::max_age)
+        .def_readwrite("min_minutes", &SimilarityFilter::min_minutes)
+        .def_readwrite("max_minutes", &SimilarityFilter::max_minutes)
+        .def_readwrite("include_team", &SimilarityFilter::include_team)
+        .def_readwrite("exclude_team", &SimilarityFilter::exclude_team)
+        .def_readwrite("exclude_group", &SimilarityFilter::exclude_group);
+
+    py::enum_<Metric>(m, "Metric")
+        .value("WEIGHTED_EUCLIDEAN", WEIGHTED_EUCLIDEAN)
+        .value("COSINE", COSINE)
+        .value("MAHALANOBIS", MAHALANOBIS);
+
     m.def("find_similar", &find_similar_players, "Trova i giocatori più simili dato un vettore di feature");
-}
\ No newline at end of file
+
+    m.def(
+        "find_similar_filtered",
+        &find_similar_filtered,
+        "Top-N simili (metrica configurabile) con filtri applicati prima della selezione",
+        py::arg("target"),
+        py::arg("matrix"),
+        py::arg("weights"),
+        py::arg("top_n"),
+        py::arg("exclude_index"),
+        py::arg("filter"),
+        py::arg("fair_value"),
+        py::arg("age"),
+        py::arg("team_code"),
+        py::arg("minutes"),
+        py::arg("metric") = WEIGHTED_EUCLIDEAN,
+        py::arg("cov_inv") = py::none(),
+        py::arg("candidates") = py::none(),
+        py::arg("group_code") = py::none()
+    );
+}
@@ -0,0 +1,152 @@
+"""
+Team ELO Store - Serie storiche ELO/forma in memoria
+====================================================
+Carica team_performance una volta per versione dei dati e tiene, per ogni
+(stagione, squadra), array ordinati per data di ELO, forma offensiva e difensiva:
+
+- ELO corrente: ultimo elemento dell'array (niente DISTINCT ON per richiesta);
+- storico in un intervallo di date: due np.searchsorted e uno slice;
+- ELO "as of" una data: searchsorted(side='right') - 1.
+
+Usato da /analytics/team/{id}/elo-history, /analytics/league/strength-rankings e
+league_simulator.get_team_elos. Come l'indice di ricerca giocatori, la versione
+dei dati è controllata al massimo ogni REFRESH_INTERVAL_SECONDS e la struttura
+viene sostituita con uno swap atomico del riferimento.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from team_keys import team_season_code
+
+REFRESH_INTERVAL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class TeamSeries:
+    dates: np.ndarray          # datetime64[D], ordinate
+    elo: np.ndarray
+    attack_form: np.ndarray    # rolling_xg_form (NaN se assente)
+    defense_form: np.ndarray   # rolling_ga_form (NaN se assente)
+
+    def point(self, i: int) -> dict:
+        return {
+            "date": str(self.dates[i]),
+            "elo": float(self.elo[i]),
+            "attack_form": _form(self.attack_form[i]),
+            "defense_form": _form(self.defense_form[i]),
+        }
+
+
+def _form(value) -> float:
+    return 0.0 if np.isnan(value) else float(value)
+
+
+def _as_day(value) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+def build_series(rows: pd.DataFrame) -> dict:
+    """{stagione: {team_id: TeamSeries}} da righe (season, team_id, match_date, elo, forme)."""
+    rows = rows.dropna(subset=["season", "team_id", "match_date", "elo"])
+    rows = rows.assign(match_date=pd.to_datetime(rows["match_date"]).dt.normalize())
+    rows = rows.sort_values(["season", "team_id", "match_date"], kind="mergesort")
+
+    series: dict[str, dict[str, TeamSeries]] = {}
+    for (season, team_id), group in rows.groupby(["season", "team_id"], sort=False):
+        series.setdefault(str(season), {})[team_id] = TeamSeries(
+            dates=group["match_date"].to_numpy().astype("datetime64[D]"),
+            elo=group["elo"].to_numpy(dtype=np.float64),
+            attack_form=pd.to_numeric(group["rolling_xg_form"], errors="coerce").to_numpy(dtype=np.float64),
+            defense_form=pd.to_numeric(group["rolling_ga_form"], errors="coerce").to_numpy(dtype=np.float64),
+        )
+    return series
+
+
+class TeamEloStore:
+    def __init__(self, engine):
+        self.engine = engine
+        self._series: dict | None = None
+        self._version = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _data_version(self):
+        query = text("SELECT COUNT(*), MAX(match_date), SUM(elo) FROM team_performance")
+        with self.engine.connect() as conn:
+            return tuple(conn.execute(query).fetchone())
+
+    def _load(self) -> dict:
+        query = text("""
+            SELECT season, team_id, match_date, elo, rolling_xg_form, rolling_ga_form
+            FROM team_performance
+        """)
+        return build_series(pd.read_sql(query, self.engine))
+
+    def refresh(self, force: bool = False, blocking: bool = True):
+        """Ricarica le serie se team_performance è cambiata (swap atomico del riferimento)."""
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            if not force and self._series is not None and time.monotonic() - self._last_check < REFRESH_INTERVAL_SECONDS:
+                return
+            version = self._data_version()
+            if force or version != self._version or self._series is None:
+                start = time.perf_counter()
+                self._series = self._load()
+                self._version = version
+                n_teams = sum(len(teams) for teams in self._series.values())
+                print(f"📈 Serie ELO: {n_teams} squadre-stagione in {time.perf_counter() - start:.2f}s")
+            self._last_check = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def _season(self, season: str) -> dict:
+        if self._series is None:
+            self.refresh()
+        elif time.monotonic() - self._last_check >= REFRESH_INTERVAL_SECONDS:
+            self.refresh(blocking=False)
+        return self._series.get(team_season_code(season), {})
+
+    # ------------------------------------------------------------------
+    # Query (stagione nel formato "2025" o nel codice team_performance "2526")
+    # ------------------------------------------------------------------
+    def latest(self, season: str = "2025") -> dict:
+        """{team_id: ultimo punto della serie}"""
+        return {team: s.point(len(s.dates) - 1) for team, s in self._season(season).items()}
+
+    def team_elos(self, season: str = "2025") -> dict:
+        """{team_id: ELO corrente}"""
+        return {team: float(s.elo[-1]) for team, s in self._season(season).items()}
+
+    def history(self, team_id: str, season: str = "2025", start=None, end=None) -> list:
+        """Punti della serie con start <= data <= end (estremi opzionali)."""
+        series = self._season(season).get(team_id)
+        if series is None:
+            return []
+        lo = 0 if start is None else int(np.searchsorted(series.dates, _as_day(start), side="left"))
+        hi = len(series.dates) if end is None else int(np.searchsorted(series.dates, _as_day(end), side="right"))
+        return [series.point(i) for i in range(lo, hi)]
+
+    def elo_as_of(self, team_id: str, as_of, season: str = "2025"):
+        """ELO all'ultima data <= as_of (None se la squadra non ha ancora giocato)."""
+        series = self._season(season).get(team_id)
+        if series is None:
+            return None
+        i = int(np.searchsorted(series.dates, _as_day(as_of), side="right")) - 1
+        return float(series.elo[i]) if i >= 0 else None
+
+    def points_as_of(self, as_of, season: str = "2025") -> dict:
+        """{team_id: ultimo punto con data <= as_of} per le squadre che hanno già giocato."""
+        day = _as_day(as_of)
+        points = {}
+        for team, series in self._season(season).items():
+            i = int(np.searchsorted(series.dates, day, side="right")) - 1
+            if i >= 0:
+                points[team] = series.point(i)
+        return points
@@ -0,0 +1,29 @@
+"""
+Team Keys - Chiavi squadra e stagione condivise
+===============================================
+Conversioni tra i nomi/stagioni di v_full_match_stats (Understat) e le chiavi
+di team_performance. Modulo volutamente leggero (niente modello, niente
+sklearn): lo importano sia valuation_engine_v3 sia team_elo_store.
+"""
+
+import re
+
+import pandas as pd
+
+# Suffissi anno nei nomi Understat ("Parma_Calcio_1913") assenti in team_performance
+TEAM_YEAR_SUFFIX = re.compile(r'_\d{4}$')
+
+
+def team_key(name):
+    """Nome squadra -> team_id di team_performance (spazi -> '_', senza suffisso anno)."""
+    if name is None or pd.isna(name):
+        return None
+    return TEAM_YEAR_SUFFIX.sub('', str(name).strip().replace(' ', '_'))
+
+
+def team_season_code(season):
+    """Stagione di v_full_match_stats ("2025") -> codice di team_performance ("2526")."""
+    season = str(season)
+    if len(season) == 4 and season.startswith('20'):
+        return f"{season[2:]}{(int(season[2:]) + 1) % 100:02d}"
+    return season
@@ -0,0 +1,101 @@
+"""
+Test metriche di contesto precalcolate
+======================================
+compute_context_metrics (una passata vettoriale su tutta la lega) deve dare gli
+stessi numeri del loop per riga dell'endpoint /analytics/player/{name}/context,
+con l'ELO avversario preso dall'ultima riga team_performance <= data del match.
+
+Dati sintetici, nessun DB richiesto:
+    cd backend && python test_context_metrics.py
+    cd backend && pytest test_context_metrics.py
+"""
+
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from context_metrics import compute_context_metrics
+from team_keys import team_key
+
+TEAMS = ["AC Milan", "Inter", "Juventus", "Parma Calcio 1913", "Como", "Lecce"]
+
+
+def synthetic_inputs(n_players: int = 400, matches_per_player: int = 20, seed: int = 21):
+    rng = np.random.default_rng(seed)
+    n = n_players * matches_per_player
+    player = np.repeat(np.arange(n_players), matches_per_player)
+    history = pd.DataFrame({
+        "team_id": rng.choice([team_key(t) for t in TEAMS], 600),
+        "match_date": (pd.Timestamp("2025-08-20") + pd.to_timedelta(rng.integers(0, 250, 600), unit="D")).date,
+        "elo": rng.normal(1500, 120, 600),
+        "rolling_xg_form": rng.random(600) * 2,
+        "rolling_ga_form": rng.random(600) * 2,
+    })
+    matches = pd.DataFrame({
+        "player_id": player + 1,
+        "player_name": [f"Player {p:04d}" for p in player],
+        "team_id": [f"Team_{p % 20}" for p in player],
+        "match_date": (pd.Timestamp("2025-08-15") + pd.to_timedelta(rng.integers(0, 260, n), unit="D")).date,
+        "opponent": rng.choice(TEAMS + ["Unknown"], n),
+        "goals": rng.poisson(0.3, n),
+        "xg": rng.random(n) * 0.6,
+    })
+    return matches, history
+
+
+def reference_context(group: pd.DataFrame, history: pd.DataFrame) -> dict:
+    """Loop per riga dell'endpoint storico, con lookup as-of per ogni match."""
+    total_goals, elo_weighted_goals, total_opponent_elo = 0, 0.0, 0.0
+    top_team_goals = bottom_team_goals = 0
+    matches = []
+    for _, row in group.sort_values("match_date", kind="mergesort").iterrows():
+        past = history[(history["team_id"] == team_key(row["opponent"])) & (history["match_date"] <= row["match_date"])]
+        opponent_elo = float(past.sort_values("match_date", kind="mergesort")["elo"].iloc[-1]) if len(past) else 1500.0
+        quality_multiplier = opponent_elo / 1500.0
+        matches.append(round(quality_multiplier * row["goals"], 2))
+        total_goals += row["goals"]
+        elo_weighted_goals += quality_multiplier * row["goals"]
+        total_opponent_elo += opponent_elo
+        if opponent_elo >= 1600:
+            top_team_goals += row["goals"]
+        elif opponent_elo <= 1450:
+            bottom_team_goals += row["goals"]
+
+    avg_opponent_elo = total_opponent_elo / len(matches)
+    return {
+        "avg_opponent_elo": avg_opponent_elo,
+        "difficulty_score": min(100, max(0, ((avg_opponent_elo - 1200) / 600) * 100)),
+        "goal_quality_index": (elo_weighted_goals / total_goals) if total_goals > 0 else 1.0,
+        "top_team_goals": top_team_goals,
+        "bottom_team_goals": bottom_team_goals,
+        "quality_scores": matches,
+    }
+
+
+def test_vectorized_matches_row_loop():
+    matches, history = synthetic_inputs(n_players=60)
+    metrics = compute_context_metrics(matches, history, "2025").set_index("player_id")
+    assert len(metrics) == matches["player_id"].nunique()
+
+    for player_id, group in matches.groupby("player_id"):
+        expected = reference_context(group, history)
+        row = metrics.loc[player_id]
+        assert row["matches_analyzed"] == len(group)
+        for key in ["avg_opponent_elo", "difficulty_score", "goal_quality_index"]:
+            assert abs(row[key] - expected[key]) < 1e-9, key
+        assert row["top_team_goals"] == expected["top_team_goals"]
+        assert row["bottom_team_goals"] == expected["bottom_team_goals"]
+        history_rows = json.loads(row["match_history"])
+        assert [m["quality_score"] for m in history_rows] == expected["quality_scores"]
+        assert [m["date"] for m in history_rows] == sorted(m["date"] for m in history_rows)
+
+
+if __name__ == "__main__":
+    matches, history = synthetic_inputs(n_players=2_000, matches_per_player=30)
+    start = time.perf_counter()
+    metrics = compute_context_metrics(matches, history, "2025")
+    print(f"🧭 {len(matches):,} match -> {len(metrics)} giocatori in {time.perf_counter() - start:.2f}s")
+    test_vectorized_matches_row_loop()
+    print("   ✓ Metriche identiche al loop per riga")
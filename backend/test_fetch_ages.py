@@ -0,0 +1,157 @@
+"""
+Test fetch_ages
+===============
+Server HTTP locale che imita l'API MediaWiki: verifica parsing delle date,
+giocatori non trovati o richieste rifiutate (cache negativa), retry su
+503/429, limite di concorrenza e token bucket.
+
+Nessuna rete esterna né DB richiesti:
+    cd backend && python test_fetch_ages.py
+    cd backend && pytest test_fetch_ages.py
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.parse
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_ages
+
+EXTRACTS = {
+    "Lautaro Martinez": "Lautaro Javier Martínez (born 22 August 1997) is an Argentine professional footballer.",
+    "Christian Pulisic": "Christian Mate Pulisic (born September 18, 1998) is an American professional footballer.",
+    "Nessuna Data": "Nessuna Data is an Italian footballer who plays as a midfielder.",
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    failures = {}       # nome -> risposte 503 ancora da restituire
+    rejected = {"Richiesta Rifiutata"}  # Sempre 400
+    calls = {}          # nome -> richieste ricevute
+    latency = 0.02
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        name = query["gsrsearch"][0].removesuffix(" footballer")
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            type(self).in_flight += 1
+            type(self).max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:  # Prima di rispondere: il client può già inviare la richiesta successiva
+            type(self).in_flight -= 1
+        if name in self.rejected:
+            self.send_response(400)
+            self.end_headers()
+            return
+        if self.failures.get(name, 0) > 0:
+            self.failures[name] -= 1
+            self.send_response(503 if name != "Rate Limited" else 429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        payload = {"batchcomplete": True}
+        if name in EXTRACTS:
+            payload["query"] = {"pages": [{"title": name, "extract": EXTRACTS[name]}]}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    _Handler.in_flight = _Handler.max_in_flight = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/w/api.php"
+
+
+def test_parse_birth_date_formats():
+    assert fetch_ages.parse_birth_date(EXTRACTS["Lautaro Martinez"]) == date(1997, 8, 22)
+    assert fetch_ages.parse_birth_date(EXTRACTS["Christian Pulisic"]) == date(1998, 9, 18)
+    assert fetch_ages.parse_birth_date(EXTRACTS["Nessuna Data"]) is None
+    assert fetch_ages.parse_birth_date("born 99 Smarch 1997") is None
+
+
+def test_fetch_birth_dates_found_missing_and_retries(monkeypatch):
+    monkeypatch.setattr(_Handler, "failures", {"Christian Pulisic": 2, "Rate Limited": 1, "Sempre Giu": 99})
+    monkeypatch.setattr(_Handler, "calls", {})
+    monkeypatch.setattr(fetch_ages, "RETRY_BASE_SECONDS", 0.01)
+    server, url = _serve()
+    players = [(1, "Lautaro Martinez"), (2, "Christian Pulisic"), (3, "Nessuna Data"),
+               (4, "Sconosciuto"), (5, "Rate Limited"), (6, "Sempre Giu"), (7, "Richiesta Rifiutata")]
+    try:
+        results = asyncio.run(fetch_ages.fetch_birth_dates(players, api_url=url, rate=100, concurrency=3))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    by_id = {pid: (bd, err) for pid, bd, err in results}
+    assert by_id[1] == (date(1997, 8, 22), None)
+    assert by_id[2] == (date(1998, 9, 18), None)       # Due 503, poi OK
+    assert by_id[3] == (None, None)                    # Pagina senza data: cache negativa
+    assert by_id[4] == (None, None)                    # Nessun risultato: cache negativa
+    assert by_id[5] == (None, None)                    # 429 + Retry-After, poi nessun risultato
+    assert by_id[6] == (None, "HTTP 503")              # Retry esauriti: errore transitorio
+    assert _Handler.failures["Sempre Giu"] == 99 - (fetch_ages.MAX_RETRIES + 1)
+    assert by_id[7] == (None, None)                    # 400: cache negativa, senza retry
+    assert _Handler.calls["Richiesta Rifiutata"] == 1
+
+
+def test_concurrency_and_rate_limit(monkeypatch):
+    monkeypatch.setattr(_Handler, "failures", {})
+    server, url = _serve()
+    players = [(i, f"Giocatore {i}") for i in range(24)]
+    try:
+        start = time.perf_counter()
+        asyncio.run(fetch_ages.fetch_birth_dates(players, api_url=url, rate=40, concurrency=4))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 1 < _Handler.max_in_flight <= 4
+    # Burst iniziale di 40 token: 24 richieste non aspettano il bucket...
+    assert elapsed < 24 * _Handler.latency
+
+    bucket_start = time.perf_counter()
+
+    async def drain():
+        bucket = fetch_ages.TokenBucket(rate=50, capacity=1)
+        for _ in range(11):
+            await bucket.acquire()
+
+    asyncio.run(drain())
+    # ...mentre con capacity=1 dieci token in più richiedono ~10/50 s
+    assert time.perf_counter() - bucket_start >= 10 / 50 * 0.9
+
+
+if __name__ == "__main__":
+    test_parse_birth_date_formats()
+    with pytest.MonkeyPatch.context() as mp:
+        test_fetch_birth_dates_found_missing_and_retries(mp)
+    with pytest.MonkeyPatch.context() as mp:
+        test_concurrency_and_rate_limit(mp)
+
+    server, url = _serve()
+    _Handler.latency = 0.2  # Latenza simile a Wikipedia
+    players = [(i, f"Giocatore {i}") for i in range(40)]
+    for concurrency in (1, 4, 8):
+        start = time.perf_counter()
+        asyncio.run(fetch_ages.fetch_birth_dates(players, api_url=url, rate=100, concurrency=concurrency))
+        print(f"🎂 {len(players)} giocatori, concorrenza {concurrency}: {time.perf_counter() - start:.2f}s")
+    server.shutdown()
+    print("✓ fetch_ages OK")
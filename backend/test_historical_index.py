@@ -0,0 +1,122 @@
+"""
+Test HistoricalComparablesIndex
+===============================
+Indice cross-season su stagioni sintetiche (shard su una directory temporanea,
+fingerprint controllati dal test o checksum su SQLite): ricerca del giocatore per stagione (esatta e
+parziale), esclusione delle sue altre stagioni, refresh incrementale e stato
+per-query (nomi normalizzati, codici giocatore, covarianza) calcolato una sola
+volta per rebuild.
+
+Nessun DB richiesto:
+    cd backend && pytest test_historical_index.py
+"""
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+
+from historical_index import HistoricalComparablesIndex
+from scouting_service import ScoutingService
+from test_scouting_concurrency import SyntheticScoutingService, synthetic_matches
+
+SEASONS = ("2023", "2024", "2025")
+
+
+class CountingHistoricalIndex(HistoricalComparablesIndex):
+    def __init__(self, scouting_service, index_dir):
+        self.built = []
+        super().__init__(scouting_service, index_dir)
+
+    def _build_shard(self, season):
+        self.built.append(season)
+        return super()._build_shard(season)
+
+
+class OfflineHistoricalIndex(CountingHistoricalIndex):
+    """Fingerprint in memoria al posto del checksum su v_full_match_stats."""
+
+    def __init__(self, scouting_service, index_dir):
+        self.fingerprints = {s: {"n_rows": 1} for s in SEASONS}
+        super().__init__(scouting_service, index_dir)
+
+    def _season_fingerprints(self):
+        return {s: dict(fp) for s, fp in self.fingerprints.items()}
+
+
+@pytest.fixture
+def index(tmp_path):
+    service = SyntheticScoutingService(synthetic_matches(n_players=200))
+    return OfflineHistoricalIndex(service, tmp_path)
+
+
+def test_comparables_exclude_same_player(index):
+    result = index.find_comparables("player 42", season="2024", top_n=10)
+    assert len(result["matches"]) == 10
+    assert all(m["player"] != "Player 42" for m in result["matches"])
+
+    # Stesse feature in ogni stagione sintetica: le altre stagioni sono identiche
+    same = index.find_comparables("Player 42", season="2024", top_n=2, include_same_player=True)
+    assert {m["player"] for m in same["matches"]} == {"Player 42"}
+    assert {m["season"] for m in same["matches"]} == {"2023", "2025"}
+
+    # Parziale: prima riga della stagione che contiene il frammento
+    partial = index.find_comparables("layer 19", season="2025", top_n=1, metric="mahalanobis")
+    assert partial["target"].startswith("Player 19") and partial["matches"]
+    with pytest.raises(ValueError):
+        index.find_comparables("Nessun Giocatore", season="2025")
+    with pytest.raises(ValueError):
+        index.find_comparables("Player 42", season="2019")
+
+
+def test_query_state_is_built_once_per_rebuild(index, monkeypatch):
+    index.find_comparables("Player 1", season="2025")
+    state = index._state
+    assert index.built == list(SEASONS)
+    assert state.covariance.shape == (state.matrix.shape[1],) * 2
+    assert np.allclose(state.covariance, np.cov(state.matrix, rowvar=False))
+
+    calls = []
+    original = ScoutingService._normalize_name
+    monkeypatch.setattr(ScoutingService, "_normalize_name", staticmethod(lambda n: calls.append(n) or original(n)))
+    for metric in ("euclidean", "cosine", "mahalanobis"):
+        index.find_comparables("Player 7", season="2023", metric=metric)
+    assert calls == ["Player 7"] * 3  # Solo la query: i nomi indicizzati sono già normalizzati
+    assert index._state is state
+
+    # Una stagione cambiata: ricostruito solo il suo shard, nuovo stato
+    index.fingerprints["2024"]["n_rows"] += 1
+    assert index.refresh(force=True) == ["2024"]
+    assert index.built == list(SEASONS) + ["2024"]
+    assert index._state is not state
+    assert len(index._state.normalized_names) == len(index._state.frame)
+
+
+def test_fingerprint_sees_feature_corrections(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE v_full_match_stats (player_id INTEGER, player_name TEXT, team_id TEXT, season TEXT,
+                match_date TEXT, minutes INTEGER, goals INTEGER, assists INTEGER, npxg REAL,
+                shots INTEGER, shots_on_target INTEGER)
+        """))
+        conn.execute(text("""
+            INSERT INTO v_full_match_stats VALUES
+                (1, 'Player 1', 'Team_1', '2024', '2024-09-01', 90, 1, 0, 0.45, 3, 2),
+                (1, 'Player 1', 'Team_1', '2025 ', '2025-09-01', 90, 0, 1, 0.30, 2, 1),
+                (2, 'Player 2', 'Team_2', '2025', '2025-09-01', 80, 0, 0, 0.10, 1, 0)
+        """))
+    service = SyntheticScoutingService(synthetic_matches(n_players=50))
+    service.engine = engine
+    index = CountingHistoricalIndex(service, tmp_path / "index")
+
+    assert sorted(index.refresh(force=True)) == ["2024", "2025"]
+    assert index.refresh(force=True) == []
+
+    # Correzione tardiva di npxg: stessi conteggi, minuti e gol, shard da ricostruire
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE v_full_match_stats SET npxg = 0.52 WHERE player_id = 2"))
+    assert index.refresh(force=True) == ["2025"]
+
+    # Manifest persistito: un nuovo processo non ricostruisce nulla
+    reloaded = CountingHistoricalIndex(service, tmp_path / "index")
+    assert reloaded.refresh(force=True) == [] and reloaded.built == []
@@ -0,0 +1,113 @@
+"""
+Test PlayerSearchIndex
+======================
+Ranking dell'autocomplete su una lista di nomi fissa (prefisso del nome
+completo > prefisso di parola > infix, poi minuti), limite
+MAX_TRIE_CANDIDATES del trie e logica di refresh.
+
+_load gira su SQLite (stessa query del servizio); la versione dei dati è un
+contatore del test, al posto dei contatori pg_stat di Postgres:
+    cd backend && pytest test_player_search_index.py
+"""
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import player_search_index
+from player_search_index import PlayerSearchIndex, _Index
+
+PLAYERS = {
+    "Lautaro Martínez": 3000,
+    "Marten de Roon": 2500,
+    "Martín Satriano": 500,
+    "Samuele Ricci": 2800,
+    "Hakan Çalhanoğlu": 2900,
+    "Federico Dimarco": 2700,
+    "Mattia Zaccagni": 2600,
+}
+
+
+def _index(players=PLAYERS) -> _Index:
+    return _Index(list(players), list(players.values()))
+
+
+def test_ranking_full_prefix_then_word_prefix_then_minutes():
+    index = _index()
+    # "mart": due prefissi di nome completo (per minuti), poi il prefisso di parola
+    assert index.search("mart", 10) == ["Marten de Roon", "Martín Satriano", "Lautaro Martínez"]
+    assert index.search("mart", 2) == ["Marten de Roon", "Martín Satriano"]
+    # Accenti e maiuscole normalizzati da suggest (qui la query è già normalizzata)
+    assert index.search("calhanoglu", 5) == ["Hakan Çalhanoğlu"]
+
+
+def test_infix_matches_rank_after_prefixes():
+    index = _index()
+    # "marco" è solo infix ("dimarco"); "mar" è prefisso per tre nomi e infix per Dimarco
+    assert index.search("marco", 5) == ["Federico Dimarco"]
+    assert index.search("mar", 10) == ["Marten de Roon", "Martín Satriano", "Lautaro Martínez", "Federico Dimarco"]
+    # Query corte (1-2 caratteri) via posting list di unigrammi/bigrammi
+    assert index.search("cc", 10) == ["Samuele Ricci", "Mattia Zaccagni"]
+    assert index.search("zzz", 10) == []
+
+
+def test_trie_candidates_are_capped_to_best_ranked(monkeypatch):
+    monkeypatch.setattr(player_search_index, "MAX_TRIE_CANDIDATES", 20)
+    players = {f"Rossi {i:03d}": i for i in range(50)}
+    index = _index(players)
+    ids = index.prefix_ids("rossi")
+    assert len(ids) == 20
+    # Gli id sono il rank per minuti: il trie tiene i 20 con più minuti
+    assert [index.names[i] for i in ids] == [f"Rossi {i:03d}" for i in range(49, 29, -1)]
+    assert index.search("ross", 5) == [f"Rossi {i:03d}" for i in range(49, 44, -1)]
+
+
+class CountedSearchIndex(PlayerSearchIndex):
+    """Versione dei dati controllata dal test (in produzione: pg_stat_user_tables)."""
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.version = 0
+        self.loads = 0
+
+    def _data_version(self):
+        return (self.version,)
+
+    def _load(self):
+        self.loads += 1
+        return super()._load()
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'players.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE players (player_id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("CREATE TABLE player_stats_v2 (player_id INTEGER, match_id INTEGER, minutes INTEGER)"))
+        conn.execute(text("INSERT INTO players VALUES (1, 'Marten de Roon'), (2, 'Martín Satriano')"))
+        conn.execute(text("INSERT INTO player_stats_v2 VALUES (1, 10, 90), (2, 10, 30)"))
+    return engine
+
+
+def test_refresh_rebuilds_only_when_version_changes(sqlite_engine, monkeypatch):
+    index = CountedSearchIndex(sqlite_engine)
+    assert index.suggest("Mart") == ["Marten de Roon", "Martín Satriano"]
+    assert index.loads == 1
+
+    # Upsert dei minuti: stesso numero di righe, ranking diverso
+    with sqlite_engine.begin() as conn:
+        conn.execute(text("UPDATE player_stats_v2 SET minutes = 900 WHERE player_id = 2"))
+    index.version += 1
+
+    # Entro l'intervallo di refresh si serve l'indice corrente
+    assert index.suggest("mart") == ["Marten de Roon", "Martín Satriano"]
+    assert index.loads == 1
+
+    monkeypatch.setattr(player_search_index, "REFRESH_INTERVAL_SECONDS", 0)
+    assert index.suggest("mart") == ["Martín Satriano", "Marten de Roon"]
+    assert index.loads == 2
+
+    # Versione invariata: nessuna ricostruzione
+    index.suggest("mart")
+    assert index.loads == 2
+    index.refresh(force=True)
+    assert index.loads == 3
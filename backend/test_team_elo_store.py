@@ -0,0 +1,80 @@
+"""
+Test TeamEloStore
+=================
+Le query dello store (ELO corrente, storico per intervallo, as-of) devono
+coincidere con i filtri equivalenti su team_performance (DISTINCT ON /
+WHERE match_date BETWEEN / ultima riga <= data).
+
+Dati sintetici, nessun DB richiesto:
+    cd backend && pytest test_team_elo_store.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from team_elo_store import TeamEloStore, build_series
+
+TEAMS = ["Inter", "AC_Milan", "Juventus", "Napoli", "Como"]
+
+
+def synthetic_team_performance(seed: int = 5) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frames = []
+    for season, start in [("2425", "2024-08-18"), ("2526", "2025-08-23")]:
+        for team in TEAMS:
+            dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.choice(280, 38, replace=False)), unit="D")
+            frames.append(pd.DataFrame({
+                "season": season,
+                "team_id": team,
+                "match_date": dates.date,
+                "elo": 1500 + rng.normal(0, 15, 38).cumsum(),
+                "rolling_xg_form": np.where(rng.random(38) < 0.1, np.nan, rng.random(38) * 2),
+                "rolling_ga_form": rng.random(38) * 2,
+            }))
+    rows = pd.concat(frames, ignore_index=True)
+    return rows.sample(frac=1, random_state=1).reset_index(drop=True)  # Ordine di caricamento arbitrario
+
+
+class OfflineEloStore(TeamEloStore):
+    def __init__(self, rows: pd.DataFrame):
+        super().__init__(engine=None)
+        self.rows = rows
+
+    def _data_version(self):
+        return (len(self.rows),)
+
+    def _load(self):
+        return build_series(self.rows)
+
+
+def test_queries_match_table_filters():
+    rows = synthetic_team_performance()
+    rows["match_date"] = pd.to_datetime(rows["match_date"])
+    store = OfflineEloStore(rows)
+    season_rows = rows[rows["season"] == "2526"]
+
+    latest = season_rows.sort_values("match_date").groupby("team_id").last()
+    assert store.team_elos("2025") == latest["elo"].to_dict()
+    assert store.team_elos("2526") == store.team_elos("2025")
+    assert {t: p["date"] for t, p in store.latest("2025").items()} == {
+        t: str(d.date()) for t, d in latest["match_date"].items()
+    }
+
+    inter = season_rows[season_rows["team_id"] == "Inter"].sort_values("match_date")
+    window = inter[(inter["match_date"] >= "2025-10-01") & (inter["match_date"] <= "2025-12-31")]
+    history = store.history("Inter", "2025", start="2025-10-01", end="2025-12-31")
+    assert [p["elo"] for p in history] == window["elo"].tolist()
+    assert [p["attack_form"] for p in history] == window["rolling_xg_form"].fillna(0).tolist()
+    assert len(store.history("Inter", "2025")) == len(inter)
+    assert store.history("Unknown", "2025") == []
+
+    for as_of in pd.date_range("2025-08-01", "2026-06-30", freq="9D"):
+        past = inter[inter["match_date"] <= as_of]
+        expected = float(past["elo"].iloc[-1]) if len(past) else None
+        assert store.elo_as_of("Inter", as_of, "2025") == expected
+        assert set(store.points_as_of(as_of, "2025")) == set(season_rows.loc[season_rows["match_date"] <= as_of, "team_id"])
+
+
+if __name__ == "__main__":
+    test_queries_match_table_filters()
+    print("✓ TeamEloStore coerente con team_performance")
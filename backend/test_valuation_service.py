@@ -0,0 +1,111 @@
+"""
+Test ValuationService
+=====================
+Servizio on-demand su una stagione sintetica (OfflineValuation, nessun DB):
+classifica top N con filtri, ricerca del giocatore (esatta e parziale) e
+scenari what-if ri-valutati sulla scala di lega in cache.
+
+    cd backend && pytest test_valuation_service.py
+"""
+
+import pandas as pd
+import pytest
+
+from test_valuation_vectorized import OfflineValuation, synthetic_season
+from valuation_engine_v3 import VALUATION_BANDS
+from valuation_service import ValuationService, WhatIfError
+
+SEASON_DATA = synthetic_season(n_rows=6_000, seed=21)
+
+
+class OfflineSeasonValuation(OfflineValuation):
+    def get_clean_data(self, since=None):
+        return SEASON_DATA.copy()
+
+
+class OfflineValuationService(ValuationService):
+    def __init__(self):
+        super().__init__(engine=None)
+
+    def _model(self, season):
+        return OfflineSeasonValuation(season=str(season))
+
+    def _load_bands(self, season):
+        return pd.DataFrame(columns=["player_id"] + VALUATION_BANDS)
+
+
+@pytest.fixture(scope="module")
+def service():
+    return OfflineValuationService()
+
+
+def test_top_is_sorted_and_filtered(service):
+    snapshot = service.get_snapshot("2025")
+    result = service.top(season="2025", top_n=10)
+    values = [p["fair_value"] for p in result["top"]]
+    assert len(values) == 10 and values == sorted(values, reverse=True)
+    assert result["players_valued"] == len(snapshot.scored)
+    assert values[0] == snapshot.scored["fair_value"].max()
+
+    team = snapshot.scored["team_id"].iloc[0]
+    by_team = service.top(season="2025", top_n=500, team=team)["top"]
+    assert by_team and all(p["team"] == team for p in by_team)
+    assert len(by_team) == (snapshot.scored["team_id"] == team).sum()
+
+    role = snapshot.scored["role"].iloc[-1]
+    assert all(p["role"] == role for p in service.top(season="2025", top_n=50, role=role)["top"])
+
+
+def test_find_player_exact_and_partial(service):
+    snapshot = service.get_snapshot("2025")
+    name = snapshot.scored["player_name"].iloc[3]
+
+    exact = service.value(name.upper(), season="2025")  # Confronto su nome normalizzato
+    assert exact["player"] == name
+    assert exact["rank"] == 4
+    assert "what_if" not in exact
+
+    # Parziale: fra più corrispondenze vince l'indice di riga più basso
+    fragment = name[:-1].lower()
+    matches = [i for n, i in snapshot.name_index.items() if fragment in n]
+    assert len(matches) > 1
+    partial = service.value(fragment, season="2025")
+    assert partial["player"] == snapshot.players.loc[min(matches), "player_name"]
+
+    with pytest.raises(ValueError):
+        service.value("Nessun Giocatore", season="2025")
+
+
+def test_what_if_rescoring(service):
+    snapshot = service.get_snapshot("2025")
+    name = snapshot.scored["player_name"].iloc[len(snapshot.scored) // 2]
+    current = service.value(name, season="2025")
+
+    zero = service.value(name, season="2025", what_if={"goals": 0, "assists": 0})
+    assert "what_if" not in zero  # Delta nulli: nessuno scenario
+
+    better = service.value(name, season="2025", what_if={"goals": 5, "npxg": 3})["what_if"]
+    assert better["fair_value"] >= current["fair_value"]
+    assert better["delta_value"] == better["fair_value"] - current["fair_value"]
+    others = snapshot.scored.loc[snapshot.scored["player_name"] != name, "fair_value"]
+    assert better["rank"] == int((others > better["fair_value"]).sum()) + 1
+    assert better["rank"] <= current["rank"]
+
+    # clip=True: scenari fuori scala saturano invece di esplodere
+    huge = service.value(name, season="2025", what_if={"goals": 1_000, "npxg": 1_000})["what_if"]
+    huger = service.value(name, season="2025", what_if={"goals": 5_000, "npxg": 5_000})["what_if"]
+    assert huge["fair_value"] == huger["fair_value"]
+    assert huge["rank"] <= better["rank"]
+
+    # Lo scenario non modifica lo snapshot condiviso
+    assert service.value(name, season="2025")["fair_value"] == current["fair_value"]
+
+
+def test_what_if_input_errors(service):
+    name = service.get_snapshot("2025").scored["player_name"].iloc[0]
+    with pytest.raises(WhatIfError):
+        service.value(name, season="2025", what_if={"tackles": 3})
+    with pytest.raises(WhatIfError):
+        service.value(name, season="2025", what_if={"minutes": -1_000_000})
+    # WhatIfError resta un ValueError, ma l'API la distingue (400) da "non trovato" (404)
+    assert issubclass(WhatIfError, ValueError)
@@ -0,0 +1,349 @@
+"""
+Benchmark CalibratedValuation.calculate_model
+=============================================
+Confronta la versione vettoriale del modello con l'implementazione storica
+(loop Python su groupby('player_name') + df.apply riga per riga), riportata qui
+sotto come riferimento. I fair value devono coincidere esattamente.
+
+Stagione sintetica, nessun DB richiesto:
+    cd backend && python test_valuation_vectorized.py     # benchmark 100k righe
+    cd backend && pytest test_valuation_vectorized.py     # solo equivalenza
+
+Verifica anche che lo stato incrementale (valuation_state.py), integrato a
+blocchi di giornate, produca gli stessi fair value del modello completo, e che
+una correzione su righe già integrate forzi la ricostruzione (SQLite).
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler, RobustScaler
+from sqlalchemy import create_engine, text
+
+import valuation_bootstrap
+import valuation_state
+from team_keys import team_key
+from valuation_engine_v3 import CalibratedValuation, attach_opponent_elo
+
+N_ROWS = 100_000
+MATCHES_PER_SEASON = 38
+
+
+class OfflineValuation(CalibratedValuation):
+    """CalibratedValuation senza connessione al DB."""
+
+    def __init__(self, season='2025'):
+        self.engine = None
+        self.season = season
+
+
+def synthetic_season(n_rows: int = N_ROWS, seed: int = 11) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    # Numero di presenze variabile: include giocatori con <3 e <6 partite
+    appearances = []
+    while sum(appearances) < n_rows:
+        appearances.append(int(rng.integers(1, MATCHES_PER_SEASON + 1)))
+    appearances[-1] -= sum(appearances) - n_rows
+    n_players = len(appearances)
+
+    player = np.repeat(np.arange(n_players), appearances)
+    # Giornate distinte per giocatore (niente pareggi sulla data)
+    round_no = np.concatenate([rng.permutation(MATCHES_PER_SEASON)[:k] for k in appearances])
+    talent = rng.gamma(2.0, 0.1, n_players)[player]
+
+    minutes = rng.integers(1, 91, n_rows)
+    minutes[rng.random(n_rows) < 0.002] = 0  # Presenze a 0 minuti (score infinito)
+    opponent_elo = rng.normal(1500, 120, n_rows)
+    opponent_elo[rng.random(n_rows) < 0.1] = np.nan
+    birth_date = pd.Series(pd.Timestamp("1988-01-01") + pd.to_timedelta(rng.integers(0, 6000, n_players), unit="D"))
+    birth_date[rng.random(n_players) < 0.05] = pd.NaT
+
+    npxg = rng.random(n_rows) * talent * 2
+    return pd.DataFrame({
+        "player_id": player + 1,
+        "player_name": [f"Player {p:05d}" for p in player],
+        "team_id": [f"Team_{(p + (r > 30)) % 20}" for p, r in zip(player, round_no)],
+        "match_date": pd.Timestamp("2025-08-20") + pd.to_timedelta(round_no * 7, unit="D"),
+        "opponent": None,
+        "goals": rng.poisson(talent),
+        "assists": rng.poisson(talent * 0.6),
+        "npxg": npxg,
+        "xg": npxg,
+        "shots": rng.poisson(talent * 8),
+        "shots_on_target": rng.poisson(talent * 3),
+        "minutes": minutes,
+        "birth_date": birth_date.to_numpy()[player],
+        "opponent_elo": opponent_elo,
+    })
+
+
+def reference_calculate_model(model: CalibratedValuation, match_data, roles=None):
+    """Implementazione storica (pre-vettorizzazione), invariata."""
+    player_stats = []
+
+    for player_name, group in match_data.groupby('player_name'):
+        total_minutes = group['minutes'].sum()
+
+        if total_minutes < 90:
+            continue
+
+        stats = {
+            'player_name': player_name,
+            'player_id': group['player_id'].iloc[0],
+            'team_id': group['team_id'].mode()[0] if len(group) > 0 else None,
+            'birth_date': group['birth_date'].dropna().iloc[0] if not group['birth_date'].dropna().empty else None,
+            'minutes': total_minutes,
+            'goals': group['goals'].sum(),
+            'assists': group['assists'].sum(),
+            'npxg': group['npxg'].sum(),
+            'xg': group['xg'].sum(),
+            'shots': group['shots'].sum(),
+            'sot': group['shots_on_target'].sum(),
+            'matches_played': len(group),
+            'consistency': model.calculate_consistency(group),
+            'trend': model.calculate_trend(group),
+            'goal_quality': model.goal_quality_score(group),
+            'avg_opponent_elo': group['opponent_elo'].fillna(1500).mean()
+        }
+
+        player_stats.append(stats)
+
+    df = pd.DataFrame(player_stats)
+
+    metrics = ['goals', 'assists', 'npxg', 'xg', 'shots', 'sot']
+    for m in metrics:
+        df[f'{m}_p90'] = (df[m] / df['minutes']) * 90
+
+    df['role'] = df.apply(lambda x: model.infer_role(x['goals_p90'], x['assists_p90'], x['shots_p90']), axis=1)
+    if roles:
+        df['role'] = df['player_id'].map(roles).fillna(df['role'])
+
+    def get_weights(role):
+        if role == 'attacker':
+            return {'npxg_p90': 0.45, 'goals_p90': 0.25, 'assists_p90': 0.15, 'sot_p90': 0.15}
+        elif role == 'midfielder':
+            return {'npxg_p90': 0.30, 'goals_p90': 0.15, 'assists_p90': 0.40, 'sot_p90': 0.15}
+        else:
+            return {'npxg_p90': 0.25, 'goals_p90': 0.20, 'assists_p90': 0.30, 'sot_p90': 0.25}
+
+    scaler = RobustScaler()
+    cols_p90 = ['npxg_p90', 'goals_p90', 'assists_p90', 'sot_p90']
+    for col in cols_p90:
+        cap = df[col].quantile(0.99)
+        df[col] = df[col].clip(upper=cap)
+    df[cols_p90] = scaler.fit_transform(df[cols_p90])
+    min_max = MinMaxScaler()
+    df[cols_p90] = min_max.fit_transform(df[cols_p90])
+
+    df['performance_score'] = df.apply(lambda row: (
+        row['npxg_p90'] * get_weights(row['role'])['npxg_p90'] +
+        row['goals_p90'] * get_weights(row['role'])['goals_p90'] +
+        row['assists_p90'] * get_weights(row['role'])['assists_p90'] +
+        row['sot_p90'] * get_weights(row['role'])['sot_p90']
+    ) * 100, axis=1)
+
+    df['reliability'] = df['minutes'].apply(model.sigmoid_reliability)
+    df['age_multiplier'] = df['birth_date'].apply(model.calculate_age_factor)
+    df['schedule_difficulty'] = (df['avg_opponent_elo'] - 1500) / 1500
+    df['schedule_bonus'] = 1 + (df['schedule_difficulty'] * 0.15).clip(-0.1, 0.15)
+
+    df['fair_value'] = 800_000 + (
+        (df['performance_score'] ** 1.65) *
+        df['reliability'] *
+        df['trend'] *
+        df['consistency'] *
+        df['goal_quality'] *
+        df['schedule_bonus'] *
+        df['age_multiplier'] *
+        120_000
+    )
+    df['fair_value'] = (df['fair_value'] / 500_000).round() * 500_000
+    df['fair_value'] = df['fair_value'].clip(lower=500_000, upper=200_000_000)
+
+    return df.sort_values(by='fair_value', ascending=False)
+
+
+def assert_equivalent(expected: pd.DataFrame, actual: pd.DataFrame):
+    assert list(actual.columns) == list(expected.columns)
+    assert actual['player_name'].tolist() == expected['player_name'].tolist()
+    assert (actual['fair_value'].to_numpy() == expected['fair_value'].to_numpy()).all()
+    assert actual['role'].tolist() == expected['role'].tolist()
+    assert actual['team_id'].tolist() == expected['team_id'].tolist()
+    for col in ['consistency', 'trend', 'goal_quality', 'performance_score', 'reliability', 'age_multiplier']:
+        np.testing.assert_allclose(actual[col].to_numpy(float), expected[col].to_numpy(float), rtol=1e-12, atol=1e-12)
+
+
+def test_vectorized_matches_reference():
+    model = OfflineValuation()
+    data = synthetic_season(20_000)
+    assert_equivalent(reference_calculate_model(model, data), model.calculate_model(data))
+
+
+def test_vectorized_matches_reference_with_roles():
+    model = OfflineValuation()
+    data = synthetic_season(5_000, seed=3)
+    roles = {pid: ['attacker', 'midfielder', 'defender', 'goalkeeper'][pid % 4] for pid in data['player_id'].unique()[::2]}
+    assert_equivalent(reference_calculate_model(model, data, roles), model.calculate_model(data, roles))
+
+
+def test_incremental_state_matches_full_model():
+    """Stagione integrata a blocchi di giornate (con round-trip su record DB) = modello completo."""
+    model = OfflineValuation()
+    data = synthetic_season(20_000, seed=5)
+    state = valuation_state.empty_state()
+    for dates in np.array_split(np.sort(data['match_date'].unique()), 6):
+        folded = valuation_state.fold_matches(state, data[data['match_date'].isin(dates)])
+        records = valuation_state.state_to_records(folded, model.season)
+        state = valuation_state.apply_fold(state, valuation_state.records_to_state(records))
+
+    expected = model.calculate_model(data)
+    actual = model.score_players(valuation_state.state_to_aggregates(state))
+    assert actual['player_name'].tolist() == expected['player_name'].tolist()
+    assert (actual['fair_value'].to_numpy() == expected['fair_value'].to_numpy()).all()
+
+
+class SqliteValuation(CalibratedValuation):
+    """run_incremental su SQLite: stato e watermark in memoria al posto delle tabelle Postgres."""
+
+    def __init__(self, engine, season='2025'):
+        self.engine = engine
+        self.season = season
+        self.state = valuation_state.empty_state()
+        self.watermark = None
+        self.since = []
+
+    def get_clean_data(self, since=None):
+        self.since.append(since)
+        return super().get_clean_data(since)
+
+    def load_state(self):
+        return self.state
+
+    def load_watermark(self):
+        return self.watermark
+
+    def save_state(self, folded, watermark, replace=False):
+        base = valuation_state.empty_state() if replace else self.state
+        self.state = valuation_state.apply_fold(base, folded)
+        self.watermark = dict(watermark)
+
+
+def _append_stats(engine, data):
+    """Righe sintetiche nella tabella che su SQLite fa da vista v_full_match_stats."""
+    columns = ['player_id', 'player_name', 'team_id', 'season', 'match_date', 'opponent', 'goals',
+               'assists', 'npxg', 'shots', 'shots_on_target', 'minutes']
+    rows = data.assign(season='2025', match_date=data['match_date'].dt.strftime('%Y-%m-%d'))
+    with engine.begin() as conn:
+        rows[columns].to_sql('v_full_match_stats', conn, index=False, if_exists='append')
+
+
+def _season_db(path, data):
+    engine = create_engine(f"sqlite:///{path}")
+    players = data.drop_duplicates('player_id')
+    with engine.begin() as conn:
+        pd.DataFrame({
+            'player_id': players['player_id'],
+            'name': players['player_name'],
+            'birth_date': pd.to_datetime(players['birth_date']).dt.strftime('%Y-%m-%d'),
+        }).to_sql('players', conn, index=False)
+    return engine
+
+
+def test_corrected_folded_row_forces_full_rebuild(tmp_path):
+    """Una correzione di npxg su una riga già integrata invalida il watermark."""
+    data = synthetic_season(3_000, seed=9)
+    cutoff = data['match_date'].quantile(0.6)
+    engine = _season_db(tmp_path / 'season.db', data)
+    _append_stats(engine, data[data['match_date'] <= cutoff])
+    model = SqliteValuation(engine)
+
+    model.run_incremental()
+    assert model.since == [None] and model.watermark['rows_folded'] == (data['match_date'] <= cutoff).sum()
+
+    # Nuove giornate: solo il delta oltre il watermark
+    _append_stats(engine, data[data['match_date'] > cutoff])
+    model.run_incremental()
+    assert model.since[-1] == cutoff.date()
+
+    # Correzione tardiva di npxg su una riga integrata: conteggi, minuti e gol invariati
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE v_full_match_stats SET npxg = npxg + 0.5
+            WHERE player_id = 1 AND match_date = (SELECT MIN(match_date) FROM v_full_match_stats WHERE player_id = 1)
+        """))
+    result = model.run_incremental()
+    assert model.since[-1] is None  # Ricostruzione completa
+
+    expected = SqliteValuation(engine).run_incremental()
+    assert result['player_name'].tolist() == expected['player_name'].tolist()
+    assert (result['fair_value'].to_numpy() == expected['fair_value'].to_numpy()).all()
+
+    model.run_incremental()  # Nulla di cambiato: di nuovo incrementale
+    assert model.since[-1] is not None
+
+
+def test_bootstrap_identity_resample_matches_model():
+    """Il ricampionamento identità nel layout CSR riproduce esattamente il modello."""
+    model = OfflineValuation()
+    data = synthetic_season(10_000, seed=9)
+    ordered, counts, starts = valuation_bootstrap._csr_layout(data)
+    arrays = valuation_bootstrap._row_arrays(ordered, counts)
+    constants = valuation_bootstrap._player_constants(model, ordered, counts, roles=None)
+    identity = np.arange(len(ordered))[None, :]
+    fair_value = valuation_bootstrap._resample_fair_values(arrays, identity, starts, constants)[0]
+
+    expected = model.calculate_model(data).set_index('player_name').loc[counts.index, 'fair_value']
+    assert (fair_value == expected.to_numpy()).all()
+
+    bands = valuation_bootstrap.bootstrap_fair_values(model, data, n_resamples=40)
+    assert len(bands) == len(counts)
+    assert (bands['fair_value_p10'] <= bands['fair_value_p50']).all()
+    assert (bands['fair_value_p50'] <= bands['fair_value_p90']).all()
+
+
+def test_opponent_elo_asof_matches_per_row_lookup():
+    """merge_asof = ultima riga team_performance con data <= match (lookup riga per riga)."""
+    rng = np.random.default_rng(4)
+    teams = ["AC Milan", "Parma Calcio 1913", "Inter", "Hellas_Verona"]
+    history = pd.DataFrame({
+        "team_id": rng.choice([team_key(t) for t in teams], 300),
+        "match_date": pd.Timestamp("2025-08-20") + pd.to_timedelta(rng.integers(0, 250, 300), unit="D"),
+        "elo": rng.normal(1500, 100, 300),
+    })
+    matches = pd.DataFrame({
+        "opponent": rng.choice(teams + ["Unknown", None], 2_000),
+        "match_date": (pd.Timestamp("2025-08-10") + pd.to_timedelta(rng.integers(0, 270, 2_000), unit="D")).date,
+    })
+    actual = attach_opponent_elo(matches, history)["opponent_elo"].to_numpy()
+
+    expected = []
+    for opponent, date in zip(matches["opponent"], pd.to_datetime(matches["match_date"])):
+        rows = history[(history["team_id"] == team_key(opponent)) & (history["match_date"] <= date)]
+        expected.append(rows.sort_values("match_date", kind="mergesort")["elo"].iloc[-1] if len(rows) else np.nan)
+    np.testing.assert_array_equal(actual, np.array(expected, dtype=float))
+    assert np.isfinite(actual).mean() > 0.5
+
+
+if __name__ == "__main__":
+    print(f"🧪 Benchmark calculate_model su {N_ROWS:,} righe sintetiche...")
+    model = OfflineValuation()
+    data = synthetic_season()
+    print(f"   {data['player_name'].nunique()} giocatori")
+
+    start = time.perf_counter()
+    expected = reference_calculate_model(model, data)
+    t_reference = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = model.calculate_model(data)
+    t_vectorized = time.perf_counter() - start
+
+    assert_equivalent(expected, actual)
+    print("   ✓ Fair value identici all'implementazione storica")
+    print(f"   Loop storico: {t_reference:6.2f}s")
+    print(f"   Vettoriale:   {t_vectorized:6.2f}s (x{t_reference / t_vectorized:.0f})")
+
+    start = time.perf_counter()
+    valuation_bootstrap.bootstrap_fair_values(model, data, n_resamples=valuation_bootstrap.N_RESAMPLES)
+    print(f"   Bootstrap {valuation_bootstrap.N_RESAMPLES} ricampionamenti: {time.perf_counter() - start:6.2f}s")
@@ -0,0 +1,223 @@
+"""
+Valuation Bootstrap - Bande di Incertezza sul Fair Value
+========================================================
+Per ogni giocatore ricampiona (con reinserimento) le sue partite e ricalcola il
+fair value del modello V3, restituendo p10 / p50 / p90.
+
+Tutto è vettoriale su giocatori e ricampionamenti:
+
+- le righe match-level sono ordinate per (giocatore, data): layout CSR con
+  `starts` = offset del primo match di ogni giocatore;
+- un ricampionamento è una matrice di indici (B, N): per ogni slot si estrae un
+  match dello stesso giocatore; ordinando gli indici riga per riga restano nel
+  segmento del giocatore e in ordine di data (serve al trend sugli ultimi 5);
+- le aggregazioni per giocatore sono np.add.reduceat sugli slot -> (B, P);
+- winsorization, RobustScaler e MinMaxScaler sono rifittati per ricampionamento
+  con quantili/min/max lungo l'asse dei giocatori (stessa formula di sklearn).
+
+Ogni ricampionamento è una "stagione alternativa" dell'intera lega: la
+normalizzazione si muove insieme ai dati, come nel batch reale.
+"""
+
+import numpy as np
+import pandas as pd
+
+from valuation_engine_v3 import ROLE_WEIGHTS, SCORE_COLUMNS, CalibratedValuation
+
+N_RESAMPLES = 1000
+BATCH_SIZE = 50           # Ricampionamenti per blocco: limita la memoria a ~B x N
+PERCENTILES = (10, 50, 90)
+RECENT_WINDOW = 5
+
+ROLE_CODES = {'attacker': 0, 'midfielder': 1, 'defender': 2}
+
+
+def _csr_layout(match_data: pd.DataFrame):
+    """Righe ordinate per (giocatore, data) dei soli giocatori valutati + offset CSR."""
+    md = match_data[match_data['player_name'].notna()]
+    ordered = md.sort_values(['player_name', 'match_date'], kind='mergesort', na_position='last')
+    minutes = ordered.groupby('player_name', sort=False)['minutes'].sum()
+    valued = minutes.index[~(minutes < 90)]  # Stesso filtro di aggregate_players
+    ordered = ordered[ordered['player_name'].isin(valued)].reset_index(drop=True)
+
+    counts = ordered.groupby('player_name', sort=False).size()
+    starts = np.concatenate([[0], np.cumsum(counts.to_numpy())[:-1]]).astype(np.int64)
+    return ordered, counts, starts
+
+
+def _row_arrays(ordered: pd.DataFrame, counts: pd.Series) -> dict:
+    """Colonne per-match come array float (NaN -> 0 dove pandas sommerebbe con skipna)."""
+    def col(name):
+        return pd.to_numeric(ordered[name], errors='coerce').to_numpy(dtype=np.float64)
+
+    minutes, goals, assists, npxg = col('minutes'), col('goals'), col('assists'), col('npxg')
+    elo = ordered['opponent_elo'].fillna(1500).to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (npxg * 2 + goals * 1.5 + assists * 1.2) / (minutes / 90)
+    finite = np.isfinite(score)
+
+    # Posizione di ogni slot dalla fine del suo segmento: gli ultimi 5 sono "recent"
+    n = counts.to_numpy()
+    ends = np.repeat(np.cumsum(n), n)
+    recent_slot = (ends - np.arange(len(ordered))) <= RECENT_WINDOW
+
+    return {
+        'minutes': np.nan_to_num(minutes),
+        'goals': np.nan_to_num(goals),
+        'assists': np.nan_to_num(assists),
+        'npxg': np.nan_to_num(npxg),
+        'xg': np.nan_to_num(col('xg')),
+        'shots': np.nan_to_num(col('shots')),
+        'sot': np.nan_to_num(col('shots_on_target')),
+        'weighted_goals': np.nan_to_num(goals * (elo / 1500)),
+        'elo': elo,
+        'score': np.where(finite, score, 0.0),
+        'score_sq': np.where(finite, score, 0.0) ** 2,
+        'score_valid': finite.astype(np.float64),
+        'score_inf': np.isinf(score).astype(np.float64),
+        'recent_slot': recent_slot,
+    }
+
+
+def _player_constants(model: CalibratedValuation, ordered: pd.DataFrame, counts: pd.Series, roles: dict | None) -> dict:
+    """Attributi per giocatore che non dipendono dal ricampionamento."""
+    first = ordered.groupby('player_name', sort=False)
+    player_id = first['player_id'].first().to_numpy()
+    birth_date = first['birth_date'].first().reset_index(drop=True)
+    role_map = roles or {}
+    return {
+        'player_id': player_id,
+        'n_matches': counts.to_numpy(dtype=np.float64),
+        'age_multiplier': model.age_multipliers(birth_date).to_numpy(),
+        # Ruolo da clustering (etichette non standard -> pesi 'defender', come nel modello)
+        'fixed_role': np.array([
+            ROLE_CODES.get(role_map[pid], ROLE_CODES['defender']) if pid in role_map else -1
+            for pid in player_id
+        ]),
+        'weight_table': pd.DataFrame(ROLE_WEIGHTS).T.loc[list(ROLE_CODES), SCORE_COLUMNS].to_numpy(),
+    }
+
+
+def _resample_fair_values(arrays: dict, idx: np.ndarray, starts: np.ndarray, constants: dict) -> np.ndarray:
+    """Fair value (B, P) per una matrice di indici di ricampionamento (B, N) già ordinata."""
+    recent = arrays['recent_slot']
+
+    def sums(name, mask=None):
+        values = arrays[name][idx]
+        if mask is not None:
+            values = values * mask
+        return np.add.reduceat(values, starts, axis=1)
+
+    n_matches = constants['n_matches']
+    minutes = sums('minutes')
+    goals, assists, npxg = sums('goals'), sums('assists'), sums('npxg')
+    sot, shots = sums('sot'), sums('shots')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Consistenza
+        n_valid = sums('score_valid')
+        mean = sums('score') / n_valid
+        var = np.maximum(sums('score_sq') - n_valid * mean ** 2, 0.0) / (n_valid - 1)
+        cv = np.sqrt(var) / (mean + 0.01)
+        cv = np.where(n_valid >= 2, cv, np.nan)
+        consistency = np.where(np.isnan(cv) | (sums('score_inf') > 0), 0.3, np.maximum(0.3, 1 - np.minimum(cv / 2, 0.7)))
+        consistency = np.where(n_matches < 3, 0.5, consistency)
+
+        # Trend: gli indici ordinati mettono gli ultimi 5 slot del segmento sui match più recenti
+        recent_perf = (sums('npxg', recent) + sums('goals', recent) * 0.8) / np.maximum(sums('minutes', recent) / 90, 1)
+        older_perf = (sums('npxg', ~recent) + sums('goals', ~recent) * 0.8) / np.maximum(sums('minutes', ~recent) / 90, 1)
+        trend = np.where(older_perf < 0.01, 1.0, np.clip(recent_perf / older_perf, 0.7, 1.3))
+        trend = np.where(n_matches < 6, 1.0, trend)
+
+        goal_quality = np.where(goals == 0, 1.0, sums('weighted_goals') / goals)
+        avg_opponent_elo = sums('elo') / n_matches
+
+        p90 = {
+            'npxg_p90': npxg / minutes * 90,
+            'goals_p90': goals / minutes * 90,
+            'assists_p90': assists / minutes * 90,
+            'sot_p90': sot / minutes * 90,
+        }
+        shots_p90 = shots / minutes * 90
+
+    # Ruolo: clustering se disponibile, altrimenti soglie di infer_role sul ricampionamento
+    inferred = np.select(
+        [(p90['goals_p90'] > 0.4) | (shots_p90 > 3.0), p90['assists_p90'] > 0.25],
+        [ROLE_CODES['attacker'], ROLE_CODES['midfielder']],
+        default=ROLE_CODES['defender'],
+    )
+    role_code = np.where(constants['fixed_role'] >= 0, constants['fixed_role'], inferred)
+    weights = constants['weight_table'][role_code]  # (B, P, 4)
+
+    # Normalizzazione di lega per ricampionamento (winsorization + Robust + MinMax)
+    scaled = []
+    for col in SCORE_COLUMNS:
+        x = p90[col]
+        x = np.where(np.isfinite(x), x, np.nan)
+        cap = np.nanquantile(x, 0.99, axis=1, keepdims=True)
+        x = np.minimum(x, cap)
+        q25, median, q75 = np.nanquantile(x, [0.25, 0.5, 0.75], axis=1, keepdims=True)
+        iqr = q75 - q25
+        x = (x - median) / np.where(iqr == 0, 1.0, iqr)
+        lo, hi = np.nanmin(x, axis=1, keepdims=True), np.nanmax(x, axis=1, keepdims=True)
+        scaled.append((x - lo) / np.where(hi - lo == 0, 1.0, hi - lo))
+
+    performance_score = (
+        scaled[0] * weights[..., 0] +
+        scaled[1] * weights[..., 1] +
+        scaled[2] * weights[..., 2] +
+        scaled[3] * weights[..., 3]
+    ) * 100
+
+    reliability = 1 / (1 + np.exp(-0.005 * (minutes - 900)))
+    schedule_bonus = 1 + np.clip((avg_opponent_elo - 1500) / 1500 * 0.15, -0.1, 0.15)
+
+    fair_value = 800_000 + (
+        performance_score ** 1.65 *
+        reliability *
+        trend *
+        consistency *
+        goal_quality *
+        schedule_bonus *
+        constants['age_multiplier'] *
+        120_000
+    )
+    fair_value = np.round(fair_value / 500_000) * 500_000
+    return np.clip(fair_value, 500_000, 200_000_000)
+
+
+def bootstrap_fair_values(
+    model: CalibratedValuation,
+    match_data: pd.DataFrame,
+    n_resamples: int = N_RESAMPLES,
+    roles: dict | None = None,
+    seed: int = 42,
+    batch_size: int = BATCH_SIZE,
+) -> pd.DataFrame:
+    """p10/p50/p90 del fair value per giocatore da n_resamples ricampionamenti delle partite."""
+    ordered, counts, starts = _csr_layout(match_data)
+    if ordered.empty:
+        return pd.DataFrame(columns=['player_name', 'player_id'] + [f'fair_value_p{p}' for p in PERCENTILES])
+    arrays = _row_arrays(ordered, counts)
+
+    constants = _player_constants(model, ordered, counts, roles)
+
+    # Per ogni slot: inizio e lunghezza del segmento del suo giocatore
+    n = counts.to_numpy()
+    slot_start = np.repeat(starts, n)
+    slot_len = np.repeat(n, n)
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for done in range(0, n_resamples, batch_size):
+        b = min(batch_size, n_resamples - done)
+        idx = slot_start + (rng.random((b, len(slot_start))) * slot_len).astype(np.int64)
+        idx.sort(axis=1)  # Resta nel segmento del giocatore, in ordine di data
+        results.append(_resample_fair_values(arrays, idx, starts, constants))
+    samples = np.concatenate(results, axis=0)
+
+    bands = np.nanpercentile(samples, PERCENTILES, axis=0)
+    out = pd.DataFrame({'player_name': counts.index, 'player_id': constants['player_id']})
+    for p, values in zip(PERCENTILES, bands):
+        out[f'fair_value_p{p}'] = values
+    return out
@@ -2,20 +2,157 @@ import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler, RobustScaler
 from sqlalchemy import create_engine, text
+import argparse
+import hashlib
+import io
 import os
+import time
 from dotenv import load_dotenv
 import urllib.parse
+from dataclasses import dataclass
+
+import row_checksum
+import valuation_state
+from team_keys import team_key, team_season_code
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', 'data-processing', '.env'))
 
+# Pesi del performance score per ruolo (qualsiasi altro ruolo usa quelli 'defender')
+ROLE_WEIGHTS = {
+    'attacker': {'npxg_p90': 0.45, 'goals_p90': 0.25, 'assists_p90': 0.15, 'sot_p90': 0.15},
+    'midfielder': {'npxg_p90': 0.30, 'goals_p90': 0.15, 'assists_p90': 0.40, 'sot_p90': 0.15},
+    'defender': {'npxg_p90': 0.25, 'goals_p90': 0.20, 'assists_p90': 0.30, 'sot_p90': 0.25},
+}
+
+# Una riga per player-season: fair value + componenti del modello
+VALUATION_COMPONENTS = [
+    'fair_value', 'performance_score', 'reliability', 'trend', 'consistency',
+    'goal_quality', 'schedule_bonus', 'age_multiplier',
+]
+
+VALUATION_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS player_season_valuations (
+        player_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        role TEXT,
+        minutes INTEGER NOT NULL,
+        matches_played INTEGER NOT NULL,
+        fair_value DOUBLE PRECISION NOT NULL,
+        performance_score DOUBLE PRECISION,
+        reliability DOUBLE PRECISION,
+        trend DOUBLE PRECISION,
+        consistency DOUBLE PRECISION,
+        goal_quality DOUBLE PRECISION,
+        schedule_bonus DOUBLE PRECISION,
+        age_multiplier DOUBLE PRECISION,
+        fair_value_p10 DOUBLE PRECISION,
+        fair_value_p50 DOUBLE PRECISION,
+        fair_value_p90 DOUBLE PRECISION,
+        computed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (player_id, season)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_player_season_valuations_season ON player_season_valuations (season)",
+    # Bande bootstrap (valuation_bootstrap.py) su tabelle create prima della loro introduzione
+    "ALTER TABLE player_season_valuations ADD COLUMN IF NOT EXISTS fair_value_p10 DOUBLE PRECISION",
+    "ALTER TABLE player_season_valuations ADD COLUMN IF NOT EXISTS fair_value_p50 DOUBLE PRECISION",
+    "ALTER TABLE player_season_valuations ADD COLUMN IF NOT EXISTS fair_value_p90 DOUBLE PRECISION",
+]
+VALUATION_BANDS = ['fair_value_p10', 'fair_value_p50', 'fair_value_p90']
+
+SCORE_COLUMNS = ['npxg_p90', 'goals_p90', 'assists_p90', 'sot_p90']
+
+# Colonne lette da get_clean_data (+ chiave di ordinamento): impronta delle righe già integrate
+FOLD_CHECKSUM_COLUMNS = (
+    'v.player_id', 'v.match_date', 'v.player_name', 'v.team_id', 'v.opponent', 'v.goals',
+    'v.assists', 'v.npxg', 'v.shots', 'v.shots_on_target', 'v.minutes', 'p.birth_date',
+)
+
+def attach_opponent_elo(matches, team_elo, columns=None):
+    """ELO dell'avversario all'ultima riga team_performance con data <= data del match.
+
+    Un solo merge_asof ordinato su tutta la stagione (O(n log n)) al posto di un
+    lookup per riga o di un join a data esatta, che perde i match in cui
+    l'avversario non ha una riga proprio in quel giorno. Ordine delle righe invariato.
+    `columns` mappa altre colonne di team_performance (es. la forma) sull'output.
+    """
+    columns = columns or {'elo': 'opponent_elo'}
+    out = matches.copy()
+    for target in columns.values():
+        out[target] = np.nan
+    if out.empty or team_elo.empty:
+        return out
+
+    left = pd.DataFrame({
+        'row': np.arange(len(out)),
+        'team_id': out['opponent'].map(team_key),
+        'match_date': pd.to_datetime(out['match_date'], errors='coerce'),
+    }).dropna(subset=['team_id', 'match_date'])
+    right = pd.DataFrame({
+        'team_id': team_elo['team_id'].map(team_key),
+        'match_date': pd.to_datetime(team_elo['match_date'], errors='coerce'),
+        **{target: pd.to_numeric(team_elo[source], errors='coerce') for source, target in columns.items()},
+    }).dropna(subset=['team_id', 'match_date']).dropna(subset=list(columns.values()), how='all')
+    if left.empty or right.empty:
+        return out
+
+    left['match_date'] = left['match_date'].astype('datetime64[ns]')
+    right['match_date'] = right['match_date'].astype('datetime64[ns]')
+    merged = pd.merge_asof(
+        left.sort_values('match_date', kind='mergesort'),
+        right.sort_values('match_date', kind='mergesort'),
+        on='match_date',
+        by='team_id',
+        direction='backward',
+    )
+    rows = merged['row'].to_numpy()
+    for target in columns.values():
+        values = np.full(len(out), np.nan)
+        values[rows] = merged[target].to_numpy()
+        out[target] = values
+    return out
+
+
+def copy_frame(conn, table, frame):
+    """COPY di un DataFrame in una tabella (stream CSV in memoria, driver psycopg2)."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+@dataclass(frozen=True)
+class LeagueNormalization:
+    """Winsorization + scaler fittati sulla lega: riusabili per ri-valutare singole righe."""
+    caps: dict
+    robust: RobustScaler
+    min_max: MinMaxScaler
+    clip: bool = False  # Righe fuori dalla lega (what-if): limita il risultato a [0, 1]
+
+    def transform(self, features):
+        capped = features[SCORE_COLUMNS].copy()
+        for col in SCORE_COLUMNS:
+            capped[col] = capped[col].clip(upper=self.caps[col])
+        scaled = self.min_max.transform(self.robust.transform(capped))
+        return np.clip(scaled, 0.0, 1.0) if self.clip else scaled
+
+
 class CalibratedValuation:
-    def __init__(self, season='2025'):
-        db_password = os.getenv('DB_PASSWORD')
-        encoded_password = urllib.parse.quote_plus(db_password)
-        self.engine = create_engine(f"postgresql://{os.getenv('DB_USER')}:{encoded_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+    def __init__(self, season='2025', engine=None):
+        if engine is None:
+            db_password = os.getenv('DB_PASSWORD')
+            encoded_password = urllib.parse.quote_plus(db_password)
+            engine = create_engine(f"postgresql://{os.getenv('DB_USER')}:{encoded_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
+        self.engine = engine
         self.season = season
 
-    def get_clean_data(self):
+    def get_clean_data(self, since=None):
+        """Righe match-level della stagione (solo quelle con match_date > since, se indicato)."""
         # Leggiamo dalla VISTA e manteniamo le righe match-level per metriche avanzate
         query = text("""
             SELECT
@@ -35,9 +172,10 @@ class CalibratedValuation:
             FROM v_full_match_stats v
             JOIN players p ON v.player_id = p.player_id
             WHERE season = :s
+              AND (CAST(:since AS DATE) IS NULL OR match_date > :since)
         """)
         try:
-            df = pd.read_sql(query, self.engine, params={"s": self.season})
+            df = pd.read_sql(query, self.engine, params={"s": self.season, "since": since})
         except Exception:
             fallback_query = text("""
                 SELECT
@@ -57,24 +195,45 @@ class CalibratedValuation:
                 FROM v_full_match_stats v
                 JOIN players p ON v.player_id = p.player_id
                 WHERE season = :s
+                  AND (CAST(:since AS DATE) IS NULL OR match_date > :since)
             """)
             try:
-                df = pd.read_sql(fallback_query, self.engine, params={"s": self.season})
+                df = pd.read_sql(fallback_query, self.engine, params={"s": self.season, "since": since})
             except Exception:
                 xa_fallback = text(str(fallback_query).replace("npxg", "xa"))
-                df = pd.read_sql(xa_fallback, self.engine, params={"s": self.season})
+                df = pd.read_sql(xa_fallback, self.engine, params={"s": self.season, "since": since})
                 df = df.rename(columns={"xa": "npxg"})
                 df["xg"] = df["npxg"]
-        if "opponent_elo" not in df.columns:
-            df["opponent_elo"] = np.nan
-        return df
+        return attach_opponent_elo(df, self.load_team_elo())
+
+    def load_team_elo(self):
+        """Storico ELO di tutte le squadre nella stagione (team_performance)."""
+        query = text("""
+            SELECT team_id, match_date, elo
+            FROM team_performance
+            WHERE season = :s AND elo IS NOT NULL
+        """)
+        try:
+            return pd.read_sql(query, self.engine, params={"s": team_season_code(self.season)})
+        except Exception:
+            return pd.DataFrame(columns=['team_id', 'match_date', 'elo'])
+
+    def load_roles(self):
+        """Ruoli dal clustering batch (role_clustering.py): {player_id: role}"""
+        query = text("SELECT player_id, role FROM player_roles WHERE season = :s")
+        try:
+            with self.engine.connect() as conn:
+                return {int(r[0]): r[1] for r in conn.execute(query, {"s": self.season})}
+        except Exception:
+            return {}  # Clustering mai eseguito: si usano le regole di infer_role
 
     def sigmoid_reliability(self, minutes, midpoint=900, k=0.005):
         """Funzione Sigmoide: 0.5 a 900 min (~10 partite), 0.9 a 1800+ min"""
         return 1 / (1 + np.exp(-k * (minutes - midpoint)))
     
-    def infer_role(self, goals_p90, assists_p90, shots_p90):
-        """Inferisce ruolo dal comportamento statistico"""
+    @staticmethod
+    def infer_role(goals_p90, assists_p90, shots_p90):
+        """Inferisce ruolo dal comportamento statistico (fallback se manca il clustering)"""
         if goals_p90 > 0.4 or shots_p90 > 3.0:
             return 'attacker'
         elif assists_p90 > 0.25:
@@ -143,41 +302,117 @@ class CalibratedValuation:
         
         return weighted_goals / total_goals if total_goals > 0 else 1.0
 
-    def calculate_model(self, match_data):
-        """Algoritmo Top-Tier: Integra consistenza, trend, goal quality, ruolo"""
+    def aggregate_players(self, match_data):
+        """FASE 1: una riga per giocatore con somme e metriche avanzate.
+
+        Equivalente vettoriale di calculate_consistency / calculate_trend /
+        goal_quality_score applicati a ogni gruppo: tutto passa da groupby
+        e aritmetica su array, senza loop Python sui giocatori.
+        """
+        md = match_data[match_data['player_name'].notna()]
+        key = md['player_name']
+        grouped = md.groupby(key, sort=True)
+
+        sums = grouped[['minutes', 'goals', 'assists', 'npxg', 'xg', 'shots', 'shots_on_target']].sum()
+        n_matches = grouped.size()
+
+        # Team più frequente (a parità, il primo in ordine: come Series.mode()[0])
+        team_counts = md.groupby([key, md['team_id']]).size().rename('n').reset_index()
+        team_mode = (
+            team_counts.sort_values(['player_name', 'n', 'team_id'], ascending=[True, False, True], kind='mergesort')
+            .drop_duplicates('player_name')
+            .set_index('player_name')['team_id']
+        )
+
+        # Consistenza: CV del performance score per match (inf -> 0.3 come nel caso scalare)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            match_scores = (md['npxg'] * 2 + md['goals'] * 1.5 + md['assists'] * 1.2) / (md['minutes'] / 90)
+        has_inf = np.isinf(match_scores).groupby(key).any()
+        finite_scores = match_scores.replace([np.inf, -np.inf], np.nan).groupby(key)
+        cv = finite_scores.std() / (finite_scores.mean() + 0.01)
+        consistency = np.where(
+            cv.isna() | has_inf, 0.3, np.maximum(0.3, 1 - np.minimum(cv / 2, 0.7))
+        )
+        consistency = np.where(n_matches < 3, 0.5, consistency)
+
+        # Trend: ultimi 5 match (per data, NaT in coda come sort_values) vs precedenti
+        ordered = md.sort_values(['player_name', 'match_date'], kind='mergesort', na_position='last')
+        is_recent = ordered.groupby('player_name').cumcount(ascending=False) < 5
+        trend_cols = ['npxg', 'goals', 'minutes']
+        recent = ordered.loc[is_recent, trend_cols].groupby(ordered.loc[is_recent, 'player_name']).sum()
+        older = ordered.loc[~is_recent, trend_cols].groupby(ordered.loc[~is_recent, 'player_name']).sum()
+        recent = recent.reindex(n_matches.index, fill_value=0)
+        older = older.reindex(n_matches.index, fill_value=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recent_perf = (recent['npxg'] + recent['goals'] * 0.8) / np.maximum(recent['minutes'] / 90, 1)
+            older_perf = (older['npxg'] + older['goals'] * 0.8) / np.maximum(older['minutes'] / 90, 1)
+            trend = np.where(older_perf < 0.01, 1.0, np.clip(recent_perf / older_perf, 0.7, 1.3))
+        trend = np.where(n_matches < 6, 1.0, trend)
+
+        # Goal quality e ELO medio avversari
+        elo = md['opponent_elo'].fillna(1500)
+        weighted_goals = (md['goals'] * (elo / 1500)).groupby(key).sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            goal_quality = np.where(sums['goals'] == 0, 1.0, weighted_goals / sums['goals'])
+
+        df = pd.DataFrame({
+            'player_name': n_matches.index,
+            'player_id': grouped['player_id'].first().to_numpy(),
+            'team_id': team_mode.reindex(n_matches.index).to_numpy(),
+            'birth_date': grouped['birth_date'].first().to_numpy(),
+            'minutes': sums['minutes'].to_numpy(),
+            'goals': sums['goals'].to_numpy(),
+            'assists': sums['assists'].to_numpy(),
+            'npxg': sums['npxg'].to_numpy(),
+            'xg': sums['xg'].to_numpy(),
+            'shots': sums['shots'].to_numpy(),
+            'sot': sums['shots_on_target'].to_numpy(),
+            'matches_played': n_matches.to_numpy(),
+            'consistency': consistency,
+            'trend': trend,
+            'goal_quality': goal_quality,
+            'avg_opponent_elo': elo.groupby(key).mean().to_numpy(),
+        })
+
+        # Minimo 1 partita completa
+        return df[~(df['minutes'] < 90)].reset_index(drop=True)
+
+    def age_multipliers(self, birth_dates):
+        """Versione vettoriale di calculate_age_factor."""
+        bd = pd.to_datetime(birth_dates)
+        age = (pd.Timestamp.now() - bd).dt.days / 365.25
+        factors = np.select(
+            [age < 22, age < 25, age < 29, age < 32],
+            [1.35, 1.20, 1.00, 0.70],
+            default=0.40,
+        )
+        return pd.Series(np.where(bd.isna(), 1.0, factors), index=birth_dates.index)
+
+    def calculate_model(self, match_data, roles=None):
+        """Algoritmo Top-Tier: Integra consistenza, trend, goal quality, ruolo
+
+        roles: {player_id: role} dal clustering; i giocatori non presenti
+        ricadono su infer_role.
+        """
         
         # === FASE 1: Aggregazione Player-Level con Metriche Avanzate ===
-        player_stats = []
-        
-        for player_name, group in match_data.groupby('player_name'):
-            total_minutes = group['minutes'].sum()
-            
-            if total_minutes < 90:  # Minimo 1 partita completa
-                continue
-            
-            stats = {
-                'player_name': player_name,
-                'team_id': group['team_id'].mode()[0] if len(group) > 0 else None,
-                'birth_date': group['birth_date'].dropna().iloc[0] if not group['birth_date'].dropna().empty else None,
-                'minutes': total_minutes,
-                'goals': group['goals'].sum(),
-                'assists': group['assists'].sum(),
-                'npxg': group['npxg'].sum(),
-                'xg': group['xg'].sum(),
-                'shots': group['shots'].sum(),
-                'sot': group['shots_on_target'].sum(),
-                'matches_played': len(group),
-                
-                # Metriche Avanzate
-                'consistency': self.calculate_consistency(group),
-                'trend': self.calculate_trend(group),
-                'goal_quality': self.goal_quality_score(group),
-                'avg_opponent_elo': group['opponent_elo'].fillna(1500).mean()
-            }
-            
-            player_stats.append(stats)
-        
-        df = pd.DataFrame(player_stats)
+        return self.score_players(self.aggregate_players(match_data), roles)
+
+    def score_players(self, players, roles=None, normalization=None):
+        """FASI 2-9 sulla tabella per giocatore (da aggregate_players o dallo stato incrementale).
+
+        Senza normalization, winsorization e scaler vengono fittati sull'intera lega;
+        passando una LeagueNormalization già fittata si ri-valutano righe singole
+        (what-if) sulla stessa scala senza toccare il resto della lega.
+        """
+        df = self.prepare_features(players, roles)
+        if normalization is None:
+            normalization = self.fit_normalization(df)
+        return self.apply_model(df, normalization)
+
+    def prepare_features(self, players, roles=None):
+        """FASI 2-3: metriche per 90 e ruolo."""
+        df = players.copy()
         
         # === FASE 2: Metriche Per 90 Minuti ===
         metrics = ['goals', 'assists', 'npxg', 'xg', 'shots', 'sot']
@@ -185,43 +420,51 @@ class CalibratedValuation:
             df[f'{m}_p90'] = (df[m] / df['minutes']) * 90
         
         # === FASE 3: Inferenza Ruolo ===
-        df['role'] = df.apply(lambda x: self.infer_role(x['goals_p90'], x['assists_p90'], x['shots_p90']), axis=1)
+        # Stesse soglie di infer_role, applicate all'intera colonna
+        df['role'] = np.select(
+            [(df['goals_p90'] > 0.4) | (df['shots_p90'] > 3.0), df['assists_p90'] > 0.25],
+            ['attacker', 'midfielder'],
+            default='defender',
+        )
+        if roles:
+            df['role'] = df['player_id'].map(roles).fillna(df['role'])
+        return df
+
+    def fit_normalization(self, df):
+        """FASE 5 (fit): cap al 99° percentile + RobustScaler + MinMaxScaler sulla lega."""
+        capped = df[SCORE_COLUMNS].copy()
+        # Winsorization (cap al 99° percentile)
+        caps = {col: capped[col].quantile(0.99) for col in SCORE_COLUMNS}
+        for col in SCORE_COLUMNS:
+            capped[col] = capped[col].clip(upper=caps[col])
+        robust = RobustScaler().fit(capped)  # Usa mediana e IQR invece di media e std
+        min_max = MinMaxScaler().fit(robust.transform(capped))  # Min-Max per portare a 0-1
+        return LeagueNormalization(caps=caps, robust=robust, min_max=min_max)
+
+    def apply_model(self, df, normalization):
+        """FASI 4-9 con una normalizzazione già fittata."""
+        df = df.copy()
         
         # === FASE 4: Pesi Dinamici per Ruolo ===
-        def get_weights(role):
-            if role == 'attacker':
-                return {'npxg_p90': 0.45, 'goals_p90': 0.25, 'assists_p90': 0.15, 'sot_p90': 0.15}
-            elif role == 'midfielder':
-                return {'npxg_p90': 0.30, 'goals_p90': 0.15, 'assists_p90': 0.40, 'sot_p90': 0.15}
-            else:  # defender/altro
-                return {'npxg_p90': 0.25, 'goals_p90': 0.20, 'assists_p90': 0.30, 'sot_p90': 0.25}
+        cols_p90 = SCORE_COLUMNS
+        weight_table = pd.DataFrame(ROLE_WEIGHTS).T[cols_p90]
+        role_key = df['role'].where(df['role'].isin(weight_table.index), 'defender')  # defender/altro
+        w = weight_table.loc[role_key].to_numpy()
         
         # === FASE 5: Normalizzazione Robusta (Resiste a outlier) ===
-        scaler = RobustScaler()  # Usa mediana e IQR invece di media e std
-        cols_p90 = ['npxg_p90', 'goals_p90', 'assists_p90', 'sot_p90']
-        
-        # Winsorization (cap al 99° percentile)
-        for col in cols_p90:
-            cap = df[col].quantile(0.99)
-            df[col] = df[col].clip(upper=cap)
-        
-        df[cols_p90] = scaler.fit_transform(df[cols_p90])
-        
-        # Min-Max per portare a 0-1
-        min_max = MinMaxScaler()
-        df[cols_p90] = min_max.fit_transform(df[cols_p90])
+        df[cols_p90] = normalization.transform(df[cols_p90])
         
         # === FASE 6: Performance Score Pesato per Ruolo ===
-        df['performance_score'] = df.apply(lambda row: (
-            row['npxg_p90'] * get_weights(row['role'])['npxg_p90'] +
-            row['goals_p90'] * get_weights(row['role'])['goals_p90'] +
-            row['assists_p90'] * get_weights(row['role'])['assists_p90'] +
-            row['sot_p90'] * get_weights(row['role'])['sot_p90']
-        ) * 100, axis=1)
+        df['performance_score'] = (
+            df['npxg_p90'] * w[:, 0] +
+            df['goals_p90'] * w[:, 1] +
+            df['assists_p90'] * w[:, 2] +
+            df['sot_p90'] * w[:, 3]
+        ) * 100
         
         # === FASE 7: Fattori Moltiplicativi ===
-        df['reliability'] = df['minutes'].apply(self.sigmoid_reliability)
-        df['age_multiplier'] = df['birth_date'].apply(self.calculate_age_factor)
+        df['reliability'] = self.sigmoid_reliability(df['minutes'])
+        df['age_multiplier'] = self.age_multipliers(df['birth_date'])
         
         # Bonus/Malus Calendario (ELO medio avversari)
         df['schedule_difficulty'] = (df['avg_opponent_elo'] - 1500) / 1500  # Normalized
@@ -252,39 +495,192 @@ class CalibratedValuation:
         
         return df.sort_values(by='fair_value', ascending=False)
 
-    def save_to_db(self, df):
-        print(f"💾 Salvataggio valori su schema V2...")
+    def _copy_to_staging(self, conn, table, frame):
+        copy_frame(conn, table, frame)
+
+    # ------------------------------------------------------------------
+    # Run incrementali: stato per giocatore + watermark per stagione
+    # ------------------------------------------------------------------
+    def load_state(self):
+        query = text("SELECT * FROM valuation_player_state WHERE season = :s")
+        try:
+            records = pd.read_sql(query, self.engine, params={"s": self.season})
+        except Exception:
+            return valuation_state.empty_state()  # Primo run: tabella non ancora creata
+        return valuation_state.records_to_state(records)
+
+    def load_watermark(self):
+        query = text("""
+            SELECT last_match_date, rows_folded, checksum
+            FROM valuation_watermarks WHERE season = :s
+        """)
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(query, {"s": self.season}).fetchone()
+        except Exception:
+            return None
+        return dict(row._mapping) if row else None
+
+    def _folded_checksum(self, columns, until):
+        with self.engine.connect() as conn:
+            return row_checksum.table_checksums(
+                conn, "v_full_match_stats v JOIN players p ON v.player_id = p.player_id", columns,
+                ("v.player_id", "v.match_date"), where="v.season = :s AND v.match_date <= :until",
+                params={"s": self.season, "until": until},
+            )[None]
+
+    def folded_fingerprint(self, until):
+        """Impronta delle righe fino al watermark: se cambia, lo stato non è più valido.
+
+        Checksum di tutte le colonne lette da get_clean_data (correzioni tardive di
+        npxg, tiri, squadra... incluse) e dello storico ELO usato per opponent_elo.
+        """
+        # Stessa cascata di fallback di get_clean_data (vista senza opponent, xa al posto di npxg)
+        try:
+            stats = self._folded_checksum(FOLD_CHECKSUM_COLUMNS, until)
+        except Exception:
+            without_opponent = tuple(c for c in FOLD_CHECKSUM_COLUMNS if c != 'v.opponent')
+            try:
+                stats = self._folded_checksum(without_opponent, until)
+            except Exception:
+                stats = self._folded_checksum(tuple(c.replace('npxg', 'xa') for c in without_opponent), until)
+        try:
+            with self.engine.connect() as conn:
+                elo = row_checksum.table_checksums(
+                    conn, "team_performance", ("team_id", "match_date", "elo"), ("team_id", "match_date"),
+                    where="season = :s AND elo IS NOT NULL AND match_date <= :until",
+                    params={"s": team_season_code(self.season), "until": until},
+                )[None]["checksum"]
+        except Exception:
+            elo = ""  # Come load_team_elo: nessuno storico ELO
+        digest = hashlib.md5(f"{stats['checksum']}:{elo}".encode("utf-8")).hexdigest()
+        return {"rows_folded": stats["n_rows"], "checksum": digest}
+
+    def save_state(self, folded, watermark, replace=False):
+        """Scrive i giocatori ricalcolati (o tutta la stagione se replace) e il nuovo watermark."""
+        records = valuation_state.state_to_records(folded, self.season)
         with self.engine.begin() as conn:
-            # Qui dobbiamo fare un update un po' più complesso perché dobbiamo risalire all'ID
-            # Ma dato che il fair_value è stagionale, possiamo aggiornare tutte le righe di quel giocatore in quella stagione
-            # oppure (meglio) salvare il fair_value nell'anagrafica o in una tabella di cache.
-            # Per ora, aggiorniamo le stats delle partite recenti.
-            
-            for _, row in df.iterrows():
+            for ddl in valuation_state.STATE_SCHEMA_SQL:
+                conn.execute(text(ddl))
+            if replace:
+                conn.execute(text("DELETE FROM valuation_player_state WHERE season = :s"), {"s": self.season})
+            else:
                 conn.execute(
-                    text("""
-                        UPDATE player_stats_v2 s
-                        SET fair_value = :v
-                        FROM players p, matches m
-                        WHERE s.player_id = p.player_id 
-                          AND s.match_id = m.match_id
-                          AND p.name = :n 
-                          AND m.season = :s
-                    """),
-                    {"v": row['fair_value'], "n": row['player_name'], "s": self.season}
+                    text("DELETE FROM valuation_player_state WHERE season = :s AND player_id = ANY(:ids)"),
+                    {"s": self.season, "ids": records['player_id'].tolist()},
                 )
+            if not records.empty:
+                self._copy_to_staging(conn, "valuation_player_state", records)
+            conn.execute(
+                text("""
+                    INSERT INTO valuation_watermarks (season, last_match_date, rows_folded, checksum)
+                    VALUES (:s, :last_match_date, :rows_folded, :checksum)
+                    ON CONFLICT (season) DO UPDATE SET
+                        last_match_date = EXCLUDED.last_match_date,
+                        rows_folded = EXCLUDED.rows_folded,
+                        checksum = EXCLUDED.checksum,
+                        updated_at = now()
+                """),
+                {"s": self.season, **watermark},
+            )
+
+    def run_incremental(self, roles=None, full=False):
+        """Integra solo i match successivi al watermark e rivaluta la lega dallo stato.
+
+        Ricostruzione completa se non c'è uno stato, se richiesto (full=True) o se le
+        righe già integrate sono cambiate (ETL rieseguito su giornate passate).
+        """
+        watermark = None if full else self.load_watermark()
+        if watermark is not None:
+            current = self.folded_fingerprint(watermark["last_match_date"])
+            if any(current[k] != watermark[k] for k in current):
+                print("♻️  Righe già integrate modificate: ricostruzione completa dello stato")
+                watermark = None
+
+        since = watermark["last_match_date"] if watermark else None
+        rows = self.get_clean_data(since=since)
+        state = self.load_state() if watermark else valuation_state.empty_state()
+        print(f"📊 {'Delta' if watermark else 'Ricostruzione completa'}: {len(rows)} righe match-level")
+
+        folded = valuation_state.fold_matches(state, rows)
+        state = valuation_state.apply_fold(state, folded)
+        if state.empty:
+            return pd.DataFrame()
+
+        dates = pd.to_datetime(rows['match_date'])
+        if dates.notna().any():
+            last_date = dates.max().date()
+            if watermark and last_date <= watermark["last_match_date"]:
+                last_date = watermark["last_match_date"]
+            self.save_state(folded, {"last_match_date": last_date, **self.folded_fingerprint(last_date)}, replace=watermark is None)
+            print(f"   {len(folded)} giocatori aggiornati, watermark {last_date}")
+
+        return self.score_players(valuation_state.state_to_aggregates(state), roles)
+
+    def run(self, roles=None, full=False, bootstrap=0):
+        """Valutazione della stagione (run_incremental) con bande bootstrap opzionali."""
+        results = self.run_incremental(roles=roles, full=full)
+        if not results.empty and bootstrap > 0:
+            from valuation_bootstrap import bootstrap_fair_values
+
+            start = time.perf_counter()
+            bands = bootstrap_fair_values(self, self.get_clean_data(), n_resamples=bootstrap, roles=roles)
+            results = results.merge(bands[['player_id'] + VALUATION_BANDS], on='player_id', how='left')
+            print(f"🎲 Bande bootstrap ({bootstrap} ricampionamenti) in {time.perf_counter() - start:.1f}s")
+        return results
+
+    def save_to_db(self, df):
+        """Upsert delle valutazioni stagionali in player_season_valuations.
+
+        Una riga per (player_id, season) con fair value e componenti del modello:
+        i valori vengono caricati via COPY in una tabella temporanea e applicati
+        con un unico INSERT ... ON CONFLICT. Restituisce il numero di righe scritte.
+        """
+        print(f"💾 Salvataggio valutazioni stagionali...")
+        start = time.perf_counter()
+        columns = ['player_id', 'role', 'minutes', 'matches_played'] + VALUATION_COMPONENTS + VALUATION_BANDS
+        df = df.reindex(columns=df.columns.union(VALUATION_BANDS, sort=False))  # Bande assenti -> NULL
+        values = df[columns].dropna(subset=['player_id', 'fair_value']).drop_duplicates('player_id')
+        values = values.astype({'player_id': 'int64', 'minutes': 'int64', 'matches_played': 'int64'})
+        values.insert(1, 'season', self.season)
+        assignments = ",\n                        ".join(
+            f"{col} = EXCLUDED.{col}" for col in columns[1:]
+        )
+
+        with self.engine.begin() as conn:
+            for ddl in VALUATION_SCHEMA_SQL:
+                conn.execute(text(ddl))
+            conn.execute(text("""
+                CREATE TEMP TABLE valuation_staging
+                (LIKE player_season_valuations INCLUDING DEFAULTS) ON COMMIT DROP
+            """))
+            self._copy_to_staging(conn, "valuation_staging", values)
+            result = conn.execute(text(f"""
+                INSERT INTO player_season_valuations (season, {', '.join(columns)})
+                SELECT season, {', '.join(columns)} FROM valuation_staging
+                ON CONFLICT (player_id, season) DO UPDATE
+                    SET {assignments},
+                        computed_at = now()
+            """))
+            written = result.rowcount
+
+        print(f"   {written} valutazioni scritte in {time.perf_counter() - start:.2f}s")
+        return written
 
 if __name__ == "__main__":
-    model = CalibratedValuation(season='2025') 
+    parser = argparse.ArgumentParser(description="Valutazione giocatori V3")
+    parser.add_argument("--season", default="2025")
+    parser.add_argument("--full", action="store_true", help="Ignora lo stato incrementale e rilegge tutta la stagione")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N", help="Bande p10/p50/p90 da N ricampionamenti delle partite")
+    args = parser.parse_args()
+
+    model = CalibratedValuation(season=args.season) 
     
     print("🚀 Avvio algoritmo valutazione TOP-TIER...\n")
     
-    data = model.get_clean_data()
-    if not data.empty:
-        print(f"📊 Dati caricati: {len(data)} partite analizzate\n")
-        
-        results = model.calculate_model(data)
-        
+    roles = model.load_roles()
+    results = model.run(roles=roles, full=args.full, bootstrap=args.bootstrap)
+    if not results.empty:
         print("\n" + "="*70)
         print("🏆 TOP 15 GIOCATORI SERIE A (Valutazione Algoritmica Avanzata)")
         print("="*70)
@@ -0,0 +1,176 @@
+"""
+Valuation Runner - Più stagioni in parallelo
+============================================
+Esegue il modello V3 su più stagioni contemporaneamente in un process pool
+(il modello è CPU-bound: pandas/numpy + bootstrap, i thread non bastano).
+
+- Gli input in sola lettura comuni a tutte le stagioni (ruoli da clustering e
+  storico ELO di team_performance) vengono letti una volta dal processo
+  principale e passati ai worker all'avvio del pool.
+- Ogni worker crea il proprio engine (le connessioni non si condividono tra
+  processi) e scrive con il percorso bulk del modello: stato incrementale +
+  COPY/upsert in player_season_valuations.
+- Lo schema viene creato una sola volta prima di avviare i worker, così i DDL
+  non competono tra transazioni concorrenti.
+
+Uso:
+    python valuation_runner.py                          # tutte le stagioni presenti
+    python valuation_runner.py --seasons 2024 2025 --full --bootstrap 1000 --workers 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from sqlalchemy import text
+
+import valuation_state
+from team_keys import team_season_code
+from valuation_engine_v3 import VALUATION_SCHEMA_SQL, CalibratedValuation
+
+# Input condivisi in sola lettura, impostati da _init_worker in ogni processo
+_SHARED = {}
+
+
+class SharedInputValuation(CalibratedValuation):
+    """CalibratedValuation che legge ruoli ed ELO dagli input condivisi del runner."""
+
+    def load_team_elo(self):
+        team_elo = _SHARED.get("team_elo")
+        if team_elo is None:
+            return super().load_team_elo()
+        return team_elo[team_elo["season"] == team_season_code(self.season)]
+
+    def load_roles(self):
+        roles = _SHARED.get("roles")
+        if roles is None:
+            return super().load_roles()
+        return roles.get(str(self.season), {})
+
+
+def available_seasons(engine) -> list[str]:
+    query = text("SELECT DISTINCT season FROM v_full_match_stats ORDER BY season")
+    with engine.connect() as conn:
+        return [str(r[0]) for r in conn.execute(query)]
+
+
+def load_shared_inputs(engine, seasons: list[str]) -> dict:
+    """Ruoli e storico ELO di tutte le stagioni richieste, in una query ciascuno."""
+    try:
+        roles_df = pd.read_sql(
+            text("SELECT season, player_id, role FROM player_roles WHERE season = ANY(:seasons)"),
+            engine, params={"seasons": seasons},
+        )
+        roles = {
+            str(season): dict(zip(group["player_id"].astype(int), group["role"]))
+            for season, group in roles_df.groupby("season")
+        }
+    except Exception:
+        roles = None  # Tabella assente: ogni worker ricade su load_roles()
+
+    try:
+        team_elo = pd.read_sql(
+            text("""
+                SELECT season, team_id, match_date, elo
+                FROM team_performance
+                WHERE season = ANY(:codes) AND elo IS NOT NULL
+            """),
+            engine, params={"codes": [team_season_code(s) for s in seasons]},
+        )
+    except Exception:
+        team_elo = None
+
+    return {"roles": roles, "team_elo": team_elo}
+
+
+def ensure_schema(engine):
+    with engine.begin() as conn:
+        for ddl in VALUATION_SCHEMA_SQL + valuation_state.STATE_SCHEMA_SQL:
+            conn.execute(text(ddl))
+
+
+def _init_worker(shared: dict):
+    _SHARED.update(shared)
+
+
+def value_season(season: str, full: bool = False, bootstrap: int = 0) -> dict:
+    """Valuta e salva una stagione nel processo corrente; restituisce i tempi per fase."""
+    timings = {}
+    start = time.perf_counter()
+    model = SharedInputValuation(season=season)  # Engine proprio del worker
+
+    phase = time.perf_counter()
+    roles = model.load_roles()
+    results = model.run(roles=roles, full=full, bootstrap=bootstrap)
+    timings["model"] = time.perf_counter() - phase
+
+    written = 0
+    if not results.empty:
+        phase = time.perf_counter()
+        written = model.save_to_db(results)
+        timings["save"] = time.perf_counter() - phase
+
+    model.engine.dispose()
+    timings["total"] = time.perf_counter() - start
+    return {"season": season, "players": len(results), "written": written, "timings": timings}
+
+
+def run_seasons(seasons: list[str], full: bool = False, bootstrap: int = 0, workers: int | None = None, engine=None) -> list[dict]:
+    """Valuta le stagioni in parallelo (un processo per stagione, al massimo `workers`)."""
+    engine = engine if engine is not None else CalibratedValuation(season=seasons[0]).engine
+    ensure_schema(engine)
+    shared = load_shared_inputs(engine, seasons)
+    engine.dispose()  # Nessuna connessione aperta ereditata dai worker
+
+    workers = workers or min(len(seasons), os.cpu_count() or 1)
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        futures = {pool.submit(value_season, season, full, bootstrap): season for season in seasons}
+        for future in as_completed(futures):
+            season = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                report = {"season": season, "error": str(e)}
+                print(f"❌ Stagione {season}: {e}")
+            else:
+                t = report["timings"]
+                print(f"✅ Stagione {season}: {report['players']} giocatori in {t['total']:.1f}s "
+                      f"(modello {t['model']:.1f}s, salvataggio {t.get('save', 0.0):.1f}s)")
+            reports.append(report)
+
+    return sorted(reports, key=lambda r: r["season"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valutazione V3 multi-stagione in parallelo")
+    parser.add_argument("--seasons", nargs="*", help="Stagioni da valutare (default: tutte quelle in v_full_match_stats)")
+    parser.add_argument("--full", action="store_true", help="Ricostruzione completa dello stato (es. dopo una modifica al modello)")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N", help="Bande p10/p50/p90 da N ricampionamenti")
+    parser.add_argument("--workers", type=int, default=None, help="Processi paralleli (default: min(stagioni, CPU))")
+    args = parser.parse_args()
+
+    engine = CalibratedValuation().engine
+    seasons = args.seasons or available_seasons(engine)
+    if not seasons:
+        print("❌ Nessuna stagione trovata")
+        raise SystemExit(1)
+
+    print(f"🚀 Valutazione di {len(seasons)} stagioni: {', '.join(seasons)}\n")
+    start = time.perf_counter()
+    reports = run_seasons(seasons, full=args.full, bootstrap=args.bootstrap, workers=args.workers, engine=engine)
+
+    print("\n" + "=" * 50)
+    print("⏱️  TEMPI PER STAGIONE")
+    print("=" * 50)
+    for report in reports:
+        if "error" in report:
+            print(f"{report['season']:>8}  ERRORE: {report['error']}")
+        else:
+            t = report["timings"]
+            print(f"{report['season']:>8}  {report['players']:>5} giocatori  {t['total']:7.1f}s")
+    print(f"\nTotale (wall clock): {time.perf_counter() - start:.1f}s")
+    if any("error" in r for r in reports):
+        raise SystemExit(1)
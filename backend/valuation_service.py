@@ -0,0 +1,212 @@
+"""
+Valuation Service - Fair Value On-Demand
+========================================
+Tiene in memoria, per stagione, la tabella per giocatore del modello V3 e la
+normalizzazione di lega già fittata (winsorization + RobustScaler + MinMaxScaler):
+
+- "quanto vale X" e "top N per valore" senza rieseguire il batch;
+- what-if ("e se segnasse 5 gol in più?"): la riga del giocatore viene modificata
+  e ri-valutata sulla scala di lega in cache, senza rileggere la stagione né
+  rifittare gli scaler (il resto della lega resta invariato).
+
+La tabella per giocatore arriva dallo stato incrementale (valuation_player_state);
+se il batch non è mai stato eseguito si aggrega la stagione dalle righe match-level.
+"""
+
+import dataclasses
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import valuation_state
+from player_search_index import normalize
+from valuation_engine_v3 import CalibratedValuation, LeagueNormalization, VALUATION_BANDS, VALUATION_COMPONENTS
+
+SNAPSHOT_TTL_SECONDS = 300
+
+# Parametri what-if -> colonna della tabella per giocatore
+WHAT_IF_COLUMNS = {
+    "goals": "goals",
+    "assists": "assists",
+    "npxg": "npxg",
+    "shots": "shots",
+    "shots_on_target": "sot",
+    "minutes": "minutes",
+}
+
+
+class WhatIfError(ValueError):
+    """Scenario what-if non valido (parametri sconosciuti, minuti <= 0): errore dell'input."""
+
+
+@dataclass(frozen=True)
+class ValuationSnapshot:
+    """Stato immutabile di una stagione: le richieste lo leggono senza lock."""
+    season: str
+    built_at: float
+    players: pd.DataFrame           # Tabella per giocatore (pre-normalizzazione)
+    scored: pd.DataFrame            # Output del modello, ordinato per fair value
+    normalization: LeagueNormalization
+    roles: dict
+    name_index: dict                # nome normalizzato -> indice di riga
+
+
+class ValuationService:
+    def __init__(self, engine):
+        self.engine = engine
+        self._snapshots: dict[str, ValuationSnapshot] = {}
+        self._build_lock = threading.Lock()
+
+    def _model(self, season: str) -> CalibratedValuation:
+        return CalibratedValuation(season=str(season), engine=self.engine)
+
+    def _load_players(self, model: CalibratedValuation) -> pd.DataFrame:
+        state = model.load_state()
+        if not state.empty:
+            return valuation_state.state_to_aggregates(state)
+        data = model.get_clean_data()
+        if data.empty:
+            raise ValueError("Nessun dato trovato per la stagione selezionata.")
+        return model.aggregate_players(data)
+
+    def _load_bands(self, season: str) -> pd.DataFrame:
+        """Bande bootstrap p10/p50/p90 dall'ultimo batch (valuation_bootstrap.py)."""
+        query = text(f"""
+            SELECT player_id, {', '.join(VALUATION_BANDS)}
+            FROM player_season_valuations
+            WHERE season = :season
+        """)
+        try:
+            return pd.read_sql(query, self.engine, params={"season": str(season)})
+        except Exception:
+            return pd.DataFrame(columns=["player_id"] + VALUATION_BANDS)
+
+    def _build_snapshot(self, season: str) -> ValuationSnapshot:
+        model = self._model(season)
+        players = self._load_players(model)
+        roles = model.load_roles()
+
+        features = model.prepare_features(players, roles)
+        normalization = model.fit_normalization(features)
+        scored = model.apply_model(features, normalization)
+        bands = self._load_bands(season).set_index("player_id")
+        scored = scored.join(bands[VALUATION_BANDS].astype(float), on="player_id")
+
+        normalized = players["player_name"].map(normalize)
+        return ValuationSnapshot(
+            season=str(season),
+            built_at=time.monotonic(),
+            players=players,
+            scored=scored,
+            normalization=normalization,
+            roles=roles,
+            name_index={name: idx for idx, name in reversed(list(normalized.items()))},
+        )
+
+    def get_snapshot(self, season: str = "2025") -> ValuationSnapshot:
+        key = str(season)
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and time.monotonic() - snapshot.built_at < SNAPSHOT_TTL_SECONDS:
+            return snapshot
+
+        with self._build_lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or time.monotonic() - snapshot.built_at >= SNAPSHOT_TTL_SECONDS:
+                snapshot = self._build_snapshot(key)
+                self._snapshots[key] = snapshot
+            return snapshot
+
+    def invalidate(self, season: str | None = None):
+        """Scarta gli snapshot (tutti o di una stagione) dopo un nuovo run di valutazione."""
+        with self._build_lock:
+            for key in list(self._snapshots):
+                if season is None or key == str(season):
+                    del self._snapshots[key]
+
+    # ------------------------------------------------------------------
+    # Query
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _describe(row: pd.Series) -> dict:
+        bands = [row.get(col) for col in VALUATION_BANDS]
+        return {
+            "player": row["player_name"],
+            "team": row["team_id"],
+            "role": row["role"],
+            "minutes": int(row["minutes"]),
+            "matches_played": int(row["matches_played"]),
+            "fair_value": float(row["fair_value"]),
+            "fair_value_range": (
+                dict(zip(("p10", "p50", "p90"), map(float, bands)))
+                if all(b is not None and not pd.isna(b) for b in bands) else None
+            ),
+            "components": {
+                col: round(float(row[col]), 4) for col in VALUATION_COMPONENTS if col != "fair_value"
+            },
+        }
+
+    @staticmethod
+    def _find_player(snapshot: ValuationSnapshot, player_name: str) -> int:
+        target = normalize(player_name)
+        idx = snapshot.name_index.get(target)
+        if idx is None:
+            partial = [i for name, i in snapshot.name_index.items() if target in name]
+            if not partial:
+                raise ValueError("Giocatore non trovato (minuti insufficienti?).")
+            idx = min(partial)
+        return idx
+
+    def top(self, season: str = "2025", top_n: int = 20, role: str | None = None, team: str | None = None):
+        snapshot = self.get_snapshot(season)
+        ranked = snapshot.scored
+        if role:
+            ranked = ranked[ranked["role"] == role]
+        if team:
+            ranked = ranked[ranked["team_id"] == team]
+        return {
+            "season": snapshot.season,
+            "players_valued": len(snapshot.scored),
+            "top": [self._describe(row) for _, row in ranked.head(int(top_n)).iterrows()],
+        }
+
+    def value(self, player_name: str, season: str = "2025", what_if: dict | None = None):
+        snapshot = self.get_snapshot(season)
+        idx = self._find_player(snapshot, player_name)
+        current = snapshot.scored.loc[idx]
+        rank = int(snapshot.scored.index.get_loc(idx)) + 1
+
+        result = {
+            "season": snapshot.season,
+            "rank": rank,
+            "players_valued": len(snapshot.scored),
+            **self._describe(current),
+        }
+
+        deltas = {k: float(v) for k, v in (what_if or {}).items() if v}
+        if deltas:
+            unknown = set(deltas) - set(WHAT_IF_COLUMNS)
+            if unknown:
+                raise WhatIfError(f"Parametri what-if sconosciuti: {sorted(unknown)}. Disponibili: {list(WHAT_IF_COLUMNS)}")
+            row = snapshot.players.loc[[idx]].copy()
+            for key, delta in deltas.items():
+                column = WHAT_IF_COLUMNS[key]
+                row[column] = np.maximum(row[column].astype(float) + delta, 0.0)
+            if not (row["minutes"] > 0).all():
+                raise WhatIfError("Lo scenario what-if deve avere minuti giocati > 0.")
+
+            # Stessa scala di lega del valore corrente: nessun refit degli scaler.
+            # Consistenza, trend e goal quality restano quelli osservati.
+            model = self._model(season)
+            features = model.prepare_features(row, snapshot.roles)
+            rescored = model.apply_model(features, dataclasses.replace(snapshot.normalization, clip=True))
+            scenario = self._describe(rescored.iloc[0])
+            scenario["inputs"] = deltas
+            scenario["delta_value"] = scenario["fair_value"] - result["fair_value"]
+            scenario["rank"] = int((snapshot.scored["fair_value"].drop(index=idx) > scenario["fair_value"]).sum()) + 1
+            result["what_if"] = scenario
+
+        return result
@@ -0,0 +1,332 @@
+"""
+Valuation State - Statistiche Sufficienti per Giocatore
+=======================================================
+Stato incrementale della FASE 1 di CalibratedValuation: per ogni player-season
+teniamo solo quello che serve per ricostruire le metriche aggregate senza
+rileggere le righe match-level:
+
+- somme (minuti, gol, assist, npxg, xg, tiri, tiri in porta, presenze)
+- accumulatori di Welford (n, media, M2) del performance score per match -> consistency
+- finestra degli ultimi RECENT_WINDOW match + somme dei match più vecchi -> trend
+- gol pesati per ELO avversario e somma ELO -> goal_quality, avg_opponent_elo
+- conteggio presenze per squadra -> team_id (moda)
+
+fold_matches() integra un blocco di nuove righe nello stato (tutto vettoriale,
+niente loop sui giocatori); state_to_aggregates() produce lo stesso DataFrame
+di CalibratedValuation.aggregate_players.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+RECENT_WINDOW = 5
+
+SUM_COLUMNS = [
+    'minutes', 'goals', 'assists', 'npxg', 'xg', 'shots', 'sot',
+    'matches_played', 'weighted_goals', 'elo_sum',
+]
+OLDER_COLUMNS = ['older_npxg', 'older_goals', 'older_minutes']
+STATE_COLUMNS = (
+    ['player_name', 'player_id', 'birth_date']
+    + SUM_COLUMNS
+    + ['score_n', 'score_mean', 'score_m2', 'score_has_inf']
+    + OLDER_COLUMNS
+    + ['team_counts', 'recent']
+)
+
+STATE_SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS valuation_player_state (
+        player_id INTEGER NOT NULL,
+        season TEXT NOT NULL,
+        player_name TEXT NOT NULL,
+        birth_date DATE,
+        minutes DOUBLE PRECISION NOT NULL,
+        goals DOUBLE PRECISION NOT NULL,
+        assists DOUBLE PRECISION NOT NULL,
+        npxg DOUBLE PRECISION NOT NULL,
+        xg DOUBLE PRECISION NOT NULL,
+        shots DOUBLE PRECISION NOT NULL,
+        sot DOUBLE PRECISION NOT NULL,
+        matches_played INTEGER NOT NULL,
+        weighted_goals DOUBLE PRECISION NOT NULL,
+        elo_sum DOUBLE PRECISION NOT NULL,
+        score_n INTEGER NOT NULL,
+        score_mean DOUBLE PRECISION NOT NULL,
+        score_m2 DOUBLE PRECISION NOT NULL,
+        score_has_inf BOOLEAN NOT NULL,
+        older_npxg DOUBLE PRECISION NOT NULL,
+        older_goals DOUBLE PRECISION NOT NULL,
+        older_minutes DOUBLE PRECISION NOT NULL,
+        team_counts JSONB NOT NULL,
+        recent JSONB NOT NULL,
+        PRIMARY KEY (player_id, season)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS valuation_watermarks (
+        season TEXT PRIMARY KEY,
+        last_match_date DATE NOT NULL,
+        rows_folded INTEGER NOT NULL,
+        checksum TEXT,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    # Watermark creati con l'impronta COUNT/SUM: checksum NULL -> una ricostruzione completa
+    "ALTER TABLE valuation_watermarks ADD COLUMN IF NOT EXISTS checksum TEXT",
+    "ALTER TABLE valuation_watermarks DROP COLUMN IF EXISTS minutes_folded",
+    "ALTER TABLE valuation_watermarks DROP COLUMN IF EXISTS goals_folded",
+]
+
+
+def empty_state() -> pd.DataFrame:
+    state = pd.DataFrame(columns=STATE_COLUMNS)
+    state.index = pd.Index([], dtype=object)
+    return state
+
+
+def _match_frame(rows: pd.DataFrame) -> pd.DataFrame:
+    """Colonne per-match necessarie allo stato, con le stesse convenzioni del modello."""
+    rows = rows[rows['player_name'].notna()]
+    elo = rows['opponent_elo'].fillna(1500)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (rows['npxg'] * 2 + rows['goals'] * 1.5 + rows['assists'] * 1.2) / (rows['minutes'] / 90)
+    return pd.DataFrame({
+        'player_name': rows['player_name'],
+        'player_id': rows['player_id'],
+        'team_id': rows['team_id'],
+        'birth_date': rows['birth_date'],
+        'match_date': pd.to_datetime(rows['match_date']),
+        'minutes': rows['minutes'],
+        'goals': rows['goals'],
+        'assists': rows['assists'],
+        'npxg': rows['npxg'],
+        'xg': rows['xg'],
+        'shots': rows['shots'],
+        'sot': rows['shots_on_target'],
+        'matches_played': 1,
+        'weighted_goals': rows['goals'] * (elo / 1500),
+        'elo_sum': elo,
+        'score': score,
+    })
+
+
+def _score_moments(matches: pd.DataFrame) -> pd.DataFrame:
+    """(n, media, M2, has_inf) del performance score per giocatore, NaN esclusi."""
+    key = matches['player_name']
+    has_inf = np.isinf(matches['score']).groupby(key).any()
+    finite = matches['score'].replace([np.inf, -np.inf], np.nan)
+    grouped = finite.groupby(key)
+    n = grouped.count()
+    mean = grouped.mean()
+    m2 = ((finite - mean.reindex(key).to_numpy()) ** 2).groupby(key).sum()
+    return pd.DataFrame({
+        'score_n': n,
+        'score_mean': mean.fillna(0.0),
+        'score_m2': m2,
+        'score_has_inf': has_inf,
+    })
+
+
+def _merge_moments(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Combinazione parallela di Welford (Chan et al.) di due blocchi di momenti."""
+    n_a, n_b = old['score_n'].astype(float), new['score_n'].astype(float)
+    n = n_a + n_b
+    delta = new['score_mean'] - old['score_mean']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, old['score_mean'] + delta * n_b / n, 0.0)
+        m2 = np.where(n > 0, old['score_m2'] + new['score_m2'] + delta ** 2 * n_a * n_b / n, 0.0)
+    return pd.DataFrame({
+        'score_n': n.astype(int),
+        'score_mean': mean,
+        'score_m2': m2,
+        'score_has_inf': old['score_has_inf'].astype(bool) | new['score_has_inf'].astype(bool),
+    }, index=old.index)
+
+
+def _explode_recent(state: pd.DataFrame) -> pd.DataFrame:
+    records = [
+        (name, *entry)
+        for name, window in zip(state['player_name'], state['recent'])
+        for entry in window
+    ]
+    frame = pd.DataFrame(records, columns=['player_name', 'match_date', 'npxg', 'goals', 'minutes'])
+    frame['match_date'] = pd.to_datetime(frame['match_date'])
+    return frame.astype({'npxg': float, 'goals': float, 'minutes': float})
+
+
+def _explode_teams(state: pd.DataFrame) -> pd.DataFrame:
+    records = [
+        (name, team, n)
+        for name, counts in zip(state['player_name'], state['team_counts'])
+        for team, n in counts.items()
+    ]
+    return pd.DataFrame(records, columns=['player_name', 'team_id', 'n'])
+
+
+def _json_column(values: pd.Series) -> list:
+    """Valori serializzabili in JSON: NaN/NaT -> None, numeri -> float."""
+    if pd.api.types.is_numeric_dtype(values):
+        return [None if np.isnan(v) else v for v in values.astype(float).tolist()]
+    return [v if isinstance(v, str) else None for v in values.tolist()]
+
+
+def fold_matches(state: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """Integra nuove righe match-level nello stato. Restituisce SOLO i giocatori toccati."""
+    matches = _match_frame(rows)
+    if matches.empty:
+        return empty_state()
+    key = matches['player_name']
+    touched = key.unique()
+    old = state.reindex(touched)
+    is_new = old['player_name'].isna()
+
+    # Somme: lo stato mancante vale zero
+    deltas = matches[SUM_COLUMNS].groupby(key).sum().reindex(touched)
+    sums = old[SUM_COLUMNS].astype(float).fillna(0.0) + deltas.astype(float)
+
+    # Welford
+    old_moments = old[['score_n', 'score_mean', 'score_m2', 'score_has_inf']].copy()
+    old_moments.loc[is_new, ['score_n', 'score_mean', 'score_m2']] = 0
+    old_moments.loc[is_new, 'score_has_inf'] = False
+    moments = _merge_moments(old_moments.astype({'score_n': float, 'score_mean': float, 'score_m2': float}),
+                             _score_moments(matches).reindex(touched))
+
+    # Finestra recente: vecchia finestra + nuove righe, chi esce va nelle somme "older"
+    window = pd.concat([
+        _explode_recent(old[~is_new]),
+        matches[['player_name', 'match_date', 'npxg', 'goals', 'minutes']],
+    ], ignore_index=True)
+    window = window.sort_values(['player_name', 'match_date'], kind='mergesort', na_position='last')
+    is_recent = window.groupby('player_name').cumcount(ascending=False) < RECENT_WINDOW
+    spilled = window.loc[~is_recent, ['npxg', 'goals', 'minutes']].groupby(window.loc[~is_recent, 'player_name']).sum()
+    spilled = spilled.reindex(touched, fill_value=0.0)
+    older = old[OLDER_COLUMNS].astype(float).fillna(0.0)
+    older['older_npxg'] += spilled['npxg']
+    older['older_goals'] += spilled['goals']
+    older['older_minutes'] += spilled['minutes']
+
+    recent_rows = window[is_recent]
+    recent = {}
+    for name, *entry in zip(
+        recent_rows['player_name'],
+        _json_column(recent_rows['match_date'].dt.strftime('%Y-%m-%d')),
+        _json_column(recent_rows['npxg']),
+        _json_column(recent_rows['goals']),
+        _json_column(recent_rows['minutes']),
+    ):
+        recent.setdefault(name, []).append(entry)
+
+    # Presenze per squadra
+    teams = pd.concat([
+        _explode_teams(old[~is_new]),
+        matches.groupby([key, matches['team_id']]).size().rename('n').reset_index(),
+    ], ignore_index=True)
+    team_counts = {}
+    for (name, team), n in teams.groupby(['player_name', 'team_id'])['n'].sum().items():
+        team_counts.setdefault(name, {})[str(team)] = int(n)
+
+    # Anagrafica: la prima data di nascita non nulla vince
+    first_seen = matches.groupby(key)[['player_id', 'birth_date']].first().reindex(touched)
+    birth_date = old['birth_date'].where(old['birth_date'].notna(), first_seen['birth_date'])
+    player_id = old['player_id'].where(~is_new, first_seen['player_id'])
+
+    folded = pd.concat([sums, moments, older], axis=1).rename_axis(None)
+    folded.insert(0, 'player_name', touched)
+    folded.insert(1, 'player_id', player_id.to_numpy())
+    folded.insert(2, 'birth_date', birth_date.to_numpy())
+    folded['team_counts'] = [team_counts.get(name, {}) for name in touched]
+    folded['recent'] = [recent.get(name, []) for name in touched]
+    folded['matches_played'] = folded['matches_played'].astype(int)
+    return folded[STATE_COLUMNS]
+
+
+def apply_fold(state: pd.DataFrame, folded: pd.DataFrame) -> pd.DataFrame:
+    """Sostituisce nello stato le righe dei giocatori ricalcolati."""
+    if folded.empty:
+        return state
+    if state.empty:
+        return folded.sort_index()
+    rest = state[~state.index.isin(folded.index)]
+    return pd.concat([rest, folded]).sort_index()
+
+
+def state_to_aggregates(state: pd.DataFrame) -> pd.DataFrame:
+    """Stato -> stesso DataFrame di CalibratedValuation.aggregate_players."""
+    state = state.sort_index()
+    numeric = SUM_COLUMNS + ['score_n', 'score_mean', 'score_m2'] + OLDER_COLUMNS
+    state = state.astype({col: float for col in numeric} | {'score_has_inf': bool})
+    n = state['matches_played'].astype(int)
+
+    # Consistenza (std campionaria dai momenti di Welford)
+    score_n = state['score_n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.where(score_n >= 2, np.sqrt(state['score_m2'] / (score_n - 1)), np.nan)
+        mean = np.where(score_n >= 1, state['score_mean'], np.nan)
+        cv = std / (mean + 0.01)
+    consistency = np.where(
+        np.isnan(cv) | state['score_has_inf'], 0.3, np.maximum(0.3, 1 - np.minimum(cv / 2, 0.7))
+    )
+    consistency = np.where(n < 3, 0.5, consistency)
+
+    # Trend dalla finestra recente
+    window = _explode_recent(state)
+    recent = window.groupby('player_name')[['npxg', 'goals', 'minutes']].sum().reindex(state.index, fill_value=0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recent_perf = (recent['npxg'] + recent['goals'] * 0.8) / np.maximum(recent['minutes'] / 90, 1)
+        older_perf = (state['older_npxg'] + state['older_goals'] * 0.8) / np.maximum(state['older_minutes'] / 90, 1)
+        trend = np.where(older_perf < 0.01, 1.0, np.clip(recent_perf / older_perf, 0.7, 1.3))
+    trend = np.where(n < 6, 1.0, trend)
+
+    goals = state['goals']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        goal_quality = np.where(goals == 0, 1.0, state['weighted_goals'] / goals)
+
+    # Moda squadra: più presenze, a parità il primo in ordine alfabetico
+    team_id = [
+        min(counts.items(), key=lambda kv: (-kv[1], kv[0]))[0] if counts else None
+        for counts in state['team_counts']
+    ]
+
+    df = pd.DataFrame({
+        'player_name': state['player_name'].to_numpy(),
+        'player_id': state['player_id'].astype(int).to_numpy(),
+        'team_id': team_id,
+        'birth_date': state['birth_date'].to_numpy(),
+        'minutes': state['minutes'].to_numpy(),
+        'goals': goals.to_numpy(),
+        'assists': state['assists'].to_numpy(),
+        'npxg': state['npxg'].to_numpy(),
+        'xg': state['xg'].to_numpy(),
+        'shots': state['shots'].to_numpy(),
+        'sot': state['sot'].to_numpy(),
+        'matches_played': n.to_numpy(),
+        'consistency': consistency,
+        'trend': trend,
+        'goal_quality': goal_quality,
+        'avg_opponent_elo': (state['elo_sum'] / n).to_numpy(),
+    })
+    return df[~(df['minutes'] < 90)].reset_index(drop=True)
+
+
+def state_to_records(state: pd.DataFrame, season: str) -> pd.DataFrame:
+    """Stato -> righe pronte per il COPY in valuation_player_state."""
+    records = state[STATE_COLUMNS].copy()
+    records.insert(1, 'season', season)
+    records['birth_date'] = pd.to_datetime(records['birth_date']).dt.date
+    records['team_counts'] = records['team_counts'].map(json.dumps)
+    records['recent'] = records['recent'].map(json.dumps)
+    return records.astype({'player_id': 'int64', 'matches_played': 'int64', 'score_n': 'int64'})
+
+
+def records_to_state(records: pd.DataFrame) -> pd.DataFrame:
+    """Righe lette da valuation_player_state -> stato in memoria."""
+    if records.empty:
+        return empty_state()
+    state = records.drop(columns=['season'], errors='ignore').copy()
+    for col in ('team_counts', 'recent'):
+        state[col] = state[col].map(lambda v: json.loads(v) if isinstance(v, str) else v)
+    state = state[STATE_COLUMNS].set_index('player_name', drop=False).rename_axis(None)
+    return state.sort_index()
@@ -0,0 +1,162 @@
+"""
+Bulk Load - COPY FROM STDIN + merge da tabella di staging
+=========================================================
+Utility condivisa dagli script ETL per caricare righe su Postgres senza
+executemany di INSERT parametrizzati:
+
+- le righe (DataFrame, lista/iteratore di dict o tuple) sono serializzate in CSV
+  *in streaming*: COPY legge dal generatore a blocchi, quindi la memoria resta
+  limitata anche per caricamenti arbitrariamente grandi;
+- copy_rows scrive direttamente nella tabella di destinazione;
+- bulk_merge scrive in una tabella temporanea (solo le colonne caricate, senza
+  vincoli) e poi applica un unico INSERT ... SELECT / ON CONFLICT sul target,
+  aggiornando solo le righe realmente cambiate (IS DISTINCT FROM); a parità di
+  chiave vince l'ultima riga caricata.
+
+Richiede il driver psycopg2 (cursor.copy_expert), come il resto della pipeline.
+
+Esempio:
+    with engine.begin() as conn:
+        bulk_merge(conn, "player_stats_v2", rows, columns,
+                   key_columns=["player_id", "match_id"], update_columns=["minutes", "goals"])
+"""
+
+import csv
+import io
+import itertools
+from collections.abc import Iterable, Mapping
+
+import pandas as pd
+from sqlalchemy import text
+
+CHUNK_ROWS = 50_000   # Righe serializzate per blocco (limite di memoria del buffer)
+
+
+class _CsvStream(io.RawIOBase):
+    """File-like in sola lettura che genera il CSV dai blocchi di testo su richiesta."""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b"")
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Offset sul blocco codificato: niente copia del resto del blocco a ogni read
+        while self._offset >= len(self._pending):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk.encode("utf-8"))
+            self._offset = 0
+        n = min(len(buffer), len(self._pending) - self._offset)
+        buffer[:n] = self._pending[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+
+def _csv_chunks(rows, columns: list[str], chunk_rows: int, counter: list):
+    """Blocchi di testo CSV (NULL = campo vuoto non quotato) da DataFrame o iterabile."""
+    if isinstance(rows, pd.DataFrame):
+        frame = rows[columns]
+        for start in range(0, len(frame), chunk_rows):
+            part = frame.iloc[start:start + chunk_rows]
+            counter[0] += len(part)
+            yield part.to_csv(index=False, header=False)
+        return
+
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, chunk_rows))
+        if not batch:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for row in batch:
+            values = [row.get(c) for c in columns] if isinstance(row, Mapping) else row
+            writer.writerow(["" if v is None else v for v in values])
+        counter[0] += len(batch)
+        yield buffer.getvalue()
+
+
+def _resolve_columns(rows, columns):
+    """Colonne esplicite, dal DataFrame o dal primo dict (iteratore ricostruito)."""
+    if columns is not None:
+        return list(columns), rows
+    if isinstance(rows, pd.DataFrame):
+        return list(rows.columns), rows
+    iterator = iter(rows)
+    first = next(iterator, None)
+    if first is None:
+        return [], []
+    if not isinstance(first, Mapping):
+        raise ValueError("columns è obbligatorio per righe non-dict")
+    return list(first.keys()), itertools.chain([first], iterator)
+
+
+def copy_rows(conn, table: str, rows, columns: list[str] | None = None, chunk_rows: int = CHUNK_ROWS) -> int:
+    """COPY delle righe in `table` nella transazione di `conn`. Restituisce le righe copiate."""
+    columns, rows = _resolve_columns(rows, columns)
+    if not columns:
+        return 0
+    counter = [0]
+    stream = io.BufferedReader(_CsvStream(_csv_chunks(rows, columns, chunk_rows, counter)))
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream)
+    finally:
+        cursor.close()
+    return counter[0]
+
+
+def bulk_merge(
+    conn,
+    target: str,
+    rows,
+    columns: list[str] | None = None,
+    key_columns: list[str] | None = None,
+    update_columns: list[str] | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> int:
+    """COPY in staging + merge nel target. Restituisce le righe inserite/aggiornate.
+
+    - key_columns=None: semplice INSERT ... SELECT (append);
+    - key_columns senza update_columns: le righe già presenti vengono ignorate;
+    - con update_columns: aggiornate solo se almeno una colonna è cambiata.
+    Le colonne non in update_columns (es. valori calcolati a valle) restano intatte.
+    Con chiavi duplicate in `rows` vince l'ultima riga (ordine di caricamento).
+    """
+    columns, rows = _resolve_columns(rows, columns)
+    if not columns:
+        return 0
+    staging = f"staging_{target.split('.')[-1]}"
+    col_list = ", ".join(columns)
+
+    # pg_temp: mai toccare un'eventuale tabella permanente con lo stesso nome
+    conn.execute(text(f"DROP TABLE IF EXISTS pg_temp.{staging}"))
+    conn.execute(text(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {col_list} FROM {target} WITH NO DATA"))
+    # Numero progressivo assegnato da COPY nell'ordine di lettura delle righe
+    conn.execute(text(f"ALTER TABLE pg_temp.{staging} ADD COLUMN _row_seq BIGINT GENERATED ALWAYS AS IDENTITY"))
+    loaded = copy_rows(conn, staging, rows, columns, chunk_rows)
+    if loaded == 0:
+        return 0
+
+    if not key_columns:
+        sql = f"INSERT INTO {target} ({col_list}) SELECT {col_list} FROM pg_temp.{staging} ORDER BY _row_seq"
+    else:
+        keys = ", ".join(key_columns)
+        # Una sola riga per chiave (ON CONFLICT non può toccare due volte la stessa riga): l'ultima caricata
+        source = f"SELECT DISTINCT ON ({keys}) {col_list} FROM pg_temp.{staging} ORDER BY {keys}, _row_seq DESC"
+        if update_columns:
+            sql = f"""
+                INSERT INTO {target} ({col_list}) {source}
+                ON CONFLICT ({keys}) DO UPDATE SET
+                    {', '.join(f'{c} = EXCLUDED.{c}' for c in update_columns)}
+                WHERE ({', '.join(f'{target}.{c}' for c in update_columns)})
+                    IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in update_columns)})
+            """
+        else:
+            sql = f"INSERT INTO {target} ({col_list}) {source} ON CONFLICT ({keys}) DO NOTHING"
+    return conn.execute(text(sql)).rowcount
@@ -1,4 +1,3 @@
-import soccerdata as sd
 import pandas as pd
 import os
 import urllib.parse
@@ -6,13 +5,10 @@ from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 import sys
 
-# Aggiungiamo il path per importare moduli dal backend se necessario
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+from bulk_load import bulk_merge
+from raw_cache import set_offline, understat_frame
 
-try:
-    from fetch_ages import update_ages # Importiamo la funzione specifica se l'hai creata, o usiamo subprocess
-except ImportError:
-    pass # Gestiremo con subprocess se l'import fallisce
+FETCH_AGES_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'fetch_ages.py')
 
 load_dotenv()
 
@@ -27,69 +23,164 @@ db_pass = urllib.parse.quote_plus(db_password)
 db_url = f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
 engine = create_engine(db_url)
 
-def get_or_create_player(conn, player_name, team_id, new_players_list):
-    """Restituisce l'ID del giocatore. Se non esiste, lo crea."""
-    # 1. Cerca ID
-    res = conn.execute(text("SELECT player_id FROM players WHERE name = :name"), {"name": player_name}).fetchone()
-    if res:
-        return res[0]
-    
-    # 2. Crea se non esiste
-    print(f"   👤 Nuovo giocatore trovato: {player_name}")
-    res = conn.execute(
-        text("INSERT INTO players (name, current_team_id) VALUES (:name, :tid) RETURNING player_id"),
-        {"name": player_name, "tid": team_id}
-    ).fetchone()
-    
-    new_players_list.add(player_name) # Aggiungiamo alla lista per fetch_ages
-    return res[0]
+RESOLVE_BATCH_SIZE = 1000  # Chiavi per singolo INSERT ... SELECT unnest(...)
+LOOKBACK_DAYS = 7          # Giorni prima del watermark ricontrollati (correzioni tardive Understat)
+
+STAT_COLUMNS = ['team_id', 'minutes', 'goals', 'assists', 'shots', 'shots_on_target', 'npxg', 'xa']
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        season TEXT PRIMARY KEY,
+        last_match_date DATE NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+]
+STATS_KEY_INDEX = "ux_player_stats_v2_player_match"
+
+
+def ensure_schema(conn):
+    """Tabella watermark + chiave univoca (player_id, match_id) per gli upsert."""
+    for ddl in SCHEMA_SQL:
+        conn.execute(text(ddl))
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": STATS_KEY_INDEX}).scalar() is None:
+        # Duplicati lasciati dai vecchi delete/insert: si tiene l'ultima riga scritta
+        removed = conn.execute(text("""
+            DELETE FROM player_stats_v2 a USING player_stats_v2 b
+            WHERE a.player_id = b.player_id AND a.match_id = b.match_id AND a.ctid < b.ctid
+        """)).rowcount
+        if removed:
+            print(f"   🧹 Rimossi {removed} duplicati (player_id, match_id) da player_stats_v2")
+        conn.execute(text(f"CREATE UNIQUE INDEX {STATS_KEY_INDEX} ON player_stats_v2 (player_id, match_id)"))
 
-def get_or_create_match(conn, date, season, home_team, away_team):
-    """Restituisce l'ID della partita. Se non esiste, la crea."""
-    # Chiave univoca: Data + Squadre
-    res = conn.execute(
+
+def load_watermark(conn, season):
+    return conn.execute(
+        text("SELECT last_match_date FROM etl_watermarks WHERE season = :s"), {"s": season}
+    ).scalar()
+
+
+def save_watermark(conn, season, last_match_date):
+    conn.execute(
         text("""
-            SELECT match_id FROM matches 
-            WHERE date = :date AND home_team_id = :h AND away_team_id = :a
+            INSERT INTO etl_watermarks (season, last_match_date) VALUES (:s, :d)
+            ON CONFLICT (season) DO UPDATE SET
+                last_match_date = GREATEST(etl_watermarks.last_match_date, EXCLUDED.last_match_date),
+                updated_at = now()
         """),
-        {"date": date, "h": home_team, "a": away_team}
-    ).fetchone()
-    
-    if res:
-        return res[0]
-    
-    # Crea nuova partita
-    res = conn.execute(
+        {"s": season, "d": last_match_date}
+    )
+
+
+def upsert_stats(conn, stats_buffer):
+    """Inserisce le righe nuove e aggiorna solo quelle cambiate; fair_value non viene toccato."""
+    return bulk_merge(
+        conn, "player_stats_v2", stats_buffer,
+        columns=['player_id', 'match_id'] + STAT_COLUMNS + ['fair_value'],
+        key_columns=['player_id', 'match_id'],
+        update_columns=STAT_COLUMNS,
+    )
+
+
+def _chunks(items, size=RESOLVE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _match_key(date, home_team, away_team):
+    # Giorno + squadre: stessa chiave sia da DATE sia da TIMESTAMP (Understat include l'ora)
+    return (pd.Timestamp(date).normalize(), home_team, away_team)
+
+
+def load_player_map(conn):
+    """{nome: player_id} di tutti i giocatori, in una query."""
+    rows = conn.execute(text("SELECT name, player_id FROM players")).fetchall()
+    return {name: player_id for name, player_id in rows}
+
+
+def load_match_map(conn, first_date, last_date):
+    """{(giorno, casa, trasferta): match_id} delle partite nell'intervallo di date."""
+    rows = conn.execute(
         text("""
-            INSERT INTO matches (season, date, home_team_id, away_team_id)
-            VALUES (:s, :d, :h, :a)
-            RETURNING match_id
+            SELECT date, home_team_id, away_team_id, match_id FROM matches
+            WHERE date >= :d0 AND date < :d1
         """),
-        {"s": season, "d": date, "h": home_team, "a": away_team}
-    ).fetchone()
-    return res[0]
+        {
+            "d0": pd.Timestamp(first_date).normalize().to_pydatetime(),
+            "d1": (pd.Timestamp(last_date).normalize() + pd.Timedelta(days=1)).to_pydatetime(),
+        }
+    ).fetchall()
+    return {_match_key(d, h, a): match_id for d, h, a, match_id in rows}
 
-def etl_season_v2(season_id: str):
+
+def create_missing_players(conn, players, player_map, new_players_list):
+    """Inserisce a blocchi i giocatori non ancora in player_map ({nome: team_id})."""
+    missing = [(name, team) for name, team in players.items() if name not in player_map]
+    for batch in _chunks(missing):
+        rows = conn.execute(
+            text("""
+                INSERT INTO players (name, current_team_id)
+                SELECT * FROM unnest(CAST(:names AS TEXT[]), CAST(:teams AS TEXT[]))
+                ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+                RETURNING name, player_id, (xmax = 0) AS inserted
+            """),
+            {"names": [n for n, _ in batch], "teams": [t for _, t in batch]}
+        ).fetchall()
+        for name, player_id, inserted in rows:
+            player_map[name] = player_id
+            if inserted:
+                print(f"   👤 Nuovo giocatore trovato: {name}")
+                new_players_list.add(name)  # Aggiungiamo alla lista per fetch_ages
+
+
+def create_missing_matches(conn, match_dates, season, match_map):
+    """Inserisce a blocchi le partite non ancora in match_map ({chiave: data del match})."""
+    missing = [key for key in match_dates if key not in match_map]
+    for batch in _chunks(missing):
+        rows = conn.execute(
+            text("""
+                INSERT INTO matches (season, date, home_team_id, away_team_id)
+                SELECT :s, * FROM unnest(CAST(:dates AS TIMESTAMP[]), CAST(:homes AS TEXT[]), CAST(:aways AS TEXT[]))
+                ON CONFLICT (date, home_team_id, away_team_id) DO UPDATE SET season = matches.season
+                RETURNING date, home_team_id, away_team_id, match_id
+            """),
+            {
+                "s": season,
+                "dates": [pd.Timestamp(match_dates[key]).to_pydatetime() for key in batch],
+                "homes": [h for _, h, _ in batch],
+                "aways": [a for _, _, a in batch],
+            }
+        ).fetchall()
+        for d, h, a, match_id in rows:
+            match_map[_match_key(d, h, a)] = match_id
+    if missing:
+        print(f"   🏟️ Nuove partite create: {len(missing)}")
+
+
+def etl_season_v2(season_id: str, full: bool = False, fetch_ages: bool = False):
+    """Ingest incrementale: solo le partite dal watermark (meno LOOKBACK_DAYS) in poi.
+
+    Con full=True si riconcilia tutta la stagione (sempre via upsert).
+    """
     print(f"\n🚀 Avvio ETL V2 per stagione {season_id}...")
     
     # 1. Scarica Dati Understat
-    scraper = sd.Understat(leagues=['ITA-Serie A'], seasons=season_id)
-    stats = scraper.read_player_match_stats().reset_index()
+    stats = understat_frame('read_player_match_stats', season_id).reset_index()
     print(f"✅ Dati scaricati: {len(stats)} righe.")
 
     new_players_found = set()
     stats_buffer = []
 
     with engine.begin() as conn:
-        # Pulizia preventiva dei dati V2 per questa stagione (per evitare duplicati in fase di dev)
-        # Nota: In produzione potresti voler fare "Upsert" invece di Delete/Insert
-        # Per ora manteniamo la logica semplice: puliamo le stats, non matches/players
-        print("   🧹 Pulizia statistiche vecchie per la stagione corrente...")
-        conn.execute(
-            text("DELETE FROM player_stats_v2 WHERE match_id IN (SELECT match_id FROM matches WHERE season = :s)"),
-            {"s": season_id}
-        )
+        ensure_schema(conn)
+        watermark = None if full else load_watermark(conn, season_id)
+        since = pd.Timestamp(watermark) - pd.Timedelta(days=LOOKBACK_DAYS) if watermark else None
+        if since is not None:
+            print(f"   ⏩ Watermark {watermark}: elaboro le partite dal {since.date()}")
 
+        # 1. Parsing in memoria (nessun accesso al DB per riga)
+        parsed = []
         for index, row in stats.iterrows():
             try:
                 minutes = int(row.get('minutes', 0) or 0)
@@ -100,6 +191,8 @@ def etl_season_v2(season_id: str):
                 team_name = row['team'].replace(' ', '_') # Normalizzazione base
                 game_str = row['game'] # Es: "2024-08-19 Juventus - Como 3:0"
                 date_val = pd.to_datetime(row['date'])
+                if since is not None and date_val.normalize() < since:
+                    continue
 
                 # Parsing Partita (Home vs Away) da "Juventus - Como"
                 # Understat format: "Date Home - Away Score"
@@ -114,16 +207,10 @@ def etl_season_v2(season_id: str):
                     home_team = team_name
                     away_team = "Unknown"
 
-                # 1. Gestione Player
-                p_id = get_or_create_player(conn, player_name, team_name, new_players_found)
-
-                # 2. Gestione Match
-                m_id = get_or_create_match(conn, date_val, season_id, home_team, away_team)
-
-                # 3. Preparazione Statistiche
-                stats_buffer.append({
-                    "player_id": p_id,
-                    "match_id": m_id,
+                parsed.append({
+                    "player_name": player_name,
+                    "match_key": _match_key(date_val, home_team, away_team),
+                    "match_date": date_val,
                     "team_id": team_name,
                     "minutes": minutes,
                     "goals": int(row.get('goals') or 0),
@@ -132,35 +219,69 @@ def etl_season_v2(season_id: str):
                     "shots_on_target": int(row.get('shots_on_target') or 0),
                     "npxg": float(row.get('npxg') or 0.0),
                     "xa": float(row.get('xa') or 0.0),
-                    "fair_value": 0.0 # Sarà calcolato dal Valuation Engine
                 })
 
             except Exception as e:
                 print(f"   ⚠️ Errore riga {index}: {e}")
                 continue
-        
-        # Bulk Insert Stats
+
+        last_match_date = max(r["match_date"] for r in parsed).date() if parsed else None
+
+        if parsed:
+            # 2. Mappe chiave -> id caricate una volta, entità mancanti inserite a blocchi
+            dates = [r["match_date"] for r in parsed]
+            player_map = load_player_map(conn)
+            match_map = load_match_map(conn, min(dates), max(dates))
+            print(f"   🔑 Mappe caricate: {len(player_map)} giocatori, {len(match_map)} partite")
+
+            players = {}
+            for r in parsed:
+                players.setdefault(r["player_name"], r["team_id"])  # Prima squadra vista, come prima
+            create_missing_players(conn, players, player_map, new_players_found)
+            match_dates = {}
+            for r in parsed:
+                match_dates.setdefault(r["match_key"], r.pop("match_date"))
+            create_missing_matches(conn, match_dates, season_id, match_map)
+
+            # 3. Preparazione Statistiche: solo lookup nei dizionari
+            for r in parsed:
+                stats_buffer.append({
+                    "player_id": player_map[r.pop("player_name")],
+                    "match_id": match_map[r.pop("match_key")],
+                    **r,
+                    "fair_value": 0.0 # Sarà calcolato dal Valuation Engine
+                })
+
+        # Upsert Stats (righe invariate non vengono riscritte)
         if stats_buffer:
-            print(f"   💾 Inserimento di {len(stats_buffer)} record in player_stats_v2...")
-            conn.execute(
-                text("""
-                    INSERT INTO player_stats_v2 
-                    (player_id, match_id, team_id, minutes, goals, assists, shots, shots_on_target, npxg, xa, fair_value)
-                    VALUES (:player_id, :match_id, :team_id, :minutes, :goals, :assists, :shots, :shots_on_target, :npxg, :xa, :fair_value)
-                """),
-                stats_buffer
-            )
-
-    # 4. Trigger Età (Se ci sono nuovi giocatori)
-    if new_players_found:
+            print(f"   💾 Upsert di {len(stats_buffer)} record in player_stats_v2 (COPY + merge)...")
+            written = upsert_stats(conn, stats_buffer)
+            print(f"   ✓ {written} righe nuove o modificate")
+            save_watermark(conn, season_id, last_match_date)
+        else:
+            print("   ✅ Nessuna nuova partita da importare.")
+
+    # 4. Trigger Età (opzionale: nella pipeline lo fa lo stage fetch_ages)
+    if new_players_found and fetch_ages:
         print(f"\n🎂 Trovati {len(new_players_found)} nuovi giocatori. Avvio ricerca età...")
         import subprocess
-        # Eseguiamo lo script fetch_ages.py come sottoprocesso
-        subprocess.run(["python", "backend/fetch_ages.py"])
+        subprocess.run([sys.executable, FETCH_AGES_SCRIPT])
+    elif new_players_found:
+        print(f"\n🎂 Trovati {len(new_players_found)} nuovi giocatori (età: stage fetch_ages o --fetch-ages).")
     else:
         print("\n✅ Nessun nuovo giocatore da analizzare.")
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ETL V2 Understat -> player_stats_v2")
+    parser.add_argument("--full", action="store_true", help="Ignora il watermark e riconcilia tutta la stagione")
+    parser.add_argument("--offline", action="store_true", help="Usa solo gli snapshot in cache (nessuna rete)")
+    parser.add_argument("--fetch-ages", action="store_true", help="Cerca subito le età dei nuovi giocatori (fuori dalla pipeline)")
+    args = parser.parse_args()
+    if args.offline:
+        set_offline()
+
     # Esegui per la stagione corrente e passata
-    etl_season_v2('2024')
-    etl_season_v2('2025')
\ No newline at end of file
+    etl_season_v2('2024', full=args.full, fetch_ages=args.fetch_ages)
+    etl_season_v2('2025', full=args.full, fetch_ages=args.fetch_ages)
\ No newline at end of file
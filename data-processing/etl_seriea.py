@@ -1,4 +1,3 @@
-import soccerdata as sd
 import pandas as pd
 import os
 import urllib.parse
@@ -6,6 +5,8 @@ from sqlalchemy import create_engine, insert
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from models import PlayerMatchStat, Team, League
+from raw_cache import understat_frame
+from bulk_load import copy_rows
 
 # --- 1. SETUP ---
 load_dotenv()
@@ -18,8 +19,7 @@ session = Session()
 
 # --- 2. DOWNLOAD E PREPARAZIONE ---
 print("📥 Scaricamento dati Serie A...")
-scraper = sd.Understat(leagues=['ITA-Serie A'], seasons='2024')
-stats = scraper.read_player_match_stats().reset_index()
+stats = understat_frame('read_player_match_stats', '2024').reset_index()  # Cache locale (PIPELINE_OFFLINE=1 per il replay)
 print(f"✅ Dati scaricati: {len(stats)} righe. Preparazione Bulk Insert...")
 
 # Cache dei Team per non fare query inutili
@@ -92,15 +92,11 @@ if teams_to_add:
     )
     session.commit()
 
-# B. Inseriamo le statistiche (a blocchi di 1000 per sicurezza)
+# B. Inseriamo le statistiche con COPY (streaming, memoria limitata)
 print(f"🚀 Inserimento veloce di {len(bulk_stats)} prestazioni...")
 
-# Usiamo una tecnica chiamata "Chunking"
-chunk_size = 2000
-for i in range(0, len(bulk_stats), chunk_size):
-    chunk = bulk_stats[i:i + chunk_size]
-    session.execute(insert(PlayerMatchStat), chunk)
-    session.commit()
-    print(f"   ...scritti {min(i + chunk_size, len(bulk_stats))} record.")
+with engine.begin() as conn:
+    written = copy_rows(conn, PlayerMatchStat.__tablename__, bulk_stats)
+print(f"   ...scritti {written} record.")
 
 print("🏁 FINITO! Tempo stimato: < 30 secondi.")
\ No newline at end of file
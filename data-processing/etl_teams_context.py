@@ -1,11 +1,15 @@
-import requests
 import io
+from collections import deque
 import pandas as pd
 import os
 import urllib.parse
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+from bulk_load import copy_rows
+from raw_cache import fetch_url, set_offline
+from team_context_engine import FORM_WINDOW, TeamState, new_matches, prepare_matches, process_matches, rebuild
+
 load_dotenv()
 
 # Setup Database
@@ -21,9 +25,21 @@ engine = create_engine(db_url)
 
 # Config
 SEASONS_TO_LOAD = ['2425', '2526']
-ELO_K_FACTOR = 32
-ELO_INITIAL = 1500
-HOME_ADVANTAGE = 100
+
+# Stato per squadra del motore ELO/forma (team_context_engine.TeamState)
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS team_context_state (
+        team_id TEXT PRIMARY KEY,
+        elo DOUBLE PRECISION NOT NULL,
+        last_match_date DATE NOT NULL,
+        matches_played INTEGER NOT NULL,
+        goals_for DOUBLE PRECISION[] NOT NULL,
+        goals_against DOUBLE PRECISION[] NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+]
 
 def normalize_team_name(name: str) -> str:
     # Mappatura per allineare i nomi di Football-Data con Understat/Supabase
@@ -39,7 +55,7 @@ def normalize_team_name(name: str) -> str:
     }
     return mapping.get(name.strip(), name.strip().replace(' ', '_'))
 
-def update_team_context():
+def update_team_context(full: bool = False):
     print("\n📊 AVVIO AGGIORNAMENTO CONTESTO SQUADRE (ELO & FORMA)")
     
     # 1. Download Dati
@@ -49,7 +65,7 @@ def update_team_context():
     for season in SEASONS_TO_LOAD:
         print(f"   📥 Scaricamento stagione {season}...", end=" ")
         try:
-            s = requests.get(base_url.format(season)).content
+            s = fetch_url(base_url.format(season))  # Cache locale + GET condizionale
             df_temp = pd.read_csv(io.StringIO(s.decode('latin-1')))
             df_temp['season_code'] = season
             df_list.append(df_temp)
@@ -59,64 +75,74 @@ def update_team_context():
 
     if not df_list: return
 
-    full_df = pd.concat(df_list).dropna(subset=['Date', 'HomeTeam', 'AwayTeam', 'FTR'])
-    full_df['Date'] = pd.to_datetime(full_df['Date'], dayfirst=True)
-    full_df = full_df.sort_values('Date')
-
-    # 2. Calcolo ELO
-    team_elo = {}
-    history_xg = {} # Per la rolling form (simulata coi gol se non abbiamo xG qui)
-    records = []
-
-    print(f"   🧮 Ricalcolo metriche su {len(full_df)} partite...")
-
-    for _, row in full_df.iterrows():
-        home = normalize_team_name(row['HomeTeam'])
-        away = normalize_team_name(row['AwayTeam'])
-        
-        if home not in team_elo: team_elo[home] = ELO_INITIAL
-        if away not in team_elo: team_elo[away] = ELO_INITIAL
-
-        # Calcolo ELO
-        diff = (team_elo[home] + HOME_ADVANTAGE) - team_elo[away]
-        exp_home = 1 / (1 + 10 ** (-diff / 400))
-        
-        result = 1.0 if row['FTR'] == 'H' else (0.5 if row['FTR'] == 'D' else 0.0)
-        
-        new_elo_home = team_elo[home] + ELO_K_FACTOR * (result - exp_home)
-        new_elo_away = team_elo[away] + ELO_K_FACTOR * ((1 - result) - (1 - exp_home))
-        
-        team_elo[home] = new_elo_home
-        team_elo[away] = new_elo_away
-
-        # Calcolo Forma (Usa Gol Fatti come proxy di xG se non c'è xG nel CSV)
-        # Nota: Football-Data.co.uk ha gol, non xG. Per xG reali usiamo update_team_stats.py interno.
-        # Questo script è utile come backup o per dati storici pre-Understat.
-        
-        records.append({
-            "team_id": home, "match_date": row['Date'], "season": row['season_code'],
-            "elo": round(new_elo_home, 2), "rolling_xg_form": 0.0 # Placeholder
-        })
-        records.append({
-            "team_id": away, "match_date": row['Date'], "season": row['season_code'],
-            "elo": round(new_elo_away, 2), "rolling_xg_form": 0.0
-        })
-
-    # 3. Salvataggio
-    print(f"   💾 Aggiornamento tabella team_performance ({len(records)} record)...")
+    matches = prepare_matches(pd.concat(df_list), normalize_team_name)
+
     with engine.begin() as conn:
-        # Usa INSERT ON CONFLICT o TRUNCATE per semplicità se ricalcoli tutto
-        conn.execute(text("TRUNCATE TABLE team_performance RESTART IDENTITY"))
-        
-        # Bulk Insert
-        conn.execute(
-            text("""
-                INSERT INTO team_performance (team_id, match_date, season, elo, rolling_xg_form)
-                VALUES (:team_id, :match_date, :season, :elo, :rolling_xg_form)
-            """),
-            records
-        )
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+        state = {} if full else load_state(conn)
+        todo, out_of_order = new_matches(state, matches)
+        if out_of_order:
+            print("   ♻️ Partite arrivate fuori ordine: ricostruzione completa")
+
+        if not state or out_of_order:
+            # 2a. Ricostruzione completa (vettoriale) + reload di team_performance
+            print(f"   🧮 Ricostruzione completa su {len(matches)} partite...")
+            records, state = rebuild(matches)
+            conn.execute(text("TRUNCATE TABLE team_performance RESTART IDENTITY"))
+        else:
+            # 2b. Solo le partite nuove, ripartendo dallo stato salvato
+            print(f"   🧮 Partite nuove: {len(todo)} (su {len(matches)} scaricate)")
+            records = process_matches(state, todo)
+
+        # 3. Salvataggio (COPY in append) + stato aggiornato
+        print(f"   💾 Scrittura di {len(records)} record in team_performance...")
+        copy_rows(conn, "team_performance", records)
+        save_state(conn, state)
     print("✅ Contesto Squadre Aggiornato.")
 
+
+def load_state(conn) -> dict:
+    rows = conn.execute(text("""
+        SELECT team_id, elo, last_match_date, matches_played, goals_for, goals_against
+        FROM team_context_state
+    """)).fetchall()
+    return {
+        team_id: TeamState(
+            elo=float(elo),
+            last_match_date=pd.Timestamp(last_date),
+            matches_played=int(played),
+            goals_for=deque(goals_for, maxlen=FORM_WINDOW),
+            goals_against=deque(goals_against, maxlen=FORM_WINDOW),
+        )
+        for team_id, elo, last_date, played, goals_for, goals_against in rows
+    }
+
+
+def save_state(conn, state: dict):
+    def pg_array(values):
+        return "{" + ",".join(repr(float(v)) for v in values) + "}"
+
+    conn.execute(text("DELETE FROM team_context_state"))
+    copy_rows(conn, "team_context_state", [
+        {
+            "team_id": team_id,
+            "elo": s.elo,
+            "last_match_date": s.last_match_date.date(),
+            "matches_played": s.matches_played,
+            "goals_for": pg_array(s.goals_for),
+            "goals_against": pg_array(s.goals_against),
+        }
+        for team_id, s in state.items()
+    ])
+
 if __name__ == "__main__":
-    update_team_context()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aggiornamento ELO e forma squadre")
+    parser.add_argument("--offline", action="store_true", help="Usa solo gli snapshot in cache (nessuna rete)")
+    parser.add_argument("--full", action="store_true", help="Ricostruisce tutto lo storico (modalità batch)")
+    args = parser.parse_args()
+    if args.offline:
+        set_offline()
+    update_team_context(full=args.full)
\ No newline at end of file
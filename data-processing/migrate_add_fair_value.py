@@ -4,6 +4,7 @@ Script di migrazione per aggiungere la colonna 'fair_value' e popolarla.
 Eseguire questo PRIMA di rigenerare i dati con ETL.
 """
 import os
+import time
 import urllib.parse
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
@@ -14,22 +15,20 @@ db_pass = urllib.parse.quote_plus(os.getenv("DB_PASSWORD"))
 db_url = f"postgresql://{os.getenv('DB_USER')}:{db_pass}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 engine = create_engine(db_url)
 
-def calculate_fair_value_quick(goals, assists, xg, minutes):
-    """Calcolo veloce del Fair Value in Python."""
-    base = 1.0
-    goals_val = goals * 2.0
-    xg_val = xg * 1.0
-    assists_val = assists * 1.2
-    
-    minutes_mult = 1.0
-    if minutes < 500:
-        minutes_mult = 0.5
-    elif minutes < 1000:
-        minutes_mult = 0.75
-    
-    raw = base + goals_val + xg_val + assists_val
-    adjusted = raw * minutes_mult
-    return min(adjusted, 100.0)
+# Fair Value "quick" calcolato direttamente in SQL (stessa formula e stesso ordine
+# delle operazioni float della vecchia versione Python):
+#   min((1 + gol*2 + xg + assist*1.2) * moltiplicatore minuti, 100)
+# con moltiplicatore 0.5 sotto i 500 minuti e 0.75 sotto i 1000.
+FAIR_VALUE_SQL = """
+    LEAST(
+        (1.0::float8 + COALESCE(goals, 0) * 2.0::float8 + COALESCE(xg, 0.0) * 1.0::float8
+         + COALESCE(assists, 0) * 1.2::float8)
+        * CASE WHEN COALESCE(minutes, 0) < 500 THEN 0.5::float8
+               WHEN COALESCE(minutes, 0) < 1000 THEN 0.75::float8
+               ELSE 1.0::float8 END,
+        100.0::float8
+    )
+"""
 
 print("=" * 60)
 print("MIGRAZIONE: Aggiunta colonna 'fair_value'")
@@ -58,47 +57,22 @@ with engine.connect() as conn:
         conn.commit()
         print("✓ Colonna aggiunta con successo!\n")
     
-    # Step 2: Calcola e aggiorna i valori per tutti i record
+    # Step 2: Un solo UPDATE set-based: nessuna riga passa da Python, la memoria
+    # resta costante qualunque sia la dimensione della tabella
     print("[2] Calcolo Fair Value per tutti i giocatori...")
-    
-    # Recupera tutti i record
-    fetch_query = text("""
-        SELECT id, goals, assists, xg, minutes 
-        FROM player_match_stats
+
+    update_query = text(f"""
+        UPDATE player_match_stats
+        SET fair_value = {FAIR_VALUE_SQL}
+        WHERE fair_value IS DISTINCT FROM {FAIR_VALUE_SQL}
     """)
-    
-    rows = conn.execute(fetch_query).fetchall()
-    print(f"  → Trovati {len(rows)} record da aggiornare")
-    
-    # Aggiorna in batch
-    updates = []
-    for row in rows:
-        record_id = row[0]
-        goals = row[1] or 0
-        assists = row[2] or 0
-        xg = row[3] or 0.0
-        minutes = row[4] or 0
-        
-        fair_val = calculate_fair_value_quick(goals, assists, xg, minutes)
-        updates.append({"id": record_id, "fair_value": fair_val})
-    
-    if updates:
-        update_query = text("""
-            UPDATE player_match_stats 
-            SET fair_value = :fair_value 
-            WHERE id = :id
-        """)
-        
-        # Aggiorna in chunk per performance
-        chunk_size = 1000
-        for i in range(0, len(updates), chunk_size):
-            chunk = updates[i:i+chunk_size]
-            conn.execute(update_query, chunk)
-            print(f"  → Aggiornati {min(i+chunk_size, len(updates))}/{len(updates)} record...")
-        
-        conn.commit()
-        print(f"\n✓ Tutti i {len(updates)} record sono stati aggiornati!\n")
-    
+
+    start = time.perf_counter()
+    updated = conn.execute(update_query).rowcount
+    conn.commit()
+    print(f"\n✓ Aggiornati {updated} record in {time.perf_counter() - start:.1f}s "
+          f"(quelli già corretti non vengono riscritti)\n")
+
     # Step 3: Verifica
     print("[3] Verifica dei dati...")
     verify_query = text("""
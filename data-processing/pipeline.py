@@ -0,0 +1,330 @@
+"""
+Pipeline Runner - Aggiornamento settimanale come DAG di stage
+=============================================================
+Sostituisce la sequenza fissa di step del workflow (stesso comando in locale e in CI):
+
+    python data-processing/pipeline.py [--offline] [--force] [--only stage ...] [--dry-run]
+
+- ogni stage è uno degli script esistenti, eseguito come sottoprocesso con le
+  sue dipendenze dichiarate; gli stage indipendenti (es. contesto squadre e
+  ingest Understat, età e clustering ruoli) girano in parallelo;
+- fingerprint degli input: per ogni stage un hash di comando, codice sorgente e
+  checksum di tutte le colonne che legge (TableChecksum). Se coincide con quello
+  dell'ultima esecuzione riuscita (pipeline_runs) lo stage viene saltato. Gli
+  stage che leggono sorgenti esterne (Understat, football-data) non hanno
+  fingerprint e vengono sempre eseguiti: il lavoro incrementale lo fanno loro;
+- se uno stage fallisce, quelli che ne dipendono non partono (gli altri sì);
+- a fine esecuzione: tabella con esito e durata di ogni stage.
+
+--offline passa PIPELINE_OFFLINE=1 agli script (replay dalla cache raw_cache).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+load_dotenv()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WORKERS = 3
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS pipeline_runs (
+        stage TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        duration_seconds DOUBLE PRECISION,
+        finished_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    command: tuple                  # argv, relativo a cwd
+    cwd: str = ROOT
+    deps: tuple = ()
+    inputs: tuple = ()              # TableChecksum o query sui dati letti; vuoto = sempre eseguito
+    sources: tuple = ()             # file di codice nel fingerprint (default: lo script lanciato)
+
+
+@dataclass
+class StageResult:
+    name: str
+    status: str                     # ok | skipped | failed | blocked
+    seconds: float = 0.0
+    detail: str = ""
+    fingerprint: str | None = field(default=None, repr=False)
+
+
+# --- Fingerprint degli input ---------------------------------------------------
+
+@dataclass(frozen=True)
+class TableChecksum:
+    """Checksum di tutte le righe di una tabella, limitato alle colonne lette dagli stage.
+
+    Su PostgreSQL è un md5(string_agg(...)) calcolato dal server (una riga di
+    risultato); sugli altri dialetti (SQLite nei test) le righe vengono lette in
+    ordine di chiave e accumulate nell'hash lato client.
+    """
+    table: str
+    columns: tuple
+    order_by: tuple
+
+    def query(self, dialect: str) -> str:
+        columns, order = ", ".join(self.columns), ", ".join(self.order_by)
+        if dialect == "postgresql":
+            return (f"SELECT count(*), md5(string_agg(CAST(ROW({columns}) AS TEXT), ',' ORDER BY {order})) "
+                    f"FROM {self.table}")
+        return f"SELECT {columns} FROM {self.table} ORDER BY {order}"
+
+
+# fair_value escluso: colonna legacy, nessuno stage la legge (le valutazioni stanno
+# in player_season_valuations); resta solo per migrate_add_fair_value.py
+STATS_CHECKSUM = TableChecksum(
+    "player_stats_v2",
+    ("player_id", "match_id", "team_id", "minutes", "goals", "assists", "shots", "shots_on_target", "npxg", "xa"),
+    ("player_id", "match_id"),
+)
+MATCHES_CHECKSUM = TableChecksum(
+    "matches", ("match_id", "date", "season", "home_team_id", "away_team_id"), ("match_id",)
+)
+TEAM_CHECKSUM = TableChecksum(
+    "team_performance",
+    ("team_id", "match_date", "season", "elo", "rolling_xg_form", "rolling_ga_form"),
+    ("team_id", "match_date", "season"),
+)
+ROLES_CHECKSUM = TableChecksum("player_roles", ("player_id", "season", "cluster_id", "role"), ("player_id", "season"))
+PLAYERS_CHECKSUM = TableChecksum("players", ("player_id", "name", "birth_date"), ("player_id",))
+PENDING_AGES_FINGERPRINT = """
+    SELECT count(*), COALESCE(sum(p.player_id), 0)
+    FROM players p
+    LEFT JOIN player_age_lookups l ON l.player_id = p.player_id
+    WHERE p.birth_date IS NULL AND (l.player_id IS NULL OR l.next_attempt <= now())
+"""
+
+STAGES = (
+    Stage("etl_live", (sys.executable, "data-processing/etl_live.py"),
+          sources=("data-processing/etl_live.py", "data-processing/bulk_load.py")),
+    Stage("team_context", (sys.executable, "data-processing/etl_teams_context.py"),
+          sources=("data-processing/etl_teams_context.py", "data-processing/team_context_engine.py")),
+    Stage("fetch_ages", (sys.executable, "backend/fetch_ages.py"),
+          deps=("etl_live",), inputs=(PENDING_AGES_FINGERPRINT,)),
+    Stage("role_clustering", (sys.executable, "role_clustering.py"), cwd=os.path.join(ROOT, "backend"),
+          deps=("etl_live",), inputs=(STATS_CHECKSUM, MATCHES_CHECKSUM, PLAYERS_CHECKSUM),
+          sources=("backend/role_clustering.py", "backend/scouting_service.py")),
+    Stage("valuation", (sys.executable, "backend/valuation_engine_v3.py", "--bootstrap", "1000"),
+          deps=("role_clustering", "team_context", "fetch_ages"),
+          inputs=(STATS_CHECKSUM, MATCHES_CHECKSUM, PLAYERS_CHECKSUM, TEAM_CHECKSUM, ROLES_CHECKSUM),
+          sources=("backend/valuation_engine_v3.py", "backend/valuation_bootstrap.py", "backend/valuation_state.py",
+                   "backend/team_keys.py", "backend/row_checksum.py")),
+    Stage("context_metrics", (sys.executable, "backend/context_metrics.py", "--season", "2025"),
+          deps=("etl_live", "team_context"), inputs=(STATS_CHECKSUM, MATCHES_CHECKSUM, PLAYERS_CHECKSUM, TEAM_CHECKSUM)),
+)
+
+
+def get_engine():
+    db_password = urllib.parse.quote_plus(os.getenv('DB_PASSWORD') or '')
+    return create_engine(f"postgresql://{os.getenv('DB_USER')}:{db_password}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT') or '5432'}/{os.getenv('DB_NAME')}")
+
+
+def stage_fingerprint(engine, stage: Stage) -> str | None:
+    """Hash di comando + codice + risultati delle query di input (None = da eseguire sempre)."""
+    if not stage.inputs:
+        return None
+    digest = hashlib.sha256(json.dumps([os.path.basename(stage.command[0]), *stage.command[1:]]).encode("utf-8"))
+    for source in stage.sources or (os.path.relpath(os.path.join(stage.cwd, stage.command[1]), ROOT),):
+        try:
+            with open(os.path.join(ROOT, source), "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(b"<missing>")
+    try:
+        with engine.connect() as conn:
+            for spec in stage.inputs:
+                query = spec.query(engine.dialect.name) if isinstance(spec, TableChecksum) else spec
+                digest.update(query.encode("utf-8"))
+                for row in conn.execute(text(query)):  # Riga per riga: nessun fetchall
+                    digest.update(repr(tuple(row)).encode("utf-8"))
+    except Exception as e:  # Tabella non ancora creata ecc.: si esegue lo stage
+        print(f"   ⚠️ [{stage.name}] fingerprint non disponibile ({type(e).__name__}): eseguo lo stage")
+        return None
+    return digest.hexdigest()
+
+
+def ensure_schema(engine):
+    with engine.begin() as conn:
+        for ddl in SCHEMA_SQL:
+            conn.execute(text(ddl))
+
+
+def load_fingerprints(engine) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT stage, fingerprint FROM pipeline_runs")).fetchall())
+
+
+def save_fingerprint(engine, name: str, fingerprint: str, seconds: float):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO pipeline_runs (stage, fingerprint, duration_seconds, finished_at)
+                VALUES (:stage, :fp, :secs, CURRENT_TIMESTAMP)
+                ON CONFLICT (stage) DO UPDATE SET
+                    fingerprint = EXCLUDED.fingerprint,
+                    duration_seconds = EXCLUDED.duration_seconds,
+                    finished_at = EXCLUDED.finished_at
+            """),
+            {"stage": name, "fp": fingerprint, "secs": seconds}
+        )
+
+
+# --- Scheduler -----------------------------------------------------------------
+
+def validate(stages) -> list:
+    """Ordine topologico degli stage; ValueError per dipendenze ignote o cicli."""
+    by_name = {s.name: s for s in stages}
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Ciclo nelle dipendenze: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in by_name[name].deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{name}' dipende da '{dep}', che non esiste")
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s.name, [])
+    return order
+
+
+_print_lock = threading.Lock()
+
+
+def _log(name: str, line: str):
+    with _print_lock:
+        print(f"[{name}] {line}", flush=True)
+
+
+def run_stage(stage: Stage, env: dict) -> tuple[int, float]:
+    """Esegue lo stage e inoltra l'output riga per riga con il prefisso del nome."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        list(stage.command), cwd=stage.cwd, env=env, text=True, bufsize=1,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    for line in process.stdout:
+        _log(stage.name, line.rstrip())
+    return process.wait(), time.perf_counter() - start
+
+
+def run_pipeline(stages=STAGES, engine=None, workers: int = DEFAULT_WORKERS, force: bool = False,
+                 only=None, dry_run: bool = False, offline: bool = False) -> list:
+    """Esegue il DAG; restituisce uno StageResult per stage, nell'ordine topologico."""
+    order = validate(stages)
+    if only:
+        unknown = set(only) - {s.name for s in order}
+        if unknown:
+            raise ValueError(f"Stage sconosciuti: {', '.join(sorted(unknown))}")
+        # Le dipendenze fuori selezione sono considerate già soddisfatte
+        order = [replace(s, deps=tuple(d for d in s.deps if d in only)) for s in order if s.name in only]
+
+    if dry_run:
+        for s in order:
+            print(f"   • {s.name:<16} dipende da: {', '.join(s.deps) or '-'}")
+        return [StageResult(s.name, "planned") for s in order]
+
+    engine = engine if engine is not None else get_engine()
+    ensure_schema(engine)
+    previous = {} if force else load_fingerprints(engine)
+
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    if offline:
+        env["PIPELINE_OFFLINE"] = "1"
+
+    results = {}
+    pending = {s.name: s for s in order}
+    running = {}
+
+    def launch(stage):
+        fingerprint = stage_fingerprint(engine, stage)
+        if fingerprint is not None and previous.get(stage.name) == fingerprint:
+            return StageResult(stage.name, "skipped", detail="input invariati", fingerprint=fingerprint)
+        _log(stage.name, "▶️ avvio")
+        code, seconds = run_stage(stage, env)
+        if code != 0:
+            return StageResult(stage.name, "failed", seconds, detail=f"exit code {code}")
+        # Fingerprint a fine stage: include le modifiche che lo stage fa ai propri input
+        fingerprint = stage_fingerprint(engine, stage)
+        if fingerprint is not None:
+            save_fingerprint(engine, stage.name, fingerprint, seconds)
+        return StageResult(stage.name, "ok", seconds, fingerprint=fingerprint)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                dep_status = [results[d].status if d in results else None for d in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    failed = [d for d in stage.deps if results.get(d) and results[d].status in ("failed", "blocked")]
+                    results[name] = StageResult(name, "blocked", detail=f"dipendenze fallite: {', '.join(failed)}")
+                    del pending[name]
+                elif all(s in ("ok", "skipped") for s in dep_status):
+                    running[pool.submit(launch, stage)] = name
+                    del pending[name]
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = StageResult(name, "failed", detail=f"{type(e).__name__}: {e}")
+
+    return [results[s.name] for s in order]
+
+
+def print_summary(results: list, elapsed: float):
+    icons = {"ok": "✅", "skipped": "⏭️", "failed": "❌", "blocked": "⛔", "planned": "•"}
+    print("\n" + "=" * 60)
+    print(f"{'Stage':<18}{'Esito':<12}{'Durata':>10}  Note")
+    print("-" * 60)
+    for r in results:
+        print(f"{r.name:<18}{icons.get(r.status, '')} {r.status:<9}{r.seconds:>9.1f}s  {r.detail}")
+    print("-" * 60)
+    print(f"{'Totale (wall clock)':<30}{elapsed:>9.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline settimanale (DAG di stage)")
+    parser.add_argument("--only", nargs="+", metavar="STAGE", help="Esegue solo questi stage")
+    parser.add_argument("--force", action="store_true", help="Ignora i fingerprint ed esegue tutti gli stage")
+    parser.add_argument("--offline", action="store_true", help="Solo snapshot in cache (PIPELINE_OFFLINE=1)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Stage in parallelo")
+    parser.add_argument("--dry-run", action="store_true", help="Mostra il piano senza eseguire nulla")
+    args = parser.parse_args()
+
+    print(f"🚀 Pipeline: {len(STAGES)} stage, fino a {args.workers} in parallelo")
+    start = time.perf_counter()
+    results = run_pipeline(workers=args.workers, force=args.force, only=args.only,
+                           dry_run=args.dry_run, offline=args.offline)
+    print_summary(results, time.perf_counter() - start)
+    sys.exit(1 if any(r.status in ("failed", "blocked") for r in results) else 0)
@@ -0,0 +1,173 @@
+"""
+Raw Cache - Cache locale dei download grezzi + replay offline
+=============================================================
+Cache condivisa da tutti gli script che scaricano da Understat (soccerdata) o
+football-data.co.uk:
+
+- content-addressed: ogni payload è salvato una sola volta in
+  objects/<sha256 del contenuto>; refs/<sha256 della chiave>.json punta al
+  payload corrente con timestamp, ETag e Last-Modified;
+- TTL per sorgente: entro il TTL nessuna richiesta di rete; scaduto il TTL gli
+  URL vengono riconvalidati con una GET condizionale (304 = payload invariato);
+- se la rete fallisce si riusa l'ultimo snapshot (anche scaduto);
+- modalità offline (--offline o PIPELINE_OFFLINE=1): solo snapshot locali,
+  errore esplicito se un payload manca. Permette di rieseguire la pipeline in
+  modo deterministico senza rete.
+
+I DataFrame di soccerdata sono salvati come pickle del frame restituito
+(soccerdata non espone il payload HTTP grezzo).
+
+Il backend (league_simulator) lo importa con data-processing nel PYTHONPATH;
+RAW_CACHE_DIR fissa la directory condivisa (in CI è salvata tra le esecuzioni).
+"""
+
+import hashlib
+import io
+import json
+import os
+import time
+
+import pandas as pd
+import requests
+
+CACHE_DIR = os.getenv(
+    "RAW_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".raw_cache")
+)
+DEFAULT_TTL_SECONDS = 6 * 3600
+REQUEST_TIMEOUT_SECONDS = 30
+
+_offline = os.getenv("PIPELINE_OFFLINE", "").strip().lower() in ("1", "true", "yes")
+
+
+class CacheMiss(RuntimeError):
+    """Payload richiesto in modalità offline ma assente dalla cache locale."""
+
+
+def set_offline(enabled: bool = True):
+    """Attiva il replay offline per il processo corrente (e i sottoprocessi)."""
+    global _offline
+    _offline = enabled
+    os.environ["PIPELINE_OFFLINE"] = "1" if enabled else "0"
+
+
+def is_offline() -> bool:
+    return _offline
+
+
+def _key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _ref_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, "refs", f"{_key_hash(key)}.json")
+
+
+def _object_path(digest: str) -> str:
+    return os.path.join(CACHE_DIR, "objects", digest[:2], digest)
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _load_ref(key: str) -> dict | None:
+    try:
+        with open(_ref_path(key), encoding="utf-8") as f:
+            ref = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return ref if os.path.exists(_object_path(ref["sha256"])) else None
+
+
+def _read_object(ref: dict) -> bytes:
+    with open(_object_path(ref["sha256"]), "rb") as f:
+        return f.read()
+
+
+def _store(key: str, payload: bytes, **meta) -> dict:
+    digest = hashlib.sha256(payload).hexdigest()
+    if not os.path.exists(_object_path(digest)):
+        _write_atomic(_object_path(digest), payload)
+    ref = {"key": key, "sha256": digest, "size": len(payload), "fetched_at": time.time(), **meta}
+    _write_atomic(_ref_path(key), json.dumps(ref).encode("utf-8"))
+    return ref
+
+
+def _touch(key: str, ref: dict):
+    ref = {**ref, "fetched_at": time.time()}
+    _write_atomic(_ref_path(key), json.dumps(ref).encode("utf-8"))
+
+
+def _fresh(ref: dict | None, ttl: float) -> bool:
+    return ref is not None and time.time() - ref["fetched_at"] < ttl
+
+
+def fetch_url(url: str, ttl: float = DEFAULT_TTL_SECONDS, session=None) -> bytes:
+    """Contenuto di `url` dalla cache se fresco, altrimenti GET condizionale."""
+    ref = _load_ref(url)
+    if _offline:
+        if ref is None:
+            raise CacheMiss(f"Offline: nessuno snapshot per {url}")
+        return _read_object(ref)
+    if _fresh(ref, ttl):
+        return _read_object(ref)
+
+    headers = {}
+    if ref is not None:
+        if ref.get("etag"):
+            headers["If-None-Match"] = ref["etag"]
+        if ref.get("last_modified"):
+            headers["If-Modified-Since"] = ref["last_modified"]
+    try:
+        response = (session or requests).get(url, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
+        if response.status_code == 304 and ref is not None:
+            _touch(url, ref)
+            return _read_object(ref)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if ref is None:
+            raise
+        print(f"   ⚠️ Download fallito ({e}): uso lo snapshot del {time.ctime(ref['fetched_at'])}")
+        return _read_object(ref)
+
+    _store(url, response.content, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+    return response.content
+
+
+def cached_frame(key: str, loader, ttl: float = DEFAULT_TTL_SECONDS) -> pd.DataFrame:
+    """DataFrame restituito da `loader()` (es. una read_* di soccerdata), in cache per `key`."""
+    ref = _load_ref(key)
+    if _offline:
+        if ref is None:
+            raise CacheMiss(f"Offline: nessuno snapshot per {key}")
+        return pd.read_pickle(io.BytesIO(_read_object(ref)))
+    if _fresh(ref, ttl):
+        return pd.read_pickle(io.BytesIO(_read_object(ref)))
+
+    try:
+        frame = loader()
+    except Exception as e:
+        if ref is None:
+            raise
+        print(f"   ⚠️ Download fallito ({e}): uso lo snapshot del {time.ctime(ref['fetched_at'])}")
+        return pd.read_pickle(io.BytesIO(_read_object(ref)))
+
+    buffer = io.BytesIO()
+    frame.to_pickle(buffer)
+    _store(key, buffer.getvalue())
+    return frame
+
+
+def understat_frame(method: str, season: str, league: str = "ITA-Serie A", ttl: float = DEFAULT_TTL_SECONDS) -> pd.DataFrame:
+    """Tabella soccerdata.Understat (es. read_player_match_stats, read_schedule) via cache."""
+    def load():
+        import soccerdata as sd  # Solo se serve davvero scaricare
+
+        scraper = sd.Understat(leagues=[league], seasons=season)
+        return getattr(scraper, method)()
+
+    return cached_frame(f"understat:{league}:{season}:{method}", load, ttl)
@@ -0,0 +1,204 @@
+"""
+Team Context Engine - ELO e forma incrementali
+==============================================
+Motore di calcolo per team_performance (usato da etl_teams_context.py), senza DB:
+
+- stato per squadra: ELO a piena precisione, data dell'ultima partita e due
+  ring buffer (deque con maxlen = FORM_WINDOW) con gol fatti e subiti;
+- process_matches: modalità incrementale, applica in ordine solo le partite
+  nuove a partire dallo stato salvato;
+- rebuild: ricostruzione completa vettoriale. Le partite vengono divise in
+  "onde" in cui ogni squadra compare al massimo una volta (l'ELO di una squadra
+  dipende solo dalle sue partite precedenti), e ogni onda è aggiornata con numpy;
+  la forma è una somma a finestra sui gol per squadra.
+
+Le due modalità producono numeri identici: stesse operazioni float nello stesso
+ordine per ogni squadra (verificato in test_team_context_engine.py).
+
+Forma: football-data.co.uk non ha xG, quindi rolling_xg_form è la media dei gol
+fatti nelle ultime FORM_WINDOW partite (proxy) e rolling_ga_form quella dei gol
+subiti; entrambe includono la partita della riga, come l'ELO post-partita.
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+ELO_K_FACTOR = 32
+ELO_INITIAL = 1500
+HOME_ADVANTAGE = 100
+FORM_WINDOW = 5
+
+RESULT_POINTS = {'H': 1.0, 'D': 0.5, 'A': 0.0}
+RECORD_COLUMNS = ['team_id', 'match_date', 'season', 'elo', 'rolling_xg_form', 'rolling_ga_form']
+
+
+@dataclass
+class TeamState:
+    elo: float = float(ELO_INITIAL)
+    last_match_date: pd.Timestamp | None = None
+    matches_played: int = 0
+    goals_for: deque = field(default_factory=lambda: deque(maxlen=FORM_WINDOW))
+    goals_against: deque = field(default_factory=lambda: deque(maxlen=FORM_WINDOW))
+
+
+def _window_mean(buffer) -> float:
+    total = 0.0
+    for value in buffer:  # Dal più vecchio al più recente
+        total += value
+    return total / len(buffer)
+
+
+def finalize_records(records: pd.DataFrame) -> pd.DataFrame:
+    """Arrotondamenti di team_performance (comuni alle due modalità)."""
+    out = records[RECORD_COLUMNS].copy()
+    out['elo'] = out['elo'].round(2)
+    out['rolling_xg_form'] = out['rolling_xg_form'].round(3)
+    out['rolling_ga_form'] = out['rolling_ga_form'].round(3)
+    return out.reset_index(drop=True)
+
+
+def process_matches(state: dict, matches: pd.DataFrame) -> pd.DataFrame:
+    """Applica in ordine le partite (già preparate) allo stato, che viene aggiornato in place."""
+    records = []
+    for m in matches.itertuples(index=False):
+        home = state.setdefault(m.home, TeamState())
+        away = state.setdefault(m.away, TeamState())
+
+        diff = (home.elo + HOME_ADVANTAGE) - away.elo
+        exp_home = 1 / (1 + 10 ** (-diff / 400))
+        home.elo = home.elo + ELO_K_FACTOR * (m.result - exp_home)
+        away.elo = away.elo + ELO_K_FACTOR * ((1 - m.result) - (1 - exp_home))
+
+        for team, team_id, scored, conceded in ((home, m.home, m.home_goals, m.away_goals),
+                                                (away, m.away, m.away_goals, m.home_goals)):
+            team.goals_for.append(float(scored))
+            team.goals_against.append(float(conceded))
+            team.last_match_date = m.match_date
+            team.matches_played += 1
+            records.append((team_id, m.match_date, m.season, team.elo,
+                            _window_mean(team.goals_for), _window_mean(team.goals_against)))
+
+    return finalize_records(pd.DataFrame(records, columns=RECORD_COLUMNS))
+
+
+def _waves(home_idx: np.ndarray, away_idx: np.ndarray, n_teams: int) -> np.ndarray:
+    """Onda di ogni partita: 1 + l'onda dell'ultima partita di una delle due squadre."""
+    last = np.zeros(n_teams, dtype=np.int64)
+    waves = np.empty(len(home_idx), dtype=np.int64)
+    for i, (h, a) in enumerate(zip(home_idx.tolist(), away_idx.tolist())):
+        w = max(last[h], last[a]) + 1
+        waves[i] = w
+        last[h] = last[a] = w
+    return waves
+
+
+def _rolling_window_mean(values: np.ndarray, team_idx: np.ndarray) -> np.ndarray:
+    """Media delle ultime FORM_WINDOW righe della stessa squadra (riga corrente inclusa)."""
+    frame = pd.DataFrame({'team': team_idx, 'value': values})
+    grouped = frame.groupby('team', sort=False)['value']
+    total = np.zeros(len(values))
+    count = np.zeros(len(values))
+    for lag in range(FORM_WINDOW - 1, -1, -1):  # Stesso ordine di somma del ring buffer
+        shifted = grouped.shift(lag).to_numpy()
+        present = ~np.isnan(shifted)
+        total = total + np.where(present, shifted, 0.0)
+        count = count + present
+    return total / count
+
+
+def rebuild(matches: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
+    """Ricostruzione completa vettoriale: (righe team_performance, stato finale per squadra)."""
+    if matches.empty:
+        return finalize_records(pd.DataFrame(columns=RECORD_COLUMNS)), {}
+
+    teams, codes = np.unique(np.concatenate([matches['home'].to_numpy(), matches['away'].to_numpy()]), return_inverse=True)
+    n = len(matches)
+    home_idx, away_idx = codes[:n], codes[n:]
+    result = matches['result'].to_numpy(dtype=np.float64)
+
+    # ELO: onde di partite indipendenti aggiornate con numpy
+    elo = np.full(len(teams), float(ELO_INITIAL))
+    home_elo = np.empty(n)
+    away_elo = np.empty(n)
+    waves = _waves(home_idx, away_idx, len(teams))
+    order = np.argsort(waves, kind='stable')
+    bounds = np.flatnonzero(np.diff(waves[order])) + 1
+    for wave in np.split(order, bounds):
+        h, a, r = home_idx[wave], away_idx[wave], result[wave]
+        diff = (elo[h] + HOME_ADVANTAGE) - elo[a]
+        exp_home = 1 / (1 + 10 ** (-diff / 400))
+        new_home = elo[h] + ELO_K_FACTOR * (r - exp_home)
+        new_away = elo[a] + ELO_K_FACTOR * ((1 - r) - (1 - exp_home))
+        elo[h], elo[a] = new_home, new_away
+        home_elo[wave], away_elo[wave] = new_home, new_away
+
+    # Righe per squadra nello stesso ordine della modalità incrementale (casa, poi trasferta)
+    long_team = np.column_stack([home_idx, away_idx]).ravel()
+    goals_for = np.column_stack([matches['home_goals'], matches['away_goals']]).astype(np.float64).ravel()
+    goals_against = np.column_stack([matches['away_goals'], matches['home_goals']]).astype(np.float64).ravel()
+    records = pd.DataFrame({
+        'team_id': teams[long_team],
+        'match_date': np.repeat(matches['match_date'].to_numpy(), 2),
+        'season': np.repeat(matches['season'].to_numpy(), 2),
+        'elo': np.column_stack([home_elo, away_elo]).ravel(),
+        'rolling_xg_form': _rolling_window_mean(goals_for, long_team),
+        'rolling_ga_form': _rolling_window_mean(goals_against, long_team),
+    })
+
+    # Stato finale: ELO, ultime FORM_WINDOW partite, contatori
+    state = {}
+    per_team = pd.DataFrame({'team': long_team, 'gf': goals_for, 'ga': goals_against, 'date': records['match_date']})
+    for t, group in per_team.groupby('team', sort=False):
+        tail = group.tail(FORM_WINDOW)
+        state[teams[t]] = TeamState(
+            elo=float(elo[t]),
+            last_match_date=group['date'].iloc[-1],
+            matches_played=len(group),
+            goals_for=deque(tail['gf'].tolist(), maxlen=FORM_WINDOW),
+            goals_against=deque(tail['ga'].tolist(), maxlen=FORM_WINDOW),
+        )
+    return finalize_records(records), state
+
+
+def new_matches(state: dict, matches: pd.DataFrame) -> tuple[pd.DataFrame, bool]:
+    """Partite successive all'ultima partita di entrambe le squadre.
+
+    Restituisce anche un flag se serve un rebuild: partite con data non successiva
+    per una sola delle due squadre, oppure partite anteriori per entrambe ma mai
+    integrate (es. un recupero pubblicato in ritardo). Queste ultime si vedono dalle
+    presenze: per ogni squadra, le partite non nuove devono essere esattamente
+    matches_played.
+    """
+    if not state or matches.empty:
+        return matches, False
+    last = {team: s.last_match_date for team, s in state.items()}
+    never = pd.Timestamp.min
+    home_last = matches['home'].map(last).fillna(never)
+    away_last = matches['away'].map(last).fillna(never)
+    after_home = matches['match_date'] > home_last
+    after_away = matches['match_date'] > away_last
+
+    integrated = ~(after_home | after_away)
+    appearances = pd.concat([matches.loc[integrated, 'home'], matches.loc[integrated, 'away']]).value_counts()
+    played = pd.Series({team: s.matches_played for team, s in state.items()})
+    missing = (appearances.reindex(played.index, fill_value=0) != played).any()
+    return matches[after_home & after_away], bool((after_home ^ after_away).any() or missing)
+
+
+def prepare_matches(raw: pd.DataFrame, normalize_team_name) -> pd.DataFrame:
+    """Righe football-data (Date, HomeTeam, AwayTeam, FTR, FTHG, FTAG, season_code) in ordine di data."""
+    df = raw.dropna(subset=['Date', 'HomeTeam', 'AwayTeam', 'FTR'])
+    df = df[df['FTR'].isin(list(RESULT_POINTS))]
+    out = pd.DataFrame({
+        'match_date': pd.to_datetime(df['Date'], dayfirst=True),
+        'season': df['season_code'].astype(str),
+        'home': df['HomeTeam'].map(normalize_team_name),
+        'away': df['AwayTeam'].map(normalize_team_name),
+        'home_goals': pd.to_numeric(df['FTHG'], errors='coerce').fillna(0),
+        'away_goals': pd.to_numeric(df['FTAG'], errors='coerce').fillna(0),
+        'result': df['FTR'].map(RESULT_POINTS),
+    })
+    return out.sort_values('match_date', kind='mergesort').reset_index(drop=True)
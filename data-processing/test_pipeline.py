@@ -0,0 +1,141 @@
+"""
+Test pipeline
+=============
+DAG di stage fittizi (sottoprocessi python) con i fingerprint su SQLite:
+verifica parallelismo degli stage indipendenti, skip con input invariati,
+riesecuzione quando i dati cambiano, blocco dei dipendenti di uno stage
+fallito e validazione del DAG.
+
+Nessun DB PostgreSQL richiesto:
+    cd data-processing && python test_pipeline.py
+    cd data-processing && pytest test_pipeline.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import pipeline
+from pipeline import Stage
+
+
+def _sleep_stage(name, seconds, deps=(), inputs=(), code=0):
+    script = f"import time; time.sleep({seconds}); print('{name} fatto'); raise SystemExit({code})"
+    return Stage(name, (sys.executable, "-c", script), deps=deps, inputs=inputs, sources=(__file__,))
+
+
+def _engine(tmp):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, 'pipeline.db')}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)"))
+        conn.execute(text("INSERT INTO items (value) VALUES (1), (2)"))
+    return engine
+
+
+def test_parallel_stages_and_fingerprint_skip():
+    items = "SELECT count(*), sum(value) FROM items"
+    stages = (
+        _sleep_stage("a", 0.4, inputs=(items,)),
+        _sleep_stage("b", 0.4, inputs=(items,)),
+        _sleep_stage("c", 0.0, deps=("a", "b"), inputs=(items,)),
+        _sleep_stage("external", 0.0),  # Nessun input dichiarato: sempre eseguito
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(tmp)
+
+        start = time.perf_counter()
+        first = pipeline.run_pipeline(stages, engine, workers=3)
+        assert time.perf_counter() - start < 0.75  # a e b in parallelo
+        assert [r.status for r in first] == ["ok", "ok", "ok", "ok"]
+
+        second = {r.name: r.status for r in pipeline.run_pipeline(stages, engine, workers=3)}
+        assert second == {"a": "skipped", "b": "skipped", "c": "skipped", "external": "ok"}
+
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE items SET value = 5 WHERE id = 1"))
+        third = {r.name: r.status for r in pipeline.run_pipeline(stages, engine, workers=3)}
+        assert third == {"a": "ok", "b": "ok", "c": "ok", "external": "ok"}
+
+        forced = pipeline.run_pipeline(stages, engine, workers=3, force=True, only=["c"])
+        assert [(r.name, r.status) for r in forced] == [("c", "ok")]
+
+
+def test_checksum_sees_every_read_column():
+    stages = (
+        _sleep_stage("role_clustering", 0.0, inputs=(pipeline.STATS_CHECKSUM,)),
+        _sleep_stage("valuation", 0.0, deps=("role_clustering",),
+                     inputs=(pipeline.STATS_CHECKSUM, pipeline.ROLES_CHECKSUM)),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(tmp)
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE player_stats_v2 (player_id INTEGER, match_id INTEGER, team_id TEXT, minutes INTEGER,
+                    goals INTEGER, assists INTEGER, shots INTEGER, shots_on_target INTEGER,
+                    npxg REAL, xa REAL, fair_value REAL)
+            """))
+            conn.execute(text("""
+                INSERT INTO player_stats_v2 VALUES
+                    (1, 10, 'Inter', 90, 1, 0, 4, 2, 0.61, 0.10, 0.0),
+                    (2, 10, 'Genoa', 75, 0, 1, 1, 0, 0.05, 0.32, 0.0)
+            """))
+            conn.execute(text("CREATE TABLE player_roles (player_id INTEGER, season TEXT, cluster_id INTEGER, role TEXT)"))
+            conn.execute(text("INSERT INTO player_roles VALUES (1, '2025', 0, 'Striker'), (2, '2025', 1, 'Playmaker')"))
+
+        def statuses():
+            return {r.name: r.status for r in pipeline.run_pipeline(stages, engine)}
+
+        assert statuses() == {"role_clustering": "ok", "valuation": "ok"}
+        assert statuses() == {"role_clustering": "skipped", "valuation": "skipped"}
+
+        with engine.begin() as conn:  # Colonna non aggregata (correzione tardiva via upsert)
+            conn.execute(text("UPDATE player_stats_v2 SET shots = 5 WHERE player_id = 1"))
+        assert statuses() == {"role_clustering": "ok", "valuation": "ok"}
+
+        with engine.begin() as conn:  # Stessi cluster, etichetta diversa
+            conn.execute(text("UPDATE player_roles SET role = 'Target Man' WHERE player_id = 1"))
+        assert statuses() == {"role_clustering": "skipped", "valuation": "ok"}
+
+        with engine.begin() as conn:  # fair_value è un output: non invalida nulla
+            conn.execute(text("UPDATE player_stats_v2 SET fair_value = 42.0"))
+        assert statuses() == {"role_clustering": "skipped", "valuation": "skipped"}
+
+
+def test_failed_stage_blocks_dependents():
+    stages = (
+        _sleep_stage("ingest", 0.0, code=3),
+        _sleep_stage("context", 0.0),
+        _sleep_stage("model", 0.0, deps=("ingest", "context")),
+        _sleep_stage("report", 0.0, deps=("model",)),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {r.name: r for r in pipeline.run_pipeline(stages, _engine(tmp))}
+    assert results["ingest"].status == "failed" and results["ingest"].detail == "exit code 3"
+    assert results["context"].status == "ok"
+    assert results["model"].status == "blocked"
+    assert results["report"].status == "blocked"
+
+
+def test_validate_rejects_cycles_and_unknown_deps():
+    for stages in [
+        (_sleep_stage("a", 0, deps=("b",)), _sleep_stage("b", 0, deps=("a",))),
+        (_sleep_stage("a", 0, deps=("missing",)),),
+    ]:
+        try:
+            pipeline.validate(stages)
+            raise AssertionError("ValueError attesa")
+        except ValueError:
+            pass
+    order = [s.name for s in pipeline.validate(pipeline.STAGES)]
+    assert order.index("valuation") > max(order.index(d) for d in ("role_clustering", "team_context", "fetch_ages"))
+
+
+if __name__ == "__main__":
+    test_parallel_stages_and_fingerprint_skip()
+    test_checksum_sees_every_read_column()
+    test_failed_stage_blocks_dependents()
+    test_validate_rejects_cycles_and_unknown_deps()
+    print("✓ pipeline OK")
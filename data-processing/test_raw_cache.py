@@ -0,0 +1,109 @@
+"""
+Test raw_cache
+==============
+Server HTTP locale con ETag: verifica TTL, GET condizionale (304), fallback
+sullo snapshot se la rete cade, replay offline e cache dei DataFrame.
+
+Nessuna rete esterna richiesta:
+    cd data-processing && python test_raw_cache.py
+    cd data-processing && pytest test_raw_cache.py
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import raw_cache
+
+
+class _Handler(BaseHTTPRequestHandler):
+    body = b"Date,HomeTeam,AwayTeam,FTR\n18/08/2024,Inter,Genoa,D\n"
+    requests_seen = []
+
+    def do_GET(self):
+        etag = '"' + hashlib.sha256(self.body).hexdigest()[:16] + '"'
+        conditional = self.headers.get("If-None-Match") == etag
+        self.requests_seen.append("304" if conditional else "200")
+        if conditional:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/I1.csv"
+
+
+def test_fetch_url_ttl_revalidation_and_offline():
+    server, url = _serve()
+    _Handler.requests_seen = []
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_cache.CACHE_DIR = tmp
+        try:
+            assert raw_cache.fetch_url(url) == _Handler.body
+            assert raw_cache.fetch_url(url) == _Handler.body       # Entro il TTL: nessuna richiesta
+            assert _Handler.requests_seen == ["200"]
+
+            assert raw_cache.fetch_url(url, ttl=0) == _Handler.body  # Scaduto: GET condizionale
+            assert _Handler.requests_seen == ["200", "304"]
+
+            _Handler.body = _Handler.body + b"25/08/2024,Genoa,Inter,A\n"
+            assert raw_cache.fetch_url(url, ttl=0) == _Handler.body  # Payload cambiato: nuovo oggetto
+            objects = [f for _, _, files in os.walk(os.path.join(tmp, "objects")) for f in files]
+            assert len(objects) == 2
+
+            server.shutdown()
+            server.server_close()
+            assert raw_cache.fetch_url(url, ttl=0) == _Handler.body  # Rete giù: ultimo snapshot
+
+            raw_cache.set_offline(True)
+            assert raw_cache.fetch_url(url, ttl=0) == _Handler.body
+            try:
+                raw_cache.fetch_url(url + "?missing")
+                raise AssertionError("CacheMiss attesa")
+            except raw_cache.CacheMiss:
+                pass
+        finally:
+            raw_cache.set_offline(False)
+
+
+def test_cached_frame_roundtrip():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return pd.DataFrame({"player": ["A", "B"], "minutes": [90, 45]})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_cache.CACHE_DIR = tmp
+        first = raw_cache.cached_frame("understat:test", loader)
+        second = raw_cache.cached_frame("understat:test", loader)
+        pd.testing.assert_frame_equal(first, second)
+        assert len(calls) == 1
+
+        raw_cache.set_offline(True)
+        try:
+            pd.testing.assert_frame_equal(raw_cache.cached_frame("understat:test", loader, ttl=0), first)
+            assert len(calls) == 1
+        finally:
+            raw_cache.set_offline(False)
+
+
+if __name__ == "__main__":
+    test_fetch_url_ttl_revalidation_and_offline()
+    test_cached_frame_roundtrip()
+    print("✓ raw_cache OK")
@@ -0,0 +1,120 @@
+"""
+Test team_context_engine
+========================
+La ricostruzione vettoriale (rebuild) e la modalità incrementale
+(process_matches a blocchi, ripartendo dallo stato) devono produrre numeri
+identici, e l'ELO deve coincidere con il loop storico di etl_teams_context.
+
+Dati sintetici, nessun DB richiesto:
+    cd data-processing && python test_team_context_engine.py
+    cd data-processing && pytest test_team_context_engine.py
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+import team_context_engine as engine
+
+TEAMS = [f"Team {i}" for i in range(20)]
+
+
+def synthetic_fixtures(n_seasons: int = 3, seed: int = 8) -> pd.DataFrame:
+    """Calendari a girone doppio (una partita per squadra per giornata) in formato football-data."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for s in range(n_seasons):
+        start = pd.Timestamp(f"{2022 + s}-08-20")
+        teams = list(rng.permutation(TEAMS))
+        for rnd in range(38):
+            rotation = teams[:1] + teams[1:][rnd % 19:] + teams[1:][:rnd % 19]
+            for i in range(10):
+                home, away = rotation[i], rotation[19 - i]
+                if rnd >= 19:
+                    home, away = away, home
+                hg, ag = rng.poisson(1.5), rng.poisson(1.1)
+                rows.append({
+                    "Date": (start + pd.Timedelta(days=7 * rnd + int(rng.integers(0, 3)))).strftime("%d/%m/%Y"),
+                    "HomeTeam": home, "AwayTeam": away, "FTHG": hg, "FTAG": ag,
+                    "FTR": "H" if hg > ag else ("D" if hg == ag else "A"),
+                    "season_code": f"{22 + s}{23 + s}",
+                })
+    return pd.DataFrame(rows)
+
+
+def reference_elo(matches: pd.DataFrame) -> list:
+    """Loop ELO storico di update_team_context (senza arrotondamenti)."""
+    team_elo, out = {}, []
+    for row in matches.itertuples(index=False):
+        team_elo.setdefault(row.home, engine.ELO_INITIAL)
+        team_elo.setdefault(row.away, engine.ELO_INITIAL)
+        diff = (team_elo[row.home] + engine.HOME_ADVANTAGE) - team_elo[row.away]
+        exp_home = 1 / (1 + 10 ** (-diff / 400))
+        team_elo[row.home] = team_elo[row.home] + engine.ELO_K_FACTOR * (row.result - exp_home)
+        team_elo[row.away] = team_elo[row.away] + engine.ELO_K_FACTOR * ((1 - row.result) - (1 - exp_home))
+        out += [round(team_elo[row.home], 2), round(team_elo[row.away], 2)]
+    return out
+
+
+def test_rebuild_matches_incremental_and_reference():
+    matches = engine.prepare_matches(synthetic_fixtures(), lambda name: name.replace(" ", "_"))
+    full, final_state = engine.rebuild(matches)
+
+    assert full["elo"].tolist() == reference_elo(matches)
+
+    state, chunks = {}, []
+    for part in np.array_split(np.arange(len(matches)), 9):
+        todo, out_of_order = engine.new_matches(state, matches)
+        assert not out_of_order
+        todo = todo[todo.index.isin(part)]
+        chunks.append(engine.process_matches(state, todo))
+    incremental = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(incremental, full)
+
+    assert engine.new_matches(state, matches)[0].empty  # Tutto già integrato
+    for team, s in final_state.items():
+        assert s.elo == state[team].elo
+        assert list(s.goals_for) == list(state[team].goals_for)
+        assert s.last_match_date == state[team].last_match_date
+
+
+def test_late_fixture_before_both_teams_last_match_forces_rebuild():
+    matches = engine.prepare_matches(synthetic_fixtures(n_seasons=1), lambda name: name)
+    # Recupero: partita della 5a giornata pubblicata solo a fine stagione
+    late_idx = matches.index[45]
+    late = matches.loc[late_idx]
+    _, state = engine.rebuild(matches.drop(late_idx))
+    assert late["match_date"] < state[late["home"]].last_match_date
+    assert late["match_date"] < state[late["away"]].last_match_date
+
+    todo, out_of_order = engine.new_matches(state, matches)
+    assert todo.empty and out_of_order
+
+    # Stesso download senza la partita in ritardo: nulla da fare, nessun rebuild
+    todo, out_of_order = engine.new_matches(state, matches.drop(late_idx))
+    assert todo.empty and not out_of_order
+
+
+def test_form_is_windowed_mean():
+    matches = engine.prepare_matches(synthetic_fixtures(n_seasons=1), lambda name: name)
+    records, _ = engine.rebuild(matches)
+    team = records[records["team_id"] == "Team 3"].reset_index(drop=True)
+    played = matches[(matches["home"] == "Team 3") | (matches["away"] == "Team 3")]
+    scored = np.where(played["home"] == "Team 3", played["home_goals"], played["away_goals"]).astype(float)
+    expected = pd.Series(scored).rolling(engine.FORM_WINDOW, min_periods=1).mean().round(3)
+    np.testing.assert_allclose(team["rolling_xg_form"], expected, atol=1e-12)
+
+
+if __name__ == "__main__":
+    matches = engine.prepare_matches(synthetic_fixtures(n_seasons=30), lambda name: name)
+    start = time.perf_counter()
+    engine.rebuild(matches)
+    t_rebuild = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.process_matches({}, matches)
+    print(f"⚽ {len(matches):,} partite: rebuild {t_rebuild:.2f}s, incrementale {time.perf_counter() - start:.2f}s")
+    test_rebuild_matches_incremental_and_reference()
+    test_late_fixture_before_both_teams_last_match_forces_rebuild()
+    test_form_is_windowed_mean()
+    print("   ✓ Rebuild e incrementale identici")